@@ -0,0 +1,130 @@
+# archivo.py
+"""
+Archivo de años cerrados. Los movimientos de un año cuyo diciembre ya está
+cerrado (existe el cierre de enero del año siguiente) se mueven de
+`movimientos` a `movimientos_archivo` (mismo esquema, CREATE TABLE ... LIKE)
+y el año queda anotado en `archivo_anyos`.
+
+Los registros de cierre (MoDona = 9999) se quedan en `movimientos`: son el
+punto de partida de los saldos (saldos.py, verificacion.py,
+reconstruir_ledger.py), que así no necesitan leer el archivo. Para que eso
+valga, los años se archivan por orden (lo archivado es siempre el principio
+del libro) y el cierre de un año archivado no se puede eliminar.
+Los resúmenes de meses archivados (resumenes.py) también leen con
+fuente_movimientos, así que se pueden generar después de archivar.
+
+Las lecturas por rango de fechas piden su tabla a fuente_movimientos():
+si el rango no llega a ningún año archivado es `movimientos` sin más; si
+llega, una tabla derivada con las dos partes ya filtradas por sede y fechas.
+"""
+from datetime import timedelta
+from cache import CacheTTL
+from db import asegurar_tabla
+from saldos import como_fecha
+
+DDL_MOVIMIENTOS_ARCHIVO = "CREATE TABLE IF NOT EXISTS movimientos_archivo LIKE movimientos"
+
+DDL_ARCHIVO_ANYOS = """
+CREATE TABLE IF NOT EXISTS archivo_anyos (
+    AaSede INT NOT NULL,
+    AaAnyo SMALLINT NOT NULL,
+    AaMovimientos INT NOT NULL,
+    AaArchivado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (AaSede, AaAnyo)
+)
+"""
+
+# (base de datos, sede) -> frozenset de años archivados
+cache_años_archivados = CacheTTL(ttl_segundos=300, max_items=1024)
+
+
+class ErrorArchivo(ValueError):
+    """El año no se puede archivar"""
+
+
+def asegurar_tablas_archivo(cursor):
+    """movimientos_archivo (mismo esquema que movimientos) y archivo_anyos (años ya archivados por sede)"""
+    asegurar_tabla(cursor, "movimientos_archivo", DDL_MOVIMIENTOS_ARCHIVO)
+    asegurar_tabla(cursor, "archivo_anyos", DDL_ARCHIVO_ANYOS)
+
+
+def años_archivados(cursor, sede):
+    def cargar():
+        cursor.execute("SELECT AaAnyo FROM archivo_anyos WHERE AaSede = %s", (sede,))
+        return frozenset(
+            int(fila['AaAnyo'] if isinstance(fila, dict) else fila[0]) for fila in cursor.fetchall()
+        )
+    return cache_años_archivados.obtener_o_calcular((cursor.connection.db, int(sede)), cargar)
+
+
+def fuente_movimientos(cursor, sede, desde, hasta):
+    """
+    (sql, params) de la tabla a usar en el FROM para leer movimientos de la
+    sede entre `desde` y `hasta` (días incluidos). La consulta que la usa
+    mantiene sus propios filtros; `params` van antes que los suyos.
+    """
+    desde, hasta = como_fecha(desde), como_fecha(hasta)
+    if not any(desde.year <= año <= hasta.year for año in años_archivados(cursor, sede)):
+        return "movimientos", []
+    fin = hasta + timedelta(days=1)
+    sql = """(
+        SELECT * FROM movimientos WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s
+        UNION ALL
+        SELECT * FROM movimientos_archivo WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s
+    )"""
+    return sql, [sede, desde, fin, sede, desde, fin]
+
+
+def archivar_anyo(cursor, sede, año):
+    """
+    Mueve los movimientos (no los cierres) del año al archivo. No hace commit:
+    el INSERT, el DELETE y la anotación van en la transacción del llamador.
+    Los años se archivan de más antiguo a más reciente: así lo archivado es
+    siempre el principio del libro y los saldos (reconstruir_ledger.py,
+    verificacion.py) pueden partir del último cierre archivado.
+    """
+    cursor.execute("""
+    SELECT MoID FROM movimientos
+    WHERE MoSede = %s AND MoDona = 9999 AND MoFecha >= %s AND MoFecha < %s
+    LIMIT 1
+    """, (sede, f"{año + 1}-01-01", f"{año + 1}-02-01"))
+    if not cursor.fetchone():
+        raise ErrorArchivo(f"El año {año} no está cerrado (falta el cierre de diciembre)")
+    cursor.execute("SELECT AaAnyo FROM archivo_anyos WHERE AaSede = %s AND AaAnyo = %s", (sede, año))
+    if cursor.fetchone():
+        raise ErrorArchivo(f"El año {año} ya está archivado")
+    cursor.execute("""
+    SELECT MoFecha FROM movimientos
+    WHERE MoSede = %s AND MoDona != 9999 AND MoFecha < %s
+    ORDER BY MoFecha
+    LIMIT 1
+    """, (sede, f"{año}-01-01"))
+    anterior = cursor.fetchone()
+    if anterior:
+        raise ErrorArchivo(
+            f"Antes hay que archivar el año {como_fecha(anterior['MoFecha']).year} (los años se archivan por orden)"
+        )
+
+    rango = (sede, f"{año}-01-01", f"{año + 1}-01-01")
+    cursor.execute("""
+    INSERT INTO movimientos_archivo
+    SELECT * FROM movimientos
+    WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s AND MoDona != 9999
+    """, rango)
+    archivados = cursor.rowcount
+    cursor.execute("""
+    DELETE FROM movimientos
+    WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s AND MoDona != 9999
+    """, rango)
+    if cursor.rowcount != archivados:
+        raise ErrorArchivo(f"Se copiaron {archivados} movimientos pero se borraron {cursor.rowcount}")
+    cursor.execute(
+        "INSERT INTO archivo_anyos (AaSede, AaAnyo, AaMovimientos) VALUES (%s, %s, %s)",
+        (sede, año, archivados)
+    )
+    return archivados
+
+
+def invalidar_años_archivados(cursor, sede):
+    """Llamar tras el commit del archivado"""
+    cache_años_archivados.invalidar((cursor.connection.db, int(sede)))
@@ -0,0 +1,80 @@
+# bench_respuestas.py
+"""
+Comparativa de serialización de los informes:
+  antes:   jsonable_encoder + json.dumps (lo que hace FastAPI con un dict)
+  ahora:   RespuestaJSON (orjson directo)
+
+Las filas imitan las de /api/reportes/ingresos-gastos y
+/api/reportes/listado-economico-anual (Decimal, date, str).
+Uso:  python bench_respuestas.py [filas] [repeticiones]
+"""
+import json
+import sys
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from respuestas import RespuestaJSON
+
+
+def filas_ingresos_gastos(n):
+    inicio = date(2024, 1, 1)
+    return [{
+        "MoID": 100000 + i,
+        "MoFecha": inicio + timedelta(days=i % 365),
+        "GaNombre": "INGRESOS" if i % 3 else "GASTOS",
+        "Rubro": "DIEZMOS",
+        "Concepto": f"DIEZMO FIEL {i % 400}",
+        "Caja": Decimal("25.50"),
+        "Saldo_Caja": Decimal(i) / 4,
+        "Banco": Decimal("0.00"),
+        "Saldo_Banco": Decimal("15230.75"),
+        "MoSede": 3, "MoTiMo": 100, "MoTGas": 2, "MoRubr": 0,
+        "Sede": "IGLESIA CENTRAL",
+    } for i in range(n)]
+
+
+def filas_listado_anual(n):
+    return [{
+        "IGSede": 3, "IGTiMo": 100 + i % 3 * 100, "IGMoTGas": i, "IGOpNom": f"RUBRO {i}",
+        **{f"IGMes{m:02d}": Decimal("1234.56") for m in range(1, 13)},
+        "IGTotAno": Decimal("14814.72"),
+    } for i in range(n)]
+
+
+def antes(contenido):
+    return JSONResponse(jsonable_encoder(contenido)).body
+
+
+def ahora(contenido):
+    return RespuestaJSON(contenido).body
+
+
+def medir(funcion, contenido, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        cuerpo = funcion(contenido)
+        mejor = min(mejor, time.perf_counter() - t)
+    return mejor, cuerpo
+
+
+def main():
+    filas = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    casos = {
+        "ingresos-gastos": {"success": True, "movimientos": filas_ingresos_gastos(filas)},
+        "listado-economico-anual": {"success": True, "reporte": filas_listado_anual(filas)},
+    }
+    print(f"{'informe':<26}{'filas':>8}{'antes ms':>11}{'ahora ms':>11}{'x':>7}")
+    for nombre, contenido in casos.items():
+        t_antes, cuerpo_antes = medir(antes, contenido, repeticiones)
+        t_ahora, cuerpo_ahora = medir(ahora, contenido, repeticiones)
+        # Mismo JSON (salvo espacios), para no cambiar lo que recibe el frontend
+        assert json.loads(cuerpo_antes) == json.loads(cuerpo_ahora), f"{nombre}: salida distinta"
+        print(f"{nombre:<26}{filas:>8}{t_antes * 1000:>11.1f}{t_ahora * 1000:>11.1f}{t_antes / t_ahora:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
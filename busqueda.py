@@ -0,0 +1,231 @@
+# busqueda.py
+"""
+Búsqueda incremental (typeahead) de fieles y donantes.
+Cada sede tiene en memoria un índice de prefijos por palabra, sin acentos
+ni mayúsculas: "gar jo" encuentra a "JOSÉ GARCÍA". Los índices se cargan
+en la primera búsqueda, se mantienen al día desde crear/actualizar/eliminar
+fiel y se recargan al caducar (por si otro proceso ha escrito).
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from db import conectar_db
+
+# Recarga completa del índice (cambios hechos por otros procesos)
+TTL_INDICE_SEGUNDOS = 600
+LIMITE_RESULTADOS = 20
+LIMITE_MAXIMO = 100
+
+
+def normalizar(texto):
+    """Mayúsculas y sin acentos: 'José Peña' -> 'JOSE PENA'"""
+    descompuesto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(c for c in descompuesto if not unicodedata.combining(c)).upper()
+
+
+def tokens(texto):
+    return [t for t in re.split(r"[^0-9A-Z]+", normalizar(texto)) if t]
+
+
+class IndicePrefijos:
+    """Índice token -> documentos con búsqueda por prefijo sobre la lista ordenada de tokens"""
+
+    def __init__(self):
+        self._documentos = {}       # id -> (orden, exactos, resultado, tokens)
+        self._ids_por_token = {}    # token -> {id}
+        self._tokens_ordenados = []
+        self._lock = threading.Lock()
+
+    def poner(self, id_documento, palabras, exactos, orden, resultado):
+        with self._lock:
+            self._quitar(id_documento)
+            palabras = set(palabras)
+            for token in palabras:
+                ids = self._ids_por_token.get(token)
+                if ids is None:
+                    ids = self._ids_por_token[token] = set()
+                    insort(self._tokens_ordenados, token)
+                ids.add(id_documento)
+            self._documentos[id_documento] = (orden, set(exactos), resultado, palabras)
+
+    def quitar(self, id_documento):
+        with self._lock:
+            self._quitar(id_documento)
+
+    def _quitar(self, id_documento):
+        documento = self._documentos.pop(id_documento, None)
+        if documento is None:
+            return
+        for token in documento[3]:
+            ids = self._ids_por_token[token]
+            ids.discard(id_documento)
+            if not ids:
+                del self._ids_por_token[token]
+                del self._tokens_ordenados[bisect_left(self._tokens_ordenados, token)]
+
+    def _con_prefijo(self, prefijo):
+        ids = set()
+        i = bisect_left(self._tokens_ordenados, prefijo)
+        while i < len(self._tokens_ordenados) and self._tokens_ordenados[i].startswith(prefijo):
+            ids |= self._ids_por_token[self._tokens_ordenados[i]]
+            i += 1
+        return ids
+
+    def buscar(self, consulta, limite=LIMITE_RESULTADOS):
+        """Documentos con un token que empiece por cada palabra de la consulta"""
+        terminos = tokens(consulta)
+        if not terminos:
+            return []
+        with self._lock:
+            candidatos = None
+            for termino in terminos:
+                ids = self._con_prefijo(termino)
+                candidatos = ids if candidatos is None else candidatos & ids
+                if not candidatos:
+                    return []
+            # Primero las coincidencias exactas de código / NIF, luego por orden alfabético
+            exacta = "".join(terminos)
+            mejores = heapq.nsmallest(
+                limite, candidatos,
+                key=lambda id_doc: (exacta not in self._documentos[id_doc][1], self._documentos[id_doc][0])
+            )
+            return [self._documentos[id_doc][2] for id_doc in mejores]
+
+    def __len__(self):
+        return len(self._documentos)
+
+
+class IndicesBusqueda:
+    """Un IndicePrefijos por clave, cargado bajo demanda con `cargar(clave)` y con caducidad"""
+
+    def __init__(self, cargar, documento, ttl_segundos=TTL_INDICE_SEGUNDOS):
+        self._cargar = cargar          # clave -> filas
+        self._documento = documento    # fila -> (id, palabras, exactos, orden, resultado)
+        self.ttl_segundos = ttl_segundos
+        self._indices = {}             # clave -> (cargado_en, IndicePrefijos)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._indices.get(clave)
+        if entrada and time.monotonic() - entrada[0] < self.ttl_segundos:
+            return entrada[1]
+        indice = IndicePrefijos()
+        for fila in self._cargar(clave):
+            indice.poner(*self._documento(fila))
+        print(f"🔎 Índice de búsqueda {clave} cargado: {len(indice)} registros")
+        with self._lock:
+            self._indices[clave] = (time.monotonic(), indice)
+        return indice
+
+    def cargados(self, condicion):
+        """Índices ya en memoria cuya clave cumple `condicion(clave)`"""
+        with self._lock:
+            return [(clave, indice) for clave, (_, indice) in self._indices.items() if condicion(clave)]
+
+    def invalidar(self, clave=None):
+        with self._lock:
+            if clave is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(clave, None)
+
+
+# ================== FIELES (por sede) ==================
+def _cargar_fieles(clave):
+    test_mode, sede = clave
+    conn = conectar_db(test_mode=test_mode)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+            SELECT fiID, fiCod, fiNIF, fiNombres, fiApellidos, fiSede
+            FROM fieles
+            WHERE Situacion = 1 AND fiSede = %s
+            """, (sede,))
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _documento_fiel(fila):
+    nif = normalizar(fila.get('fiNIF'))
+    codigo = str(fila.get('fiCod') or "")
+    palabras = tokens(fila.get('fiNombres')) + tokens(fila.get('fiApellidos')) + tokens(nif) + tokens(codigo)
+    nif_compacto = "".join(tokens(nif))
+    if nif_compacto:
+        palabras.append(nif_compacto)
+    resultado = {
+        "fiID": fila['fiID'],
+        "codigo": fila.get('fiCod'),
+        "nombre": f"{fila.get('fiNombres') or ''} {fila.get('fiApellidos') or ''}".strip(),
+        "fiNIF": fila.get('fiNIF'),
+    }
+    orden = (normalizar(fila.get('fiApellidos')), normalizar(fila.get('fiNombres')), fila['fiID'])
+    return fila['fiID'], palabras, {codigo, nif_compacto} - {""}, orden, resultado
+
+
+indices_fieles = IndicesBusqueda(_cargar_fieles, _documento_fiel)
+
+
+def buscar_fieles(test_mode, sede, consulta, limite=LIMITE_RESULTADOS):
+    return indices_fieles.obtener((test_mode, int(sede))).buscar(consulta, limite)
+
+
+def fiel_guardado(test_mode, fiel_id, datos):
+    """
+    Alta o modificación de un fiel (`datos` = modelo FielCreate/FielUpdate):
+    lo saca de su índice anterior y lo pone en el de su sede.
+    """
+    fiel = {"fiID": fiel_id}
+    for campo in ("fiCod", "fiNIF", "fiNombres", "fiApellidos", "fiSede", "Situacion"):
+        fiel[campo] = getattr(datos, campo, None)
+    for clave, indice in indices_fieles.cargados(lambda clave: clave[0] == test_mode):
+        if clave[1] == int(fiel['fiSede']) and fiel['Situacion'] == 1:
+            indice.poner(*_documento_fiel(fiel))
+        else:
+            indice.quitar(fiel_id)
+
+
+def fiel_eliminado(test_mode, fiel_id):
+    for _, indice in indices_fieles.cargados(lambda clave: clave[0] == test_mode):
+        indice.quitar(fiel_id)
+
+
+# ================== DONANTES (comunes a todas las sedes) ==================
+def _cargar_donantes(clave):
+    test_mode, tipo = clave
+    conn = conectar_db(test_mode=test_mode)
+    try:
+        with conn.cursor() as cursor:
+            query = "SELECT DoID, DoCod, DoNombre, DoTipo FROM donantes"
+            params = ()
+            if tipo is not None:
+                query += " WHERE DoTipo = %s"
+                params = (tipo,)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def _documento_donante(fila):
+    codigo = str(fila.get('DoCod') or "")
+    resultado = {
+        "DoID": fila['DoID'],
+        "codigo": fila.get('DoCod'),
+        "nombre": fila.get('DoNombre'),
+        "tipo": fila.get('DoTipo'),
+    }
+    orden = (normalizar(fila.get('DoNombre')), fila['DoID'])
+    return fila['DoID'], tokens(fila.get('DoNombre')) + tokens(codigo), {codigo} - {""}, orden, resultado
+
+
+# Sin endpoints de escritura de donantes: se refrescan solo por caducidad
+indices_donantes = IndicesBusqueda(_cargar_donantes, _documento_donante, ttl_segundos=300)
+
+
+def buscar_donantes(test_mode, consulta, tipo=None, limite=LIMITE_RESULTADOS):
+    return indices_donantes.obtener((test_mode, tipo)).buscar(consulta, limite)
@@ -0,0 +1,63 @@
+# cache.py
+"""
+Caché en memoria compartida por los endpoints (por proceso).
+Cada entrada caduca a los `ttl_segundos` y, al superar `max_items`,
+se descarta la menos usada recientemente (ttl 0 = sin caducidad).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """Caché LRU con expiración, segura para los hilos del threadpool de FastAPI"""
+
+    def __init__(self, ttl_segundos=300, max_items=1024):
+        self.ttl_segundos = ttl_segundos
+        self.max_items = max_items
+        self._datos = OrderedDict()  # clave -> (expira, valor)
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, por_defecto=None):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return por_defecto
+            expira, valor = entrada
+            if expira is not None and expira < time.monotonic():
+                del self._datos[clave]
+                return por_defecto
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor, ttl_segundos=None):
+        ttl = self.ttl_segundos if ttl_segundos is None else ttl_segundos
+        expira = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_items:
+                self._datos.popitem(last=False)
+
+    def obtener_o_calcular(self, clave, funcion):
+        """Devuelve el valor en caché o lo calcula con `funcion()` y lo guarda"""
+        faltante = object()
+        valor = self.obtener(clave, faltante)
+        if valor is faltante:
+            valor = funcion()
+            self.guardar(clave, valor)
+        return valor
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def invalidar_si(self, condicion):
+        """Elimina todas las entradas cuya clave cumple `condicion(clave)`"""
+        with self._lock:
+            for clave in [c for c in self._datos if condicion(c)]:
+                del self._datos[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
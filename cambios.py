@@ -0,0 +1,207 @@
+# cambios.py
+"""
+Registro de cambios del libro de movimientos para la sincronización por
+deltas del frontend. Cada alta, modificación (incluidos los saldos que
+reescribe un recálculo) o baja deja una fila en `cambios_movimientos`
+dentro de la MISMA transacción que la escritura: si se hace rollback,
+el registro desaparece con ella. Las bajas quedan como "lápidas" (D).
+
+El cliente carga un mes con /movimientos (que devuelve el cursor actual)
+y después pide /cambios-movimientos?desde=<cursor> para recibir solo lo
+que ha cambiado. Como en saldos.py, aquí no se hace commit.
+
+El cursor (CaID, AUTO_INCREMENT) se asigna al insertar, no al hacer commit.
+Para que dos escrituras de la misma sede no se confirmen en orden inverso
+a sus CaID, registrar_cambios bloquea antes la fila de la sede en
+`cambios_turnos` (INSERT ... ON DUPLICATE KEY UPDATE), y el bloqueo dura
+hasta el commit o el rollback: la siguiente escritura de la sede espera y
+recibe un CaID mayor. Así, si una lectura ve un CaID, ve también todos los
+anteriores de la sede, y el cursor es simplemente el último CaID visible.
+Las escrituras llaman a registrar_cambios / registrar_recalculo como ÚLTIMA
+sentencia antes del commit, para que el turno se tenga el menor tiempo posible.
+"""
+import time
+from db import asegurar_tabla, conectar_db
+
+ALTA = "I"
+MODIFICACION = "U"
+BAJA = "D"
+
+# Días que se conservan los cambios; un cliente con un cursor más antiguo debe recargar
+RETENCION_DIAS = 30
+PURGA_CADA_SEGUNDOS = 3600
+LIMITE_CAMBIOS = 500
+
+DDL_CAMBIOS = """
+CREATE TABLE IF NOT EXISTS cambios_movimientos (
+    CaID BIGINT NOT NULL AUTO_INCREMENT,
+    CaSede INT NOT NULL,
+    CaMoID INT NOT NULL,
+    CaOp CHAR(1) NOT NULL,
+    CaFecha DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (CaID),
+    KEY idx_cambios_sede (CaSede, CaID),
+    KEY idx_cambios_fecha (CaFecha)
+)
+"""
+
+# Una fila por sede: su bloqueo ordena los CaID de la sede por commit
+DDL_TURNOS = """
+CREATE TABLE IF NOT EXISTS cambios_turnos (
+    CtSede INT NOT NULL,
+    CtCambios BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (CtSede)
+)
+"""
+
+# Columnas de movimientos que viajan en el feed (las mismas que /movimientos)
+COLUMNAS_FEED = ("MoID", "MoFecha", "MoDesc", "MoCChica", "MoSaldoCaja", "MoImporte", "MoSaldoBanco")
+
+_ultima_purga = {}
+
+
+def asegurar_tabla_cambios(cursor):
+    """cambios_movimientos (el feed) y cambios_turnos (la fila que ordena los CaID de cada sede)"""
+    asegurar_tabla(cursor, "cambios_movimientos", DDL_CAMBIOS)
+    asegurar_tabla(cursor, "cambios_turnos", DDL_TURNOS)
+
+
+def purgar_cambios_antiguos(conn):
+    """
+    Borra los cambios de más de RETENCION_DIAS, como mucho cada
+    PURGA_CADA_SEGUNDOS. Hace su propio commit: no llamar dentro de una
+    escritura del libro.
+    """
+    clave = conn.db
+    ahora = time.monotonic()
+    if clave in _ultima_purga and ahora - _ultima_purga[clave] < PURGA_CADA_SEGUNDOS:
+        return
+    _ultima_purga[clave] = ahora
+    with conn.cursor() as cursor:
+        # Se conserva siempre el último cambio para que MIN(CaID) marque hasta dónde se ha purgado
+        cursor.execute("SELECT MAX(CaID) AS ultimo FROM cambios_movimientos")
+        ultimo = cursor.fetchone()['ultimo']
+        if ultimo is not None:
+            cursor.execute("""
+            DELETE FROM cambios_movimientos
+            WHERE CaFecha < NOW() - INTERVAL %s DAY AND CaID < %s
+            LIMIT 5000
+            """, (RETENCION_DIAS, ultimo))
+    conn.commit()
+
+
+def registrar_cambios(cursor, sede, operacion, ids):
+    """
+    Anota [MoID, ...] con la operación ALTA / MODIFICACION / BAJA en una sola
+    sentencia. Toma antes el turno de la sede (ver arriba), que se libera con
+    el commit: llamar justo antes de él.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return
+    cursor.execute("""
+    INSERT INTO cambios_turnos (CtSede, CtCambios) VALUES (%s, 1)
+    ON DUPLICATE KEY UPDATE CtCambios = CtCambios + 1
+    """, (sede,))
+    sql = (
+        "INSERT INTO cambios_movimientos (CaSede, CaMoID, CaOp) VALUES "
+        + ", ".join(["(%s, %s, %s)"] * len(ids))
+    )
+    cursor.execute(sql, [valor for mo_id in ids for valor in (sede, mo_id, operacion)])
+
+
+def registrar_recalculo(cursor, sede, recalculo, excluir=()):
+    """Anota como modificados los movimientos cuyo saldo ha reescrito recalcular_saldos_desde"""
+    excluir = set(excluir)
+    registrar_cambios(
+        cursor, sede, MODIFICACION,
+        [mo_id for mo_id in recalculo["ids_actualizados"] if mo_id not in excluir]
+    )
+
+
+def ultimo_cambio(cursor, sede):
+    """Cursor actual de la sede (0 si aún no hay cambios)"""
+    cursor.execute("SELECT COALESCE(MAX(CaID), 0) AS ultimo FROM cambios_movimientos WHERE CaSede = %s", (sede,))
+    return int(cursor.fetchone()['ultimo'])
+
+
+def versiones_sedes(cursor, sedes):
+    """ultimo_cambio de varias sedes en una sola consulta: tupla en el orden de `sedes`"""
+    if not sedes:
+        return ()
+    placeholders = ",".join(["%s"] * len(sedes))
+    cursor.execute(f"""
+    SELECT CaSede AS sede, MAX(CaID) AS ultimo FROM cambios_movimientos
+    WHERE CaSede IN ({placeholders}) GROUP BY CaSede
+    """, tuple(sedes))
+    ultimos = {fila['sede']: int(fila['ultimo']) for fila in cursor.fetchall()}
+    return tuple(ultimos.get(sede, 0) for sede in sedes)
+
+
+def version_sede(test_mode, sede):
+    """
+    ultimo_cambio con su propia conexión, para validar cachés del proceso:
+    cambia con cualquier escritura confirmada de la sede que pase por
+    registrar_cambios, la haga este proceso, otro worker o reconstruir_ledger.py.
+    No ve el SQL escrito a mano (no deja cambios).
+    """
+    conn = conectar_db(test_mode=test_mode)
+    try:
+        with conn.cursor() as cursor:
+            asegurar_tabla_cambios(cursor)
+            return ultimo_cambio(cursor, sede)
+    finally:
+        conn.close()
+
+
+def leer_cambios(cursor, sede, desde, limite=LIMITE_CAMBIOS):
+    """
+    Cambios de la sede posteriores al cursor `desde`, uno por movimiento
+    (el más reciente) y en orden de cursor. Altas y modificaciones llevan
+    la fila actual; las bajas solo el MoID.
+    `reiniciar` indica que el cursor ya no es válido (purgado o de otra
+    base de datos) y el cliente debe recargar con /movimientos.
+    """
+    cursor.execute("SELECT MIN(CaID) AS primero, MAX(CaID) AS ultimo FROM cambios_movimientos")
+    rango = cursor.fetchone()
+    primero, ultimo = rango['primero'], rango['ultimo']
+    if desde and (ultimo is None or desde > ultimo or desde < primero - 1):
+        return {"cambios": [], "cursor": ultimo_cambio(cursor, sede), "hay_mas": False, "reiniciar": True}
+
+    columnas = ", ".join(f"m.{columna}" for columna in COLUMNAS_FEED)
+    cursor.execute(f"""
+    SELECT c.CaID, c.CaMoID, c.CaOp, {columnas}
+    FROM (
+        SELECT CaMoID, MAX(CaID) AS CaUltimo
+        FROM cambios_movimientos
+        WHERE CaSede = %s AND CaID > %s
+        GROUP BY CaMoID
+        ORDER BY CaUltimo
+        LIMIT %s
+    ) u
+    JOIN cambios_movimientos c ON c.CaID = u.CaUltimo
+    LEFT JOIN movimientos m ON m.MoID = c.CaMoID
+    ORDER BY c.CaID
+    """, (sede, desde, limite + 1))
+    filas = cursor.fetchall()
+
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+    cambios = []
+    for fila in filas:
+        # Sin fila en movimientos (borrada después, o archivada) se trata como baja
+        if fila['CaOp'] == BAJA or fila['MoID'] is None:
+            cambios.append({"cursor": fila['CaID'], "MoID": fila['CaMoID'], "operacion": BAJA, "movimiento": None})
+        else:
+            cambios.append({
+                "cursor": fila['CaID'],
+                "MoID": fila['CaMoID'],
+                "operacion": fila['CaOp'],
+                "movimiento": {columna: fila[columna] for columna in COLUMNAS_FEED}
+            })
+
+    if hay_mas:
+        nuevo_cursor = filas[-1]['CaID']
+    else:
+        nuevo_cursor = max(ultimo_cambio(cursor, sede), desde)
+    return {"cambios": cambios, "cursor": nuevo_cursor, "hay_mas": hay_mas, "reiniciar": False}
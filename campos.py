@@ -0,0 +1,68 @@
+# campos.py
+"""
+Proyección de columnas (?fields=a,b,c) para los endpoints que hacían
+SELECT *. Solo se aceptan columnas de la lista permitida de cada tabla,
+así el nombre puede ir directamente en el SQL sin riesgo de inyección.
+Sin `fields` se mantiene el SELECT * de siempre.
+"""
+from typing import Optional
+from fastapi import HTTPException, Query
+
+COLUMNAS_PERMITIDAS = {
+    "locales": (
+        "LoID", "LoCod", "LoNombre", "LoPasAdm", "LoCalle", "LoCP", "LoCiudad",
+        "LoProvincia", "LoPais", "LoTelefono", "LoSituacion",
+    ),
+    "fieles": (
+        "fiID", "fiSede", "fiCod", "fiNIF", "fiNombres", "fiApellidos", "fiNacidoEn",
+        "fiFecNacido", "fiDiezmo", "fiDirec1", "fiDirec2", "fiPostal", "fiCiudad",
+        "fiTelefono", "fieMail", "fiDesde", "fiPasaporte", "fiNacionalidad",
+        "fiEstadoCivil", "fiComentario", "Situacion",
+    ),
+}
+
+# Nombre en minúsculas -> nombre canónico (MySQL no distingue mayúsculas en columnas)
+_CANONICAS = {
+    tabla: {columna.lower(): columna for columna in columnas}
+    for tabla, columnas in COLUMNAS_PERMITIDAS.items()
+}
+
+
+def columnas_select(tabla, fields):
+    """Lista de columnas para el SELECT a partir de `fields` ('*' si no se indica)"""
+    if not fields or not fields.strip():
+        return "*"
+    canonicas = _CANONICAS[tabla]
+    pedidas, no_permitidas = [], []
+    for nombre in fields.split(","):
+        nombre = nombre.strip()
+        if not nombre:
+            continue
+        columna = canonicas.get(nombre.lower())
+        if columna is None:
+            no_permitidas.append(nombre)
+        elif columna not in pedidas:
+            pedidas.append(columna)
+    if no_permitidas:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no permitidos en {tabla}: {', '.join(no_permitidas)}"
+        )
+    return ", ".join(pedidas) if pedidas else "*"
+
+
+def campos(tabla):
+    """Dependencia que valida ?fields= contra la tabla y devuelve las columnas del SELECT"""
+    def dependencia(
+        fields: Optional[str] = Query(None, description=f"Columnas de {tabla} separadas por comas")
+    ):
+        return columnas_select(tabla, fields)
+    return dependencia
+
+
+def con_columnas(columnas, obligatorias):
+    """Añade a la proyección las columnas que el endpoint necesita (p.ej. la clave de orden)"""
+    if columnas == "*":
+        return columnas
+    lista = columnas.split(", ")
+    return ", ".join(lista + [columna for columna in obligatorias if columna not in lista])
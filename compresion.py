@@ -0,0 +1,200 @@
+# compresion.py
+"""
+Middleware ASGI que comprime las respuestas de la API (gzip, o brotli si
+está instalado y el cliente lo acepta).
+- Solo comprime tipos de la lista permitida y cuerpos por encima del umbral.
+- Las respuestas en varios trozos (StreamingResponse) se comprimen sobre la
+  marcha, vaciando el compresor cada ~16 KB, sin esperar al final del informe.
+- No toca respuestas que ya traen Content-Encoding (estáticos precomprimidos).
+- Acumula por ruta los bytes originales y enviados para ver el ahorro.
+"""
+import threading
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+from estaticos import brotli, elegir_codificacion
+
+UMBRAL_BYTES = 1024
+NIVEL_GZIP = 6
+# Calidad de brotli para respuestas dinámicas (11 es demasiado lento por petición)
+CALIDAD_BROTLI = 5
+TIPOS_COMPRIMIBLES = ("application/json", "text/csv", "text/plain", "text/html")
+# En streaming se vacía el compresor cada vez que acumula esta entrada
+# (vaciar en cada trozo pequeño arruina la compresión)
+VACIAR_CADA_BYTES = 16 * 1024
+
+
+class _Compresor:
+    """Compresión incremental con vaciado periódico para el streaming"""
+
+    def __init__(self):
+        self._pendiente = 0
+
+    def comprimir(self, datos):
+        salida = self._procesar(datos)
+        self._pendiente += len(datos)
+        if self._pendiente >= VACIAR_CADA_BYTES:
+            self._pendiente = 0
+            salida += self._vaciar()
+        return salida
+
+
+class _Gzip(_Compresor):
+    def __init__(self, nivel):
+        super().__init__()
+        self._compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def _procesar(self, datos):
+        return self._compresor.compress(datos)
+
+    def _vaciar(self):
+        return self._compresor.flush(zlib.Z_SYNC_FLUSH)
+
+    def terminar(self, datos=b""):
+        return self._compresor.compress(datos) + self._compresor.flush()
+
+
+class _Brotli(_Compresor):
+    def __init__(self, calidad):
+        super().__init__()
+        self._compresor = brotli.Compressor(quality=calidad)
+
+    def _procesar(self, datos):
+        return self._compresor.process(datos)
+
+    def _vaciar(self):
+        return self._compresor.flush()
+
+    def terminar(self, datos=b""):
+        return self._compresor.process(datos) + self._compresor.finish()
+
+
+class MetricasCompresion:
+    """Bytes originales / enviados por ruta (plantilla, p.ej. /fieles/{sede_id})"""
+
+    def __init__(self):
+        self._rutas = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, ruta, original, enviado):
+        with self._lock:
+            datos = self._rutas.setdefault(ruta, {"respuestas": 0, "bytes_originales": 0, "bytes_enviados": 0})
+            datos["respuestas"] += 1
+            datos["bytes_originales"] += original
+            datos["bytes_enviados"] += enviado
+
+    def resumen(self):
+        with self._lock:
+            filas = [{"ruta": ruta, **datos} for ruta, datos in self._rutas.items()]
+        for fila in filas:
+            fila["bytes_ahorrados"] = fila["bytes_originales"] - fila["bytes_enviados"]
+            fila["ratio"] = round(fila["bytes_enviados"] / fila["bytes_originales"], 3) if fila["bytes_originales"] else None
+        filas.sort(key=lambda fila: fila["bytes_ahorrados"], reverse=True)
+        return filas
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas.clear()
+
+
+metricas_compresion = MetricasCompresion()
+
+
+class CompresionMiddleware:
+    def __init__(self, app, umbral_bytes=UMBRAL_BYTES, nivel=NIVEL_GZIP, calidad_brotli=CALIDAD_BROTLI,
+                 tipos=TIPOS_COMPRIMIBLES, metricas=metricas_compresion):
+        self.app = app
+        self.umbral_bytes = umbral_bytes
+        self.nivel = nivel
+        self.calidad_brotli = calidad_brotli
+        self.tipos = tuple(tipos)
+        self.metricas = metricas
+        self.disponibles = {"gzip", "br"} if brotli is not None else {"gzip"}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        codificacion = elegir_codificacion(Headers(scope=scope).get("accept-encoding"), self.disponibles)
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+        await _RespuestaComprimida(self, scope, codificacion, send).ejecutar(receive)
+
+
+class _RespuestaComprimida:
+    """Estado de una respuesta: decide al ver la cabecera y el primer trozo del cuerpo"""
+
+    def __init__(self, middleware, scope, codificacion, send):
+        self.middleware = middleware
+        self.scope = scope
+        self.codificacion = codificacion
+        self.send = send
+        self.inicio = None
+        self.compresor = None
+        self.directa = False
+        self.original = 0
+        self.enviado = 0
+
+    async def ejecutar(self, receive):
+        await self.middleware.app(self.scope, receive, self.enviar)
+
+    def _nuevo_compresor(self):
+        if self.codificacion == "br":
+            return _Brotli(self.middleware.calidad_brotli)
+        return _Gzip(self.middleware.nivel)
+
+    def _comprimible(self, cabeceras):
+        if "content-encoding" in cabeceras:
+            return False
+        tipo = cabeceras.get("content-type", "").split(";")[0].strip().lower()
+        return tipo.startswith(self.middleware.tipos)
+
+    async def enviar(self, mensaje):
+        if mensaje["type"] == "http.response.start":
+            self.inicio = mensaje
+            self.directa = not self._comprimible(Headers(raw=mensaje["headers"]))
+            if self.directa:
+                await self.send(mensaje)
+            return
+
+        if mensaje["type"] != "http.response.body" or self.directa:
+            await self.send(mensaje)
+            return
+
+        cuerpo = mensaje.get("body", b"")
+        mas = mensaje.get("more_body", False)
+        self.original += len(cuerpo)
+
+        if self.compresor is None:
+            if not mas and len(cuerpo) < self.middleware.umbral_bytes:
+                # Respuesta pequeña y completa: no compensa comprimir
+                self.directa = True
+                await self.send(self.inicio)
+                await self.send(mensaje)
+                return
+            self.compresor = self._nuevo_compresor()
+            cabeceras = MutableHeaders(raw=self.inicio["headers"])
+            cabeceras["content-encoding"] = self.codificacion
+            cabeceras.add_vary_header("Accept-Encoding")
+            if mas:
+                # En streaming el tamaño final no se conoce
+                del cabeceras["content-length"]
+                datos = self.compresor.comprimir(cuerpo)
+            else:
+                datos = self.compresor.terminar(cuerpo)
+                cabeceras["content-length"] = str(len(datos))
+            await self.send(self.inicio)
+        else:
+            datos = self.compresor.comprimir(cuerpo) if mas else self.compresor.terminar(cuerpo)
+
+        self.enviado += len(datos)
+        if mas and not datos:
+            return
+        await self.send({"type": "http.response.body", "body": datos, "more_body": mas})
+        if not mas:
+            self._registrar()
+
+    def _registrar(self):
+        ruta = self.scope.get("route")
+        ruta = getattr(ruta, "path", None) or "(sin ruta)"
+        self.middleware.metricas.registrar(ruta, self.original, self.enviado)
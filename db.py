@@ -32,4 +32,59 @@ def conectar_db(test_mode=False):
         database=db_name,
         port=DB_PORT,
         cursorclass=pymysql.cursors.DictCursor
-    )
\ No newline at end of file
+    )
+
+# Tablas auxiliares ya comprobadas en este proceso: {(base_de_datos, tabla)}
+_tablas_aseguradas = set()
+
+def asegurar_tabla(cursor, nombre, ddl):
+    """
+    Ejecuta el CREATE TABLE IF NOT EXISTS de una tabla auxiliar una sola vez
+    por proceso y base de datos.
+
+    En MySQL el DDL hace commit implícito de la transacción en curso. Si la
+    primera llamada del proceso llegara a mitad de una escritura, confirmaría
+    lo hecho hasta ahí y un rollback posterior ya no lo desharía. Por eso los
+    asegurar_* de cada módulo, que acaban aquí, se llaman al abrir la
+    conexión, ANTES de la primera escritura.
+    """
+    clave = (cursor.connection.db, nombre)
+    if clave in _tablas_aseguradas:
+        return
+    cursor.execute(ddl)
+    _tablas_aseguradas.add(clave)
+
+# Índices ya comprobados en este proceso: {(base_de_datos, tabla, columnas)}
+_indices_asegurados = set()
+
+def asegurar_indice(cursor, tabla, nombre, columnas):
+    """
+    Crea el índice `nombre` sobre `columnas` si la tabla no tiene ya uno que
+    empiece por esas columnas. Una comprobación por proceso y base de datos;
+    igual que asegurar_tabla, llamar ANTES de empezar a escribir.
+    Construir un índice en una tabla grande bloquea y requiere permiso ALTER:
+    usar solo en migraciones y herramientas fuera de línea, nunca en una petición.
+    """
+    clave = (cursor.connection.db, tabla, tuple(columnas))
+    if clave in _indices_asegurados:
+        return
+    cursor.execute("""
+    SELECT GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS columnas
+    FROM information_schema.statistics
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    GROUP BY INDEX_NAME
+    """, (tabla,))
+    buscado = ",".join(columnas).lower()
+    existentes = [
+        str(fila['columnas'] if isinstance(fila, dict) else fila[0]).lower()
+        for fila in cursor.fetchall()
+    ]
+    if not any(existente == buscado or existente.startswith(buscado + ",") for existente in existentes):
+        print(f"🔧 Creando índice {nombre} en {tabla} ({', '.join(columnas)})")
+        try:
+            cursor.execute(f"CREATE INDEX {nombre} ON {tabla} ({', '.join(columnas)})")
+        except pymysql.err.OperationalError as e:
+            # 1061 Duplicate key name: otro proceso lo ha creado entre la comprobación y el CREATE
+            if e.args[0] != 1061:
+                raise
+    _indices_asegurados.add(clave)
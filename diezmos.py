@@ -0,0 +1,186 @@
+# diezmos.py
+"""
+Totales anuales de diezmos por persona, mantenidos al grabar.
+`diezmos_anuales` guarda (sede, año, MoPers) -> total y número de
+movimientos. Grabar (uno o en lote), editar y eliminar movimientos ajustan
+las filas afectadas con ajustar_diezmos() en su misma transacción, así que
+el informe de diezmos por persona lee unas pocas filas por clave primaria
+en vez de agrupar todos los movimientos del año.
+
+Las sedes cuyo total se ha calculado desde cero quedan anotadas en
+`diezmos_anuales_sedes`. El cálculo (reconstruir_diezmos) lo hace el
+trabajo /trabajos/reconstruir-diezmos, la primera vez y siempre que los
+movimientos se hayan tocado fuera de la API; el informe solo lee, y
+mientras la sede no esté calculada agrupa los movimientos del año como
+antes. Archivar un año no cambia nada: la reconstrucción lee también
+movimientos_archivo.
+"""
+from collections import defaultdict
+import pymysql
+from archivo import asegurar_tablas_archivo, fuente_movimientos
+from busqueda import normalizar
+from cache import CacheTTL
+from db import asegurar_tabla
+from resumenes import TIPO_INGRESO, CONCEPTO_DIEZMO
+from saldos import como_fecha
+
+DDL_DIEZMOS_ANUALES = """
+CREATE TABLE IF NOT EXISTS diezmos_anuales (
+    DaSede INT NOT NULL,
+    DaAnyo SMALLINT NOT NULL,
+    DaPers INT NOT NULL,
+    DaTotal DECIMAL(14,2) NOT NULL,
+    DaMovimientos INT NOT NULL,
+    PRIMARY KEY (DaSede, DaAnyo, DaPers)
+)
+"""
+
+DDL_DIEZMOS_ANUALES_SEDES = """
+CREATE TABLE IF NOT EXISTS diezmos_anuales_sedes (
+    DsSede INT NOT NULL,
+    DsConstruido DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (DsSede)
+)
+"""
+
+# (base de datos, sede) -> {fiCod: "NOMBRES APELLIDOS"}
+cache_nombres_fieles = CacheTTL(ttl_segundos=600, max_items=1024)
+
+
+def asegurar_tablas_diezmos(cursor):
+    """diezmos_anuales (total por persona y año) y diezmos_anuales_sedes (sedes ya reconstruidas)"""
+    asegurar_tabla(cursor, "diezmos_anuales", DDL_DIEZMOS_ANUALES)
+    asegurar_tabla(cursor, "diezmos_anuales_sedes", DDL_DIEZMOS_ANUALES_SEDES)
+    # reconstruir_diezmos lee también los años archivados
+    asegurar_tablas_archivo(cursor)
+
+
+def es_diezmo(fila):
+    return (int(fila['MoTiMo'] or 0) == TIPO_INGRESO and int(fila['MoTGas'] or 0) == CONCEPTO_DIEZMO
+            and int(fila['MoPers'] or 0) > 0)
+
+
+def ajustar_diezmos(cursor, altas=(), bajas=()):
+    """
+    Suma las `altas` y resta las `bajas` (dicts con MoSede, MoFecha, MoTiMo,
+    MoTGas, MoPers, MoImporte y MoCChica) de los totales anuales. Una edición
+    es la baja de la fila original más el alta de la nueva. No hace commit.
+    """
+    ajustes = defaultdict(lambda: [0.0, 0])
+    for signo, filas in ((1, altas), (-1, bajas)):
+        for fila in filas:
+            if not es_diezmo(fila):
+                continue
+            clave = (int(fila['MoSede']), como_fecha(fila['MoFecha']).year, int(fila['MoPers']))
+            ajustes[clave][0] += signo * (float(fila['MoImporte'] or 0) + float(fila['MoCChica'] or 0))
+            ajustes[clave][1] += signo
+    ajustes = {clave: valor for clave, valor in ajustes.items() if round(valor[0], 2) or valor[1]}
+    if not ajustes:
+        return 0
+
+    valores = []
+    for (sede, año, pers), (total, movimientos) in sorted(ajustes.items()):
+        valores.extend((sede, año, pers, round(total, 2), movimientos))
+    cursor.execute(f"""
+    INSERT INTO diezmos_anuales (DaSede, DaAnyo, DaPers, DaTotal, DaMovimientos)
+    VALUES {", ".join(["(%s, %s, %s, %s, %s)"] * len(ajustes))}
+    ON DUPLICATE KEY UPDATE
+        DaTotal = DaTotal + VALUES(DaTotal),
+        DaMovimientos = DaMovimientos + VALUES(DaMovimientos)
+    """, valores)
+
+    # Una persona sin movimientos en el año deja de salir en el informe
+    claves = [clave for clave, (_, movimientos) in ajustes.items() if movimientos < 0]
+    if claves:
+        cursor.execute(f"""
+        DELETE FROM diezmos_anuales
+        WHERE DaMovimientos <= 0 AND (DaSede, DaAnyo, DaPers) IN ({", ".join(["(%s, %s, %s)"] * len(claves))})
+        """, [valor for clave in claves for valor in clave])
+    return len(ajustes)
+
+
+def reconstruir_diezmos(cursor, sede):
+    """Recalcula desde cero todos los años de la sede. No hace commit"""
+    cursor.execute("DELETE FROM diezmos_anuales WHERE DaSede = %s", (sede,))
+    cursor.execute("""
+    INSERT INTO diezmos_anuales (DaSede, DaAnyo, DaPers, DaTotal, DaMovimientos)
+    SELECT MoSede, YEAR(MoFecha), MoPers, COALESCE(SUM(MoImporte + MoCChica), 0), COUNT(*)
+    FROM (
+        SELECT MoSede, MoFecha, MoPers, MoImporte, MoCChica FROM movimientos
+        WHERE MoSede = %s AND MoTiMo = %s AND MoTGas = %s AND MoPers > 0
+        UNION ALL
+        SELECT MoSede, MoFecha, MoPers, MoImporte, MoCChica FROM movimientos_archivo
+        WHERE MoSede = %s AND MoTiMo = %s AND MoTGas = %s AND MoPers > 0
+    ) m
+    GROUP BY MoSede, YEAR(MoFecha), MoPers
+    """, (sede, TIPO_INGRESO, CONCEPTO_DIEZMO, sede, TIPO_INGRESO, CONCEPTO_DIEZMO))
+    filas = cursor.rowcount
+    cursor.execute("REPLACE INTO diezmos_anuales_sedes (DsSede) VALUES (%s)", (sede,))
+    return filas
+
+
+def diezmos_construidos(cursor, sede):
+    """Sin crear las tablas: si aún no existen la sede no está calculada"""
+    try:
+        cursor.execute("SELECT DsSede FROM diezmos_anuales_sedes WHERE DsSede = %s", (sede,))
+    except pymysql.err.ProgrammingError as e:
+        # 1146 Table doesn't exist
+        if e.args[0] != 1146:
+            raise
+        return False
+    return cursor.fetchone() is not None
+
+
+def nombres_fieles(cursor, sede):
+    """{fiCod: nombre completo} de los fieles de la sede (también los dados de baja)"""
+    def cargar():
+        cursor.execute("""
+        SELECT fiCod, CONCAT_WS(' ', fiNombres, fiApellidos) AS nombre
+        FROM fieles
+        WHERE fiSede = %s
+        """, (sede,))
+        return {
+            int(fila['fiCod']): fila['nombre'] for fila in cursor.fetchall()
+            if str(fila['fiCod'] or "").strip().isdigit()
+        }
+    return cache_nombres_fieles.obtener_o_calcular((cursor.connection.db, int(sede)), cargar)
+
+
+def invalidar_nombres_fieles(cursor):
+    """Llamar tras crear o modificar un fiel (puede haber cambiado de sede)"""
+    db = cursor.connection.db
+    cache_nombres_fieles.invalidar_si(lambda clave: clave[0] == db)
+
+
+def diezmos_por_persona(cursor, sede, año):
+    """
+    Filas Codigo / Nombres / Total del año, ordenadas por nombre. Solo lee:
+    llamar a asegurar_tablas_archivo antes (como el resto de informes).
+    """
+    if diezmos_construidos(cursor, sede):
+        cursor.execute("""
+        SELECT DaPers, DaTotal FROM diezmos_anuales
+        WHERE DaSede = %s AND DaAnyo = %s
+        """, (sede, año))
+    else:
+        print(f"⚠️ Diezmos de la sede {sede} sin calcular: se agrupan los movimientos (ejecutar /trabajos/reconstruir-diezmos)")
+        tabla, params_tabla = fuente_movimientos(cursor, sede, f"{año}-01-01", f"{año}-12-31")
+        cursor.execute(f"""
+        SELECT MoPers AS DaPers, COALESCE(SUM(MoImporte + MoCChica), 0) AS DaTotal
+        FROM {tabla} m
+        WHERE MoSede = %s AND MoTiMo = %s AND MoTGas = %s AND MoPers > 0
+        AND MoFecha >= %s AND MoFecha < %s
+        GROUP BY MoPers
+        """, (*params_tabla, sede, TIPO_INGRESO, CONCEPTO_DIEZMO, f"{año}-01-01", f"{año + 1}-01-01"))
+    totales = cursor.fetchall()
+    nombres = nombres_fieles(cursor, sede) if totales else {}
+    filas = []
+    for fila in totales:
+        pers = int(fila['DaPers'])
+        filas.append({
+            "Codigo": pers if pers in nombres else None,
+            "Nombres": nombres.get(pers) or "",
+            "Total": fila['DaTotal'],
+        })
+    filas.sort(key=lambda fila: (normalizar(fila["Nombres"]), fila["Codigo"] or 0))
+    return filas
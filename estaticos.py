@@ -0,0 +1,177 @@
+# estaticos.py
+"""
+Servicio de los archivos del frontend compilado (carpeta static).
+- Los JS/CSS/HTML/SVG se comprimen en gzip (y brotli si está instalado)
+  una sola vez al arrancar y se sirven desde memoria según Accept-Encoding.
+- Los archivos con hash de contenido en el nombre (index-DI5bPACY.js)
+  llevan Cache-Control immutable: el navegador no vuelve a pedirlos.
+- El resto (index.html, logos, favicons) se revalidan con ETag /
+  If-None-Match y responden 304 si no han cambiado.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:  # Sin brotli se sirve solo gzip
+    brotli = None
+
+# Nombres generados por Vite: <nombre>-<hash de 8 caracteres>.<ext>
+PATRON_HASH = re.compile(r"-[A-Za-z0-9_]{8}\.[A-Za-z0-9]+$")
+EXTENSIONES_COMPRIMIBLES = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".map", ".txt", ".ico"}
+# Por debajo de este tamaño la compresión no compensa
+TAMAÑO_MINIMO_COMPRESION = 1024
+NIVEL_GZIP = 9
+CALIDAD_BROTLI = 11
+
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDAR = "no-cache"
+
+# Archivos ya preparados (los mounts /assets y /static comparten carpeta):
+# (ruta real, mtime, tamaño) -> datos
+_preparados = {}
+
+
+def es_nombre_con_hash(nombre):
+    return bool(PATRON_HASH.search(nombre))
+
+
+def elegir_codificacion(accept_encoding, disponibles):
+    """
+    Codificación preferida por el cliente entre las disponibles ("br", "gzip"),
+    respetando los valores q. None = sin comprimir.
+    """
+    preferencias = {}
+    for parte in (accept_encoding or "").split(","):
+        trozos = parte.strip().split(";")
+        nombre = trozos[0].strip().lower()
+        if not nombre:
+            continue
+        calidad = 1.0
+        for parametro in trozos[1:]:
+            clave, _, valor = parametro.strip().partition("=")
+            if clave.strip() == "q":
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        preferencias[nombre] = calidad
+
+    mejor, mejor_calidad = None, 0.0
+    for codificacion in ("br", "gzip"):  # br primero: gana en caso de empate
+        if codificacion not in disponibles:
+            continue
+        calidad = preferencias.get(codificacion, preferencias.get("*", 0.0))
+        if calidad > mejor_calidad:
+            mejor, mejor_calidad = codificacion, calidad
+    return mejor
+
+
+def _etags_de_peticion(if_none_match):
+    return {etiqueta.strip().removeprefix("W/") for etiqueta in if_none_match.split(",")}
+
+
+class ArchivosEstaticos(StaticFiles):
+    """StaticFiles con variantes precomprimidas, ETag por contenido y cabeceras de caché"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # ruta relativa normalizada -> datos del archivo (ver _preparar_archivo)
+        self._archivos = {}
+
+    def precomprimir(self):
+        """Recorre la carpeta y prepara ETag y variantes comprimidas de cada archivo"""
+        archivos = {}
+        original = comprimido = 0
+        for raiz, _, nombres in os.walk(self.directory):
+            for nombre in nombres:
+                if nombre.endswith((".gz", ".br")):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                estado = os.stat(ruta)
+                clave_archivo = (os.path.realpath(ruta), estado.st_mtime_ns, estado.st_size)
+                datos = _preparados.get(clave_archivo)
+                if datos is None:
+                    datos = _preparados[clave_archivo] = self._preparar_archivo(ruta)
+                clave = os.path.normpath(os.path.relpath(ruta, self.directory))
+                archivos[clave] = datos
+                if datos["variantes"]:
+                    original += datos["tamaño"]
+                    comprimido += min(len(v) for v in datos["variantes"].values())
+        self._archivos = archivos
+        print(f"🗜️ Estáticos en {self.directory}: {len(archivos)} archivos, "
+              f"comprimibles {original // 1024} KB -> {comprimido // 1024} KB"
+              f"{'' if brotli else ' (brotli no instalado, solo gzip)'}")
+
+    def _preparar_archivo(self, ruta):
+        with open(ruta, "rb") as f:
+            contenido = f.read()
+        nombre = os.path.basename(ruta)
+        extension = os.path.splitext(nombre)[1].lower()
+        con_hash = es_nombre_con_hash(nombre)
+
+        variantes = {}
+        if extension in EXTENSIONES_COMPRIMIBLES and len(contenido) >= TAMAÑO_MINIMO_COMPRESION:
+            variantes["gzip"] = self._variante(ruta + ".gz", lambda: gzip.compress(contenido, NIVEL_GZIP, mtime=0))
+            if brotli is not None:
+                variantes["br"] = self._variante(ruta + ".br", lambda: brotli.compress(contenido, quality=CALIDAD_BROTLI))
+            # Solo se guardan las variantes que realmente ocupan menos
+            variantes = {cod: datos for cod, datos in variantes.items() if len(datos) < len(contenido)}
+
+        return {
+            "ruta": ruta,
+            "tamaño": len(contenido),
+            "tipo": mimetypes.guess_type(nombre)[0] or "application/octet-stream",
+            "etag": hashlib.sha1(contenido).hexdigest()[:20],
+            "cache": CACHE_INMUTABLE if con_hash else CACHE_REVALIDAR,
+            "variantes": variantes,
+        }
+
+    @staticmethod
+    def _variante(ruta_precomprimida, comprimir):
+        """Usa el .gz/.br generado en el build si existe; si no, comprime en memoria"""
+        if os.path.isfile(ruta_precomprimida):
+            with open(ruta_precomprimida, "rb") as f:
+                return f.read()
+        return comprimir()
+
+    async def get_response(self, path, scope):
+        datos = self._archivos.get(os.path.normpath(path))
+        if datos is None or scope["method"] not in ("GET", "HEAD"):
+            # Archivo añadido después de arrancar (o método no permitido)
+            response = await super().get_response(path, scope)
+            response.headers.setdefault("cache-control", CACHE_REVALIDAR)
+            return response
+        return self._respuesta(datos, scope)
+
+    def _respuesta(self, datos, scope):
+        peticion = Headers(scope=scope)
+        codificacion = elegir_codificacion(peticion.get("accept-encoding"), datos["variantes"])
+        etag = f'"{datos["etag"]}-{codificacion}"' if codificacion else f'"{datos["etag"]}"'
+        cabeceras = {"etag": etag, "cache-control": datos["cache"]}
+        if datos["variantes"]:
+            cabeceras["vary"] = "Accept-Encoding"
+
+        if_none_match = peticion.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in _etags_de_peticion(if_none_match)):
+            return NotModifiedResponse(Headers(cabeceras))
+
+        if codificacion:
+            cabeceras["content-encoding"] = codificacion
+            cuerpo = datos["variantes"][codificacion]
+            if scope["method"] == "HEAD":
+                cabeceras["content-length"] = str(len(cuerpo))
+                cuerpo = b""
+            return Response(cuerpo, media_type=datos["tipo"], headers=cabeceras)
+
+        response = FileResponse(datos["ruta"], media_type=datos["tipo"], method=scope["method"])
+        # El ETag por contenido sustituye al de FileResponse (mtime + tamaño)
+        response.headers.update(cabeceras)
+        return response
@@ -0,0 +1,180 @@
+# eventos.py
+"""
+Publicación/suscripción en memoria (por proceso) de los cambios del libro
+de movimientos, servida como Server-Sent Events por sede. Los endpoints de
+escritura publican DESPUÉS del commit; cada pestaña abierta tiene su cola.
+
+Cada sede numera sus eventos y guarda los últimos en un historial: al
+reconectar, el navegador manda Last-Event-ID y recibe lo que se perdió.
+Si ya no está en el historial (o el cliente se ha quedado atrás y su cola
+se ha llenado) se le envía `reiniciar` para que recargue con /movimientos.
+"""
+import asyncio
+import threading
+from collections import deque
+from respuestas import a_json
+
+MOVIMIENTO_GRABADO = "movimiento-grabado"
+MOVIMIENTO_EDITADO = "movimiento-editado"
+MOVIMIENTO_ELIMINADO = "movimiento-eliminado"
+SALDOS_RECALCULADOS = "saldos-recalculados"
+REINICIAR = "reiniciar"
+
+# Eventos pendientes por suscriptor antes de darlo por desbordado
+MAX_PENDIENTES = 100
+# Eventos recientes por sede para reanudar con Last-Event-ID
+TAMAÑO_HISTORIAL = 200
+MAX_SUSCRIPTORES = 500
+# Comentario periódico para que proxies y navegador no cierren la conexión
+LATIDO_SEGUNDOS = 15
+REINTENTO_MS = 3000
+
+
+class Suscripcion:
+    def __init__(self, canal, loop):
+        self.canal = canal
+        self.loop = loop
+        self.cola = asyncio.Queue(MAX_PENDIENTES)
+        self.desbordada = False
+
+    def entregar(self, evento):
+        # Se ejecuta en el bucle de eventos del suscriptor
+        if self.desbordada:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            self.desbordada = True
+            # Hueco garantizado para el aviso final
+            self.cola.get_nowait()
+            self.cola.put_nowait(None)
+
+
+class BusEventos:
+    """Canales (test_mode, sede) -> suscriptores, con historial numerado por canal"""
+
+    def __init__(self, tamaño_historial=TAMAÑO_HISTORIAL, max_suscriptores=MAX_SUSCRIPTORES):
+        self.tamaño_historial = tamaño_historial
+        self.max_suscriptores = max_suscriptores
+        self._suscriptores = {}   # canal -> {Suscripcion}
+        self._historial = {}      # canal -> deque[(id, tipo, datos)]
+        self._secuencia = {}      # canal -> último id
+        self._lock = threading.Lock()
+
+    def suscribir(self, canal, ultimo_id=None):
+        """
+        Alta de un suscriptor (llamar desde el bucle de eventos).
+        Devuelve (suscripcion, pendientes); pendientes = None si hay que reiniciar.
+        """
+        suscripcion = Suscripcion(canal, asyncio.get_running_loop())
+        with self._lock:
+            if sum(len(s) for s in self._suscriptores.values()) >= self.max_suscriptores:
+                return None, None
+            self._suscriptores.setdefault(canal, set()).add(suscripcion)
+            pendientes = []
+            if ultimo_id is not None:
+                ultimo = self._secuencia.get(canal, 0)
+                historial = self._historial.get(canal, ())
+                if ultimo_id > ultimo:
+                    pendientes = None   # id de otro proceso o anterior a un reinicio
+                elif ultimo_id < ultimo:
+                    if not historial or historial[0][0] > ultimo_id + 1:
+                        pendientes = None
+                    else:
+                        pendientes = [evento for evento in historial if evento[0] > ultimo_id]
+        return suscripcion, pendientes
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscriptores = self._suscriptores.get(suscripcion.canal)
+            if suscriptores is not None:
+                suscriptores.discard(suscripcion)
+                if not suscriptores:
+                    del self._suscriptores[suscripcion.canal]
+
+    def publicar(self, canal, tipo, datos):
+        """Seguro desde los hilos del threadpool (endpoints síncronos)"""
+        with self._lock:
+            id_evento = self._secuencia.get(canal, 0) + 1
+            self._secuencia[canal] = id_evento
+            evento = (id_evento, tipo, datos)
+            historial = self._historial.get(canal)
+            if historial is None:
+                historial = self._historial[canal] = deque(maxlen=self.tamaño_historial)
+            historial.append(evento)
+            suscriptores = list(self._suscriptores.get(canal, ()))
+        for suscripcion in suscriptores:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion.entregar, evento)
+            except RuntimeError:
+                # Bucle cerrado (apagado del servidor)
+                self.cancelar(suscripcion)
+        return id_evento
+
+    def ultimo_id(self, canal):
+        with self._lock:
+            return self._secuencia.get(canal, 0)
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "canales": len(self._suscriptores),
+                "suscriptores": sum(len(s) for s in self._suscriptores.values())
+            }
+
+
+bus_movimientos = BusEventos()
+
+
+def publicar_movimientos(test_mode, sede, tipo, **datos):
+    """Evento del libro de la sede; llamar solo después del commit"""
+    try:
+        bus_movimientos.publicar((bool(test_mode), int(sede)), tipo, datos)
+    except Exception as e:
+        # La escritura ya está confirmada: un fallo aquí no debe convertirse en un 500
+        print(f"⚠️ No se pudo publicar el evento {tipo}: {e}")
+
+
+def publicar_recalculo(test_mode, sede, recalculo):
+    """saldos-recalculados, solo si el recálculo ha reescrito algún saldo"""
+    if recalculo and recalculo["movimientos_actualizados"]:
+        publicar_movimientos(
+            test_mode, sede, SALDOS_RECALCULADOS,
+            fecha_desde=recalculo["fecha_desde"],
+            movimientos_actualizados=recalculo["movimientos_actualizados"],
+            saldo_final_caja=round(recalculo["saldo_final_caja"], 2),
+            saldo_final_banco=round(recalculo["saldo_final_banco"], 2)
+        )
+
+
+def formatear_evento(id_evento, tipo, datos):
+    return b"id: %d\nevent: %s\ndata: %s\n\n" % (id_evento, tipo.encode(), a_json(datos))
+
+
+def _reiniciar(bus, suscripcion, motivo):
+    # Con el id actual: tras recargar, el cliente sigue desde aquí y no vuelve a pedir lo perdido
+    return formatear_evento(bus.ultimo_id(suscripcion.canal), REINICIAR, {"motivo": motivo})
+
+
+async def flujo_eventos(suscripcion, pendientes, bus=bus_movimientos):
+    """Generador para StreamingResponse: historial pendiente, eventos nuevos y latidos"""
+    try:
+        yield b"retry: %d\n\n" % REINTENTO_MS
+        if pendientes is None:
+            yield _reiniciar(bus, suscripcion, "historial no disponible")
+        else:
+            for evento in pendientes:
+                yield formatear_evento(*evento)
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), LATIDO_SEGUNDOS)
+            except asyncio.TimeoutError:
+                yield b": latido\n\n"
+                continue
+            if evento is None:
+                suscripcion.desbordada = False
+                yield _reiniciar(bus, suscripcion, "demasiados eventos pendientes")
+                continue
+            yield formatear_evento(*evento)
+    finally:
+        bus.cancelar(suscripcion)
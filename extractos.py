@@ -0,0 +1,94 @@
+# extractos.py
+"""
+Lectura de extractos bancarios en CSV, fila a fila (sin cargar el fichero
+completo en memoria), y clasificación de cada movimiento en
+MoTiMo / MoTGas / MoRubr según un conjunto de reglas.
+"""
+import csv
+import io
+from datetime import datetime
+
+# Reglas por defecto. Se evalúan en orden y gana la primera que coincide:
+#   "contiene": texto que debe aparecer en la descripción (opcional)
+#   "signo":    "+" ingresos, "-" cargos (opcional)
+REGLAS_EXTRACTO_BANCO = [
+    {"signo": "+", "MoTiMo": 100, "MoTGas": 0, "MoRubr": 0},
+    {"signo": "-", "MoTiMo": 200, "MoTGas": 0, "MoRubr": 0},
+]
+
+
+class ErrorExtracto(ValueError):
+    """Configuración de columnas o fichero no válidos"""
+
+
+def normalizar_descripcion(texto):
+    return " ".join(str(texto or "").upper().split())
+
+
+def parsear_importe(texto, decimal=","):
+    """'1.234,56' -> 1234.56 con decimal=','; '1,234.56' -> 1234.56 con decimal='.'"""
+    miles = "." if decimal == "," else ","
+    limpio = str(texto).strip().replace(" ", "").replace("€", "").replace(miles, "")
+    return float(limpio.replace(decimal, "."))
+
+
+def clasificar(descripcion, importe, reglas):
+    """Devuelve (MoTiMo, MoTGas, MoRubr) de la primera regla que coincide, o None"""
+    for regla in reglas:
+        signo = regla.get("signo")
+        if signo == "+" and importe < 0 or signo == "-" and importe >= 0:
+            continue
+        contiene = regla.get("contiene")
+        if contiene and normalizar_descripcion(contiene) not in descripcion:
+            continue
+        return int(regla.get("MoTiMo", 0)), int(regla.get("MoTGas", 0)), int(regla.get("MoRubr", 0))
+    return None
+
+
+def _indice_columna(columna, cabecera):
+    columna = str(columna).strip()
+    if columna.isdigit():
+        return int(columna)
+    if cabecera is None:
+        raise ErrorExtracto(f"La columna '{columna}' se indica por nombre pero el fichero no tiene cabecera")
+    nombres = [str(nombre).strip().upper() for nombre in cabecera]
+    if columna.upper() not in nombres:
+        raise ErrorExtracto(f"No se encuentra la columna '{columna}' en la cabecera")
+    return nombres.index(columna.upper())
+
+
+def leer_extracto(fichero_binario, col_fecha, col_descripcion, col_importe, separador=";",
+                  formato_fecha="%d/%m/%Y", decimal=",", codificacion="utf-8-sig", tiene_cabecera=True):
+    """
+    Generador de (linea, fecha, descripcion, importe, error) leyendo el CSV de
+    forma incremental. Las filas vacías se ignoran; las que no se pueden
+    interpretar se devuelven con `error` y el resto de campos a None.
+    """
+    texto = io.TextIOWrapper(fichero_binario, encoding=codificacion, newline="")
+    lector = csv.reader(texto, delimiter=separador)
+
+    cabecera = next(lector, None) if tiene_cabecera else None
+    indices = [_indice_columna(col, cabecera) for col in (col_fecha, col_descripcion, col_importe)]
+    necesarias = max(indices) + 1
+
+    for fila in lector:
+        linea = lector.line_num
+        if not any(campo.strip() for campo in fila):
+            continue
+        if len(fila) < necesarias:
+            yield linea, None, None, None, f"La fila tiene {len(fila)} columnas"
+            continue
+        valor_fecha, valor_desc, valor_importe = (fila[i] for i in indices)
+        try:
+            fecha = datetime.strptime(valor_fecha.strip(), formato_fecha).date()
+        except ValueError:
+            yield linea, None, None, None, f"Fecha no válida: {valor_fecha}"
+            continue
+        try:
+            importe = round(parsear_importe(valor_importe, decimal), 2)
+        except ValueError:
+            yield linea, None, None, None, f"Importe no válido: {valor_importe}"
+            continue
+        yield linea, fecha, normalizar_descripcion(valor_desc), importe, None
+
+    texto.detach()
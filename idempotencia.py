@@ -0,0 +1,167 @@
+# idempotencia.py
+"""
+Claves de idempotencia (cabecera Idempotency-Key) para las escrituras del
+libro de movimientos. La clave se guarda en la tabla `idempotencia` con la
+MISMA conexión y transacción que la escritura: la operación recibe un
+objeto ClaveIdempotencia, llama a reservar(cursor) al empezar y a
+guardar(cursor, respuesta) justo antes de su commit. Así la clave y los
+movimientos se confirman (o se deshacen) juntos, y los reintentos con la
+misma clave devuelven la respuesta guardada sin volver a tocar `movimientos`.
+
+Cada clave guarda además la huella (SHA-256) de los datos de la petición:
+reutilizar una clave con otros datos es un error 422, no una repetición.
+Delante de la tabla hay una caché en memoria con la misma caducidad.
+"""
+import hashlib
+import json
+import time
+import pymysql
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from db import conectar_db, asegurar_tabla
+from cache import CacheTTL
+
+# Tiempo durante el que se recuerda una clave
+TTL_HORAS = 24
+# Cada cuánto se borran de la tabla las claves caducadas
+PURGA_CADA_SEGUNDOS = 600
+LONGITUD_MAXIMA_CLAVE = 100
+
+DDL_IDEMPOTENCIA = """
+CREATE TABLE IF NOT EXISTS idempotencia (
+    IdClave VARCHAR(100) NOT NULL,
+    IdUsuario VARCHAR(50) NOT NULL,
+    IdRuta VARCHAR(100) NOT NULL,
+    IdHuella CHAR(64) NOT NULL,
+    IdEstado SMALLINT NOT NULL DEFAULT 0,
+    IdRespuesta MEDIUMTEXT NULL,
+    IdCaduca DATETIME NOT NULL,
+    PRIMARY KEY (IdClave, IdUsuario, IdRuta),
+    KEY idx_idempotencia_caduca (IdCaduca)
+)
+"""
+
+# Estado de una clave reservada cuya petición aún no ha terminado
+EN_CURSO = 0
+COMPLETADA = 200
+
+# (test_mode, usuario, ruta, clave) -> (huella, respuesta)
+cache_respuestas = CacheTTL(ttl_segundos=TTL_HORAS * 3600, max_items=2048)
+_ultima_purga = {}
+
+
+def huella(datos):
+    """SHA-256 de los datos de la petición (modelos pydantic, dicts, ...)"""
+    texto = json.dumps(jsonable_encoder(datos), sort_keys=True, default=str)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _respuesta_guardada(huella_guardada, huella_peticion, respuesta):
+    if huella_guardada != huella_peticion:
+        raise HTTPException(
+            status_code=422,
+            detail="La Idempotency-Key ya se usó con datos distintos en esta petición"
+        )
+    return respuesta
+
+
+def _purgar_caducadas(test_mode):
+    """Fuera de las transacciones del libro, con su propia conexión y como mucho cada PURGA_CADA_SEGUNDOS"""
+    ahora = time.monotonic()
+    if ahora - _ultima_purga.get(test_mode, 0) < PURGA_CADA_SEGUNDOS:
+        return
+    _ultima_purga[test_mode] = ahora
+    conn = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        with conn.cursor() as cursor:
+            asegurar_tabla(cursor, "idempotencia", DDL_IDEMPOTENCIA)
+            cursor.execute("DELETE FROM idempotencia WHERE IdCaduca < NOW() LIMIT 1000")
+        conn.commit()
+    except Exception as e:
+        print(f"⚠️ No se pudieron purgar las claves de idempotencia caducadas: {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+class ClaveIdempotencia:
+    """Clave de una petición; sin cabecera `clave` es None y no hace nada"""
+
+    def __init__(self, clave, usuario, ruta, huella_peticion):
+        self.clave = clave
+        self.usuario = usuario
+        self.ruta = ruta
+        self.huella = huella_peticion
+
+    def reservar(self, cursor):
+        """
+        Llamar al principio de la operación, tras los asegurar_* y antes de
+        cualquier escritura (crea su tabla con db.asegurar_tabla). Devuelve None
+        si la clave es nueva o la respuesta guardada si ya se completó. Una
+        petición simultánea con la misma clave espera en el INSERT a que esta
+        termine.
+        """
+        if self.clave is None:
+            return None
+        asegurar_tabla(cursor, "idempotencia", DDL_IDEMPOTENCIA)
+        filtro = (self.clave, self.usuario, self.ruta)
+        for _ in range(2):
+            try:
+                cursor.execute("""
+                INSERT INTO idempotencia (IdClave, IdUsuario, IdRuta, IdHuella, IdEstado, IdCaduca)
+                VALUES (%s, %s, %s, %s, %s, NOW() + INTERVAL %s HOUR)
+                """, (*filtro, self.huella, EN_CURSO, TTL_HORAS))
+                return None
+            except pymysql.IntegrityError:
+                cursor.execute("""
+                SELECT IdHuella, IdEstado, IdRespuesta, IdCaduca < NOW() AS caducada
+                FROM idempotencia
+                WHERE IdClave = %s AND IdUsuario = %s AND IdRuta = %s
+                """, filtro)
+                existente = cursor.fetchone()
+                if existente and not existente['caducada'] and existente['IdEstado'] == COMPLETADA:
+                    respuesta = json.loads(existente['IdRespuesta'])
+                    print(f"♻️ Reintento idempotente de {self.ruta} (tabla)")
+                    return _respuesta_guardada(existente['IdHuella'], self.huella, respuesta)
+                # Caducada (o borrada entre medias): se libera y se vuelve a intentar
+                cursor.execute(
+                    "DELETE FROM idempotencia WHERE IdClave = %s AND IdUsuario = %s AND IdRuta = %s",
+                    filtro
+                )
+        raise HTTPException(status_code=409, detail="No se pudo reservar la clave de idempotencia")
+
+    def guardar(self, cursor, respuesta):
+        """Llamar justo antes del commit de la operación"""
+        if self.clave is None:
+            return
+        cursor.execute("""
+        UPDATE idempotencia SET IdEstado = %s, IdRespuesta = %s
+        WHERE IdClave = %s AND IdUsuario = %s AND IdRuta = %s
+        """, (COMPLETADA, json.dumps(respuesta, default=str), self.clave, self.usuario, self.ruta))
+
+
+def ejecutar_idempotente(clave, auth, ruta, test_mode, datos, funcion):
+    """
+    Ejecuta `funcion(clave_idempotencia)` una sola vez por (clave, usuario, ruta).
+    `datos` son los de la petición (para la huella). Sin clave se ejecuta
+    directamente, como hasta ahora.
+    """
+    if not clave:
+        return funcion(ClaveIdempotencia(None, None, ruta, None))
+    clave = clave.strip()
+    if not clave or len(clave) > LONGITUD_MAXIMA_CLAVE:
+        raise HTTPException(status_code=400, detail="Idempotency-Key no válida")
+
+    usuario = str(auth.get("sub", ""))
+    huella_peticion = huella(datos)
+    clave_cache = (test_mode, usuario, ruta, clave)
+    guardada = cache_respuestas.obtener(clave_cache)
+    if guardada is not None:
+        print(f"♻️ Reintento idempotente de {ruta} (caché)")
+        return _respuesta_guardada(guardada[0], huella_peticion, guardada[1])
+
+    respuesta = funcion(ClaveIdempotencia(clave, usuario, ruta, huella_peticion))
+    cache_respuestas.guardar(clave_cache, (huella_peticion, respuesta))
+    _purgar_caducadas(test_mode)
+    return respuesta
@@ -1,14 +1,16 @@
 # C:\Proyectos\Jetro\BackEnd\login.py
 # ✅ login.py con selección de iglesia y JWT
-from fastapi import APIRouter, HTTPException, Depends, Header
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Optional, List, Dict
+from functools import lru_cache
 import pymysql
 import bcrypt
 from jose import jwt, JWTError, ExpiredSignatureError
 from datetime import datetime, timedelta
 from db import conectar_db
+from cache import CacheTTL
 
 # Configuración JWT
 SECRET_KEY = "tu_clave_secreta_super_segura"
@@ -17,6 +19,17 @@ EXPIRATION_MINUTES = 60
 
 router = APIRouter()
 security = HTTPBearer()
+security_opcional = HTTPBearer(auto_error=False)
+
+# Token corto para /eventos-movimientos (EventSource no puede enviar cabeceras)
+USO_EVENTOS = "eventos"
+EXPIRACION_TOKEN_EVENTOS_SEGUNDOS = 120
+
+# Valor de UsSedes que da acceso a todas las iglesias activas
+TODAS_LAS_SEDES = "999"
+
+# Códigos de locales activos por base de datos (clave: test_mode)
+cache_sedes_activas = CacheTTL(ttl_segundos=300, max_items=4)
 
 # Modelos de entrada
 class LoginInput(BaseModel):
@@ -70,6 +83,110 @@ def get_current_user(
         raise HTTPException(status_code=401, detail="Token inválido")
     return payload
 
+# ---- Permisos por sede ----
+def parsear_sedes(sedes_str) -> Optional[List[int]]:
+    """Convierte UsSedes ("999", "3" o "1,4,7") en lista ordenada de códigos. None = todas"""
+    codigos = set()
+    for parte in str(sedes_str or "").split(","):
+        parte = parte.strip()
+        if parte.isdigit():
+            codigos.add(int(parte))
+    if int(TODAS_LAS_SEDES) in codigos:
+        return None
+    return sorted(codigos)
+
+def obtener_sedes_activas(test_mode: bool = False) -> frozenset:
+    """Códigos de los locales activos, servidos desde caché"""
+    def cargar():
+        conn = conectar_db(test_mode=test_mode)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT LoCod FROM locales WHERE LoSituacion=1")
+                return frozenset(int(fila["LoCod"]) for fila in cursor.fetchall())
+        finally:
+            conn.close()
+
+    return cache_sedes_activas.obtener_o_calcular(test_mode, cargar)
+
+def invalidar_sedes_activas(test_mode: bool = False):
+    """Llamar tras crear, modificar o dar de baja un local"""
+    cache_sedes_activas.invalidar(test_mode)
+
+@lru_cache(maxsize=1024)
+def _conjunto_sedes(codigos: tuple) -> frozenset:
+    return frozenset(codigos)
+
+def sedes_permitidas(usuario: Dict, test_mode: bool = False) -> frozenset:
+    """Conjunto de sedes del token: lista de códigos, o "999" para todas las activas"""
+    sedes = usuario.get("sedes")
+    if isinstance(sedes, list):
+        return _conjunto_sedes(tuple(sedes))
+    # "999" o tokens emitidos antes de resolver las sedes (UsSedes en texto)
+    codigos = parsear_sedes(sedes)
+    if codigos is None:
+        return obtener_sedes_activas(test_mode)
+    return _conjunto_sedes(tuple(codigos))
+
+def autorizar_sede(usuario: Dict, sede, test_mode: bool = False):
+    """Lanza 403 si la sede no está entre las permitidas al usuario"""
+    try:
+        permitida = int(sede) in sedes_permitidas(usuario, test_mode)
+    except (TypeError, ValueError):
+        permitida = False
+    if not permitida:
+        raise HTTPException(status_code=403, detail=f"No tiene acceso a la sede {sede}")
+
+# Dependencia para endpoints con parámetro ?sede=
+def sede_autorizada(
+    sede: int = Query(...),
+    test_mode: bool = False,
+    usuario: Dict = Depends(get_current_user)
+) -> int:
+    autorizar_sede(usuario, sede, test_mode)
+    return sede
+
+# ---- Token para Server-Sent Events ----
+def crear_token_eventos(usuario: Dict, sede: int, test_mode: bool = False) -> str:
+    """
+    Token de EXPIRACION_TOKEN_EVENTOS_SEGUNDOS válido solo para los eventos
+    de una sede y de una base (real o test_mode). Va en la URL (?token=),
+    así que no sirve para nada más.
+    """
+    datos = {
+        "sub": usuario.get("sub"),
+        "uso": USO_EVENTOS,
+        "sede": int(sede),
+        "test_mode": bool(test_mode),
+        "exp": datetime.utcnow() + timedelta(seconds=EXPIRACION_TOKEN_EVENTOS_SEGUNDOS)
+    }
+    return jwt.encode(datos, SECRET_KEY, algorithm=ALGORITHM)
+
+def sede_autorizada_eventos(
+    sede: int = Query(...),
+    token: Optional[str] = Query(None),
+    test_mode: bool = False,
+    creds: Optional[HTTPAuthorizationCredentials] = Depends(security_opcional)
+) -> int:
+    """
+    Como sede_autorizada, pero acepta también el token de crear_token_eventos
+    en ?token= (el navegador con EventSource no puede mandar Authorization)
+    """
+    if creds is not None:
+        return sede_autorizada(sede, test_mode, get_current_user(creds))
+    if not token:
+        raise HTTPException(status_code=401, detail="Falta el token de eventos")
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token de eventos expirado")
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Token de eventos inválido")
+    if payload.get("uso") != USO_EVENTOS or payload.get("sede") != sede:
+        raise HTTPException(status_code=403, detail=f"El token no da acceso a los eventos de la sede {sede}")
+    if payload.get("test_mode") is not bool(test_mode):
+        raise HTTPException(status_code=403, detail="El token de eventos es de la otra base (test_mode)")
+    return sede
+
 # ---- Endpoint Login ----
 @router.post("/login")
 def login(datos: LoginInput, test_mode: bool = False):
@@ -91,11 +208,13 @@ def login(datos: LoginInput, test_mode: bool = False):
                 if not bcrypt.checkpw(datos.clave.encode("utf-8"), usuario["UsKeyWeb"].encode("utf-8")):
                     raise HTTPException(status_code=401, detail="Contraseña incorrecta")
 
+            # Sedes resueltas una sola vez: "999" (todas las activas) o lista de códigos
+            sedes = parsear_sedes(usuario["UsSedes"])
             token_data = {
                 "sub": usuario["UsCod"],
                 "id": usuario["UsID"],
                 "nivel": usuario["UsNivel"],
-                "sedes": usuario["UsSedes"],
+                "sedes": TODAS_LAS_SEDES if sedes is None else sedes,
                 "exp": datetime.utcnow() + timedelta(hours=12)
             }
 
@@ -114,14 +233,15 @@ def obtener_iglesias(sede_ids: str, test_mode: bool = False):
         conexion = conectar_db(test_mode=test_mode)
         cursor = conexion.cursor()
 
-        if sede_ids == "999":
+        codigos = parsear_sedes(sede_ids)
+        if codigos is None:
             cursor.execute("SELECT LoCod, LoNombre FROM locales WHERE LoSituacion=1 ORDER BY LoNombre")
-        elif "," in sede_ids:
-            ids = tuple(sede_ids.split(","))
-            sql = f"SELECT LoCod, LoNombre FROM locales WHERE LoSituacion=1 AND LoCod IN {ids}"
-            cursor.execute(sql)
+        elif not codigos:
+            return []
         else:
-            cursor.execute("SELECT LoCod, LoNombre FROM locales WHERE LoSituacion=1 AND LoCod = %s", (sede_ids,))
+            placeholders = ",".join(["%s"] * len(codigos))
+            sql = f"SELECT LoCod, LoNombre FROM locales WHERE LoSituacion=1 AND LoCod IN ({placeholders}) ORDER BY LoNombre"
+            cursor.execute(sql, codigos)
 
         iglesias = cursor.fetchall()
         return iglesias
@@ -1,18 +1,67 @@
 # C:\Proyectos\Jetro\BackEnd\main.py
-from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Form, File, UploadFile, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from estaticos import ArchivosEstaticos
+from compresion import CompresionMiddleware, metricas_compresion
+from campos import campos, con_columnas
+from paginacion import (
+    LIMITE_MAXIMO_PAGINA, codificar_cursor, decodificar_cursor, condicion_despues_de, parametros_despues_de,
+    orden_sin_nulos, valores_sin_nulos
+)
+from busqueda import buscar_fieles, buscar_donantes, fiel_guardado, fiel_eliminado, LIMITE_RESULTADOS, LIMITE_MAXIMO
+from respuestas import RespuestaJSON, formato_columnar, cursor_filas, columnas_cursor, tabla_columnar, dicts_a_columnar
 from pydantic import BaseModel
-from login import router as login_router, get_current_user
+from login import (
+    router as login_router, get_current_user, parsear_sedes, sedes_permitidas,
+    autorizar_sede, sede_autorizada, invalidar_sedes_activas,
+    crear_token_eventos, sede_autorizada_eventos, EXPIRACION_TOKEN_EVENTOS_SEGUNDOS
+)
 from typing import List, Dict, Optional
 from db import conectar_db
+from cache import CacheTTL
+from vuelo_unico import compartir_lectura
+from vista_mensual import cache_meses, calcular_totales, columnar_mes, invalidar_mes, invalidar_desde, COLUMNAS_MES
+from trabajos import gestor_trabajos, COMPLETADO, ERROR
+from verificacion import verificar_sedes
+from diezmos import (
+    asegurar_tablas_diezmos, ajustar_diezmos, reconstruir_diezmos,
+    diezmos_por_persona, invalidar_nombres_fieles
+)
+from archivo import (
+    asegurar_tablas_archivo, fuente_movimientos, archivar_anyo, invalidar_años_archivados, años_archivados,
+    ErrorArchivo
+)
+from saldos import (
+    insertar_movimientos, recalcular_saldos_desde, meses_cerrados, saldos_en_fechas,
+    como_fecha, COLUMNAS_MOVIMIENTO
+)
+from resumenes import (
+    asegurar_tablas_resumen, crear_resumen_mes, eliminar_resumen_mes, corte_resumenes,
+    mes_corte_en_año, resumenes_pendientes, SQL_ULTIMO_SALDO_BANCO
+)
+from eventos import (
+    MOVIMIENTO_GRABADO, MOVIMIENTO_EDITADO, MOVIMIENTO_ELIMINADO, bus_movimientos,
+    publicar_movimientos, publicar_recalculo, flujo_eventos
+)
+from cambios import (
+    ALTA, MODIFICACION, BAJA, LIMITE_CAMBIOS, asegurar_tabla_cambios, registrar_cambios,
+    registrar_recalculo, ultimo_cambio, version_sede, versiones_sedes, leer_cambios,
+    purgar_cambios_antiguos
+)
+from idempotencia import ejecutar_idempotente
+from secuencias import asignador_codigos
+from extractos import REGLAS_EXTRACTO_BANCO, ErrorExtracto, leer_extracto, clasificar, normalizar_descripcion
 from datetime import datetime
 from pathlib import Path
 import pymysql
+import csv
+import json
 import os
+import re
 
-app = FastAPI()
+app = FastAPI(default_response_class=RespuestaJSON)
 
 # CORS PRIMERO
 app.add_middleware(
@@ -23,6 +72,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión de las respuestas JSON de la API (los estáticos ya van precomprimidos)
+app.add_middleware(CompresionMiddleware)
+
 # RUTAS API ANTES DEL MOUNT
 app.include_router(login_router)
 
@@ -39,27 +91,34 @@ if not static_dir.exists():
     print(f"⚠️  ADVERTENCIA: No se encuentra la carpeta static en {static_dir}")
     print("🔧 Asegúrate de tener la carpeta 'static' con los archivos del frontend")
 
-# RUTA RAÍZ - Servir index.html
+# ARCHIVOS ESTÁTICOS
+# Precomprimidos al arrancar, immutable si llevan hash, ETag para el resto
+estaticos_assets = None
+if (static_dir / "assets").exists():
+    # Servir assets (CSS, JS)
+    estaticos_assets = ArchivosEstaticos(directory=str(static_dir / "assets"))
+    app.mount("/assets", estaticos_assets, name="assets")
+
+# Servir otros archivos estáticos (logos, imágenes)
+estaticos_static = ArchivosEstaticos(directory=str(static_dir))
+app.mount("/static", estaticos_static, name="static_files")
+
+# RUTA RAÍZ - Servir index.html (con ETag / If-None-Match)
 @app.get("/")
-async def read_root():
+async def read_root(request: Request):
     index_path = static_dir / "index.html"
     if index_path.exists():
-        return FileResponse(str(index_path))
+        return await estaticos_static.get_response("index.html", request.scope)
     else:
         raise HTTPException(status_code=404, detail="Frontend no encontrado")
 
-# ARCHIVOS ESTÁTICOS
-# Servir assets (CSS, JS)
-if (static_dir / "assets").exists():
-    app.mount("/assets", StaticFiles(directory=str(static_dir / "assets")), name="assets")
-
-# Servir otros archivos estáticos (logos, imágenes)
-app.mount("/static", StaticFiles(directory=str(static_dir)), name="static_files")
-
 # INFO DE INICIO
 @app.on_event("startup")
 async def startup_event():
     print("🚀 FastAPI iniciado correctamente")
+    for estaticos in (estaticos_assets, estaticos_static):
+        if estaticos is not None:
+            await run_in_threadpool(estaticos.precomprimir)
     print(f"📁 Sirviendo archivos estáticos desde: {static_dir.absolute()}")
     print(f"🌐 Frontend disponible en: http://localhost:8000/")
     print(f"📚 Documentación API: http://localhost:8000/docs")
@@ -85,7 +144,7 @@ class LocalBase(BaseModel):
     LoSituacion: int = 1
 
 class LocalCreate(LocalBase):
-    pass
+    LoCod: Optional[int] = None  # Lo asigna el servidor
 
 class LocalUpdate(LocalBase):
     LoID: int
@@ -116,7 +175,7 @@ class FielBase(BaseModel):
     Situacion: int = 1
 
 class FielCreate(FielBase):
-    pass
+    fiCod: Optional[int] = None  # Lo asigna el servidor
 
 class FielUpdate(FielBase):
     fiID: int
@@ -138,7 +197,7 @@ class UsuarioBase(BaseModel):
     UsIntentos: int = 0
 
 class UsuarioCreate(UsuarioBase):
-    pass
+    UsCod: Optional[str] = None  # Vacío o USRnnn: lo asigna el servidor
 
 class UsuarioUpdate(UsuarioBase):
     UsID: int
@@ -171,6 +230,10 @@ class MovimientoCreate(BaseModel):
     moPers: Optional[int] = 0      # Para fieles/pastores
     moSedeDes: Optional[int] = 0  # Para locales
 
+# ================== MODELO PARA GRABAR LOTE DE MOVIMIENTOS =======================
+class MovimientosLote(BaseModel):
+    sede: int
+    movimientos: List[MovimientoCreate]
 
 # ================== MODELO PARA CREAR CIERRE =======================
 class CierreCreate(BaseModel):
@@ -188,6 +251,14 @@ class CierreCreateTemporal(BaseModel):
     mes: int
     usuario: str
 
+# ================== MODELO PARA SALDOS A UNA FECHA =======================
+class SaldoFechaConsulta(BaseModel):
+    sede: int
+    fecha: str
+
+class SaldosFechasRequest(BaseModel):
+    consultas: List[SaldoFechaConsulta]
+
 # ================== MODELOS PARA REPORTES ==================
 class ReporteIngresosGastosRequest(BaseModel):
     codigoSede: int
@@ -240,6 +311,18 @@ class RubroSedeItem(BaseModel):
     nombre: str
     orden: int = 1
 
+class ReordenarMenuSede(BaseModel):
+    """Orden completo de los botones del menú de una sede (MnuID en el orden deseado)"""
+    sede: int
+    tipo_operacion: int
+    ids: List[int]
+
+class ReordenarRubrosSede(BaseModel):
+    """Orden completo de los rubros de una sede (RuID en el orden deseado)"""
+    sede: int
+    tip_gasto: int
+    ids: List[int]
+
 class TransferirElementoRequest(BaseModel):
     """Modelo para transferir elementos entre menús"""
     accion: str  # "agregar" o "eliminar"
@@ -255,8 +338,8 @@ class EliminarElementoRequest(BaseModel):
     sede: int
 
 # ============ FUNCION PARA CALCULAR TOTALES ==================
-def calcular_resumen_movimientos(movimientos):
-    """Función auxiliar para calcular totales"""
+def calcular_resumen_movimientos(movimientos, columnas=None):
+    """Función auxiliar para calcular totales (con `columnas`, las filas son tuplas)"""
     resumen = {
         'totalCaja': 0,
         'totalBanco': 0,
@@ -267,9 +350,15 @@ def calcular_resumen_movimientos(movimientos):
         'saldoNeto': 0
     }
     
-    for mov in movimientos:
-        caja = float(mov.get('Caja', 0) or 0)
-        banco = float(mov.get('Banco', 0) or 0)
+    if columnas is None:
+        importes = ((mov.get('Caja', 0), mov.get('Banco', 0)) for mov in movimientos)
+    else:
+        i_caja, i_banco = columnas.index('Caja'), columnas.index('Banco')
+        importes = ((fila[i_caja], fila[i_banco]) for fila in movimientos)
+
+    for caja, banco in importes:
+        caja = float(caja or 0)
+        banco = float(banco or 0)
         total = caja + banco
         
         resumen['totalCaja'] += caja
@@ -284,11 +373,26 @@ def calcular_resumen_movimientos(movimientos):
     resumen['saldoNeto'] = resumen['totalIngresos'] - resumen['totalGastos']
     return resumen
 
+# ============ FUNCION PARA NORMALIZAR FECHAS DE MYSQL ==================
+def solo_fecha(valor):
+    """MoFecha puede llegar como date o datetime según la columna; devuelve siempre date"""
+    return valor.date() if isinstance(valor, datetime) else valor
+
 # ============ FUNCION PARA VERIFICAR PERMISOS DE ADMINISTRADOR ==================
 def verificar_admin(auth_user):
     if auth_user.get("nivel") != 9:
         raise HTTPException(status_code=403, detail="Solo los administradores pueden realizar esta acción")
 
+# Menús de sede (mnusedesbtn) y rubros de sede (rubingassede) leídos en cada pantalla
+# Clave: (tabla, test_mode, sede, ...)
+cache_menus = CacheTTL(ttl_segundos=300, max_items=512)
+
+def invalidar_menus(test_mode, tabla, sede=None):
+    """Descarta las lecturas cacheadas de la tabla (de una sede o de todas)"""
+    cache_menus.invalidar_si(
+        lambda clave: clave[0] == tabla and clave[1] == test_mode and (sede is None or clave[2] == sede)
+    )
+
 # ============ FUNCION PARA CONVERTIR TEXTO A MAYÚSCULAS ==================
 def convertir_campos_texto_mayusculas(modelo_data):
     """Convierte campos de texto a mayúsculas, preservando números, fechas, etc."""
@@ -308,7 +412,12 @@ def convertir_campos_texto_mayusculas(modelo_data):
 
 # ================== ENDPOINTS PARA IGLESIAS ==================
 @app.get("/locales/{sede_ids}")
-def obtener_locales(sede_ids: str, auth=Depends(get_current_user), test_mode: bool = False):
+def obtener_locales(
+    sede_ids: str,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("locales"))
+):
     """Obtener todos los locales de las sedes especificadas"""
     conn = None
     cursor = None
@@ -317,16 +426,17 @@ def obtener_locales(sede_ids: str, auth=Depends(get_current_user), test_mode: bo
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)  # Corregido para PyMySQL
         
-        # Usar la misma lógica que ya tienes en login.py
-        if sede_ids == "999":
-            cursor.execute("SELECT * FROM locales WHERE LoSituacion=1 ORDER BY LoNombre")
-        elif "," in sede_ids:
-            ids = tuple(sede_ids.split(","))
-            placeholders = ",".join(["%s"] * len(ids))
-            sql = f"SELECT * FROM locales WHERE LoSituacion=1 AND LoCod IN ({placeholders}) ORDER BY LoNombre"
-            cursor.execute(sql, ids)
-        else:
-            cursor.execute("SELECT * FROM locales WHERE LoSituacion=1 AND LoCod = %s ORDER BY LoNombre", (sede_ids,))
+        # Solo las sedes pedidas que además están permitidas en el token
+        solicitadas = parsear_sedes(sede_ids)
+        permitidas = sedes_permitidas(auth, test_mode)
+        codigos = sorted(permitidas if solicitadas is None else permitidas.intersection(solicitadas))
+        if not codigos:
+            print("✅ Encontrados 0 locales")
+            return []
+        
+        placeholders = ",".join(["%s"] * len(codigos))
+        sql = f"SELECT {columnas} FROM locales WHERE LoSituacion=1 AND LoCod IN ({placeholders}) ORDER BY LoNombre"
+        cursor.execute(sql, codigos)
         
         locales = cursor.fetchall()
         print(f"✅ Encontrados {len(locales)} locales")
@@ -343,7 +453,12 @@ def obtener_locales(sede_ids: str, auth=Depends(get_current_user), test_mode: bo
 
 # ================== ENDPOINT PARA DETALLES DEL LOCAL ==================
 @app.get("/locales/detalle/{local_id}")
-def obtener_local_detalle(local_id: int, auth=Depends(get_current_user), test_mode: bool = False):
+def obtener_local_detalle(
+    local_id: int,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("locales"))
+):
     """Obtener un local específico por ID"""
     conn = None
     cursor = None
@@ -352,7 +467,7 @@ def obtener_local_detalle(local_id: int, auth=Depends(get_current_user), test_mo
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)  # Corregido para PyMySQL
         
-        cursor.execute("SELECT * FROM locales WHERE LoID = %s", (local_id,))
+        cursor.execute(f"SELECT {columnas} FROM locales WHERE LoID = %s", (local_id,))
         local = cursor.fetchone()
         
         if not local:
@@ -375,24 +490,21 @@ def obtener_local_detalle(local_id: int, auth=Depends(get_current_user), test_mo
 # ================== ENDPOINT PARA NUEVO CODIGO DE LOCAL ==================
 @app.get("/nuevo-codigo-local")
 def obtener_nuevo_codigo(auth=Depends(get_current_user), test_mode: bool = False):
-    conn = None
-    cursor = None
     try:
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor()
-        cursor.execute("SELECT MAX(LoCod)+1 as nuevoCodigo FROM locales")
-        resultado = cursor.fetchone()
-        nuevo_codigo = resultado[0] if resultado[0] else 1
+        # Orientativo: el código definitivo se asigna al crear el local
+        nuevo_codigo = asignador_codigos.previsto(test_mode, "locales")
         return {"nuevoCodigo": nuevo_codigo}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
 
 # ================== ENDPOINT PARA CREAR UN LOCAL ==================        
 @app.post("/locales")
-def crear_local(local: LocalCreate, auth=Depends(get_current_user), test_mode: bool = False):
+def crear_local(
+    local: LocalCreate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("locales"))
+):
     """Crear un nuevo local"""
     conn = None
     cursor = None
@@ -401,10 +513,11 @@ def crear_local(local: LocalCreate, auth=Depends(get_current_user), test_mode: b
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)  # Corregido para PyMySQL
         
-        # Verificar si el código ya existe
-        cursor.execute("SELECT LoID FROM locales WHERE LoCod = %s", (local.LoCod,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="El código de local ya existe")
+        # Asignar el código en el servidor (secuencia atómica)
+        def codigo_ocupado(codigo):
+            cursor.execute("SELECT LoID FROM locales WHERE LoCod = %s", (codigo,))
+            return cursor.fetchone() is not None
+        local.LoCod = asignador_codigos.asignar(test_mode, "locales", codigo_ocupado)
         
         sql = """
         INSERT INTO locales (LoCod, LoNombre, LoPasAdm, LoCalle, LoCP, LoCiudad, 
@@ -421,9 +534,10 @@ def crear_local(local: LocalCreate, auth=Depends(get_current_user), test_mode: b
         cursor.execute(sql, valores)
         conn.commit()
         new_id = conn.insert_id()  # Corregido para PyMySQL
+        invalidar_sedes_activas(test_mode)
         
         # Obtener el registro creado
-        cursor.execute("SELECT * FROM locales WHERE LoID = %s", (new_id,))
+        cursor.execute(f"SELECT {columnas} FROM locales WHERE LoID = %s", (new_id,))
         nuevo_local = cursor.fetchone()
         
         print("✅ Local creado correctamente")
@@ -446,7 +560,13 @@ def crear_local(local: LocalCreate, auth=Depends(get_current_user), test_mode: b
 
 # ================== ENDPOINT PARA ACTUALIZAR UN LOCAL ==================
 @app.put("/locales/{local_id}")
-def actualizar_local(local_id: int, local: LocalUpdate, auth=Depends(get_current_user), test_mode: bool = False):
+def actualizar_local(
+    local_id: int,
+    local: LocalUpdate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("locales"))
+):
     """Actualizar un local existente"""
     conn = None
     cursor = None
@@ -480,9 +600,10 @@ def actualizar_local(local_id: int, local: LocalUpdate, auth=Depends(get_current
         
         cursor.execute(sql, valores)
         conn.commit()
+        invalidar_sedes_activas(test_mode)
         
         # Obtener el registro actualizado
-        cursor.execute("SELECT * FROM locales WHERE LoID = %s", (local_id,))
+        cursor.execute(f"SELECT {columnas} FROM locales WHERE LoID = %s", (local_id,))
         local_actualizado = cursor.fetchone()
         
         print("✅ Local actualizado correctamente")
@@ -523,6 +644,7 @@ def eliminar_local(local_id: int, auth=Depends(get_current_user), test_mode: boo
         # Soft delete - cambiar situación a 0
         cursor.execute("UPDATE locales SET LoSituacion = 0 WHERE LoID = %s", (local_id,))
         conn.commit()
+        invalidar_sedes_activas(test_mode)
         
         print(f"✅ Local '{local['LoNombre']}' eliminado correctamente")
         return {"message": f"Local '{local['LoNombre']}' eliminado correctamente"}
@@ -539,25 +661,91 @@ def eliminar_local(local_id: int, auth=Depends(get_current_user), test_mode: boo
             conn.close()
 
 # ================== ENDPOINTS PARA FIELES ==================
+# Orden estable del listado de fieles (también es la clave de paginación)
+ORDEN_FIELES = ("fiApellidos", "fiNombres", "fiID")
+# Fichas antiguas pueden tener apellidos o nombres a NULL
+CLAVE_FIELES = orden_sin_nulos(ORDEN_FIELES, ("fiApellidos", "fiNombres"))
+
 @app.get("/fieles/{sede_id}")
-def obtener_fieles(sede_id: str, auth=Depends(get_current_user), test_mode: bool = False):
-    """Obtener todos los fieles de la sede especificada"""
+def obtener_fieles(
+    sede_id: str,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar),
+    columnas: str = Depends(campos("fieles")),
+    situacion: int = 1,
+    ciudad: Optional[str] = None,
+    nombre: Optional[str] = Query(None, description="Prefijo de apellidos o nombres"),
+    diezmo: Optional[bool] = Query(None, description="True: con diezmo asignado, False: sin él"),
+    limite: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO_PAGINA, description="Activa la paginación"),
+    cursor_pagina: Optional[str] = Query(None, alias="cursor", description="Valor 'siguiente' de la página anterior")
+):
+    """
+    Obtener los fieles de la sede especificada (999 = todas), filtrados en el servidor.
+    Sin `limite` devuelve la lista completa como siempre; con `limite` devuelve una
+    página {"fieles", "siguiente"} ordenada por apellidos, nombres y fiID.
+    """
     conn = None
     cursor = None
     try:
         print(f"▶️ Obteniendo fieles para sede: {sede_id}")
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        if sede_id == "999":
-            cursor.execute("SELECT * FROM fieles WHERE Situacion=1 ORDER BY fiApellidos, fiNombres")
-        else:
-            cursor.execute("SELECT * FROM fieles WHERE Situacion=1 AND fiSede = %s ORDER BY fiApellidos, fiNombres", (sede_id,))
+        condiciones = ["Situacion = %s"]
+        params = [situacion]
+        if sede_id != "999":
+            condiciones.append("fiSede = %s")
+            params.append(sede_id)
+        if ciudad:
+            condiciones.append("fiCiudad = %s")
+            params.append(ciudad.strip())
+        if nombre and nombre.strip():
+            prefijo = nombre.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            condiciones.append("(fiApellidos LIKE %s OR fiNombres LIKE %s)")
+            params += [prefijo, prefijo]
+        if diezmo is not None:
+            condiciones.append("COALESCE(fiDiezmo, 0) > 0" if diezmo else "COALESCE(fiDiezmo, 0) = 0")
+        
+        if limite is not None:
+            columnas = con_columnas(columnas, ORDEN_FIELES)
+            if cursor_pagina:
+                valores = valores_sin_nulos(decodificar_cursor(cursor_pagina, len(ORDEN_FIELES)))
+                condicion, indices = condicion_despues_de(CLAVE_FIELES)
+                condiciones.append(condicion)
+                params += parametros_despues_de(valores, indices)
+        
+        sql = f"SELECT {columnas} FROM fieles WHERE {' AND '.join(condiciones)} ORDER BY {', '.join(CLAVE_FIELES)}"
+        if limite is not None:
+            # Una fila de más para saber si hay página siguiente
+            sql += " LIMIT %s"
+            params.append(limite + 1)
         
+        conn = conectar_db(test_mode=test_mode)
+        cursor = cursor_filas(conn, columnar)
+        cursor.execute(sql, params)
         fieles = cursor.fetchall()
         print(f"✅ Encontrados {len(fieles)} fieles")
-        return fieles
         
+        if limite is None:
+            return RespuestaJSON(tabla_columnar(cursor, fieles) if columnar else fieles)
+        
+        hay_mas = len(fieles) > limite
+        fieles = fieles[:limite]
+        siguiente = None
+        if hay_mas:
+            ultimo = fieles[-1]
+            if columnar:
+                nombres = columnas_cursor(cursor)
+                siguiente = codificar_cursor(valores_sin_nulos(ultimo[nombres.index(columna)] for columna in ORDEN_FIELES))
+            else:
+                siguiente = codificar_cursor(valores_sin_nulos(ultimo[columna] for columna in ORDEN_FIELES))
+        return RespuestaJSON({
+            "fieles": tabla_columnar(cursor, fieles) if columnar else fieles,
+            "siguiente": siguiente,
+            "limite": limite
+        })
+        
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ ERROR obteniendo fieles: {e}")
         raise HTTPException(status_code=500, detail=f"Error al obtener fieles: {str(e)}")
@@ -569,7 +757,12 @@ def obtener_fieles(sede_id: str, auth=Depends(get_current_user), test_mode: bool
 
 # ================== ENDPOINT PARA OBTERNE DETALLES DEL FIEL ==================
 @app.get("/fieles/detalle/{fiel_id}")
-def obtener_fiel_detalle(fiel_id: int, auth=Depends(get_current_user), test_mode: bool = False):
+def obtener_fiel_detalle(
+    fiel_id: int,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("fieles"))
+):
     """Obtener un fiel específico por ID"""
     conn = None
     cursor = None
@@ -578,7 +771,7 @@ def obtener_fiel_detalle(fiel_id: int, auth=Depends(get_current_user), test_mode
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        cursor.execute("SELECT * FROM fieles WHERE fiID = %s", (fiel_id,))
+        cursor.execute(f"SELECT {columnas} FROM fieles WHERE fiID = %s", (fiel_id,))
         fiel = cursor.fetchone()
         
         if not fiel:
@@ -602,25 +795,22 @@ def obtener_fiel_detalle(fiel_id: int, auth=Depends(get_current_user), test_mode
 @app.get("/nuevo-codigo-fiel")
 def obtener_nuevo_codigo_fiel(auth=Depends(get_current_user), test_mode: bool = False):
     """Obtener el siguiente código disponible para fiel"""
-    conn = None
-    cursor = None
     try:
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)  # ← Esto hace que sea diccionario
-        cursor.execute("SELECT MAX(fiCod)+1 as nuevoCodigo FROM fieles")
-        resultado = cursor.fetchone()
-        nuevo_codigo = resultado.get('nuevoCodigo', 1001)  # ← Corregido
+        # Orientativo: el código definitivo se asigna al crear el fiel
+        nuevo_codigo = asignador_codigos.previsto(test_mode, "fieles")
         print(f"▶️ Nuevo código del fiel: {nuevo_codigo}")
         return {"nuevoCodigo": nuevo_codigo}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
 
 # ================== ENDPOINT PARA CREAR UN FIEL ==================
 @app.post("/fieles")
-def crear_fiel(fiel: FielCreate, auth=Depends(get_current_user), test_mode: bool = False):
+def crear_fiel(
+    fiel: FielCreate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("fieles"))
+):
     fiel = convertir_campos_texto_mayusculas(fiel)
     conn = None
     cursor = None
@@ -629,10 +819,11 @@ def crear_fiel(fiel: FielCreate, auth=Depends(get_current_user), test_mode: bool
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        # Verificar si el código ya existe
-        cursor.execute("SELECT fiID FROM fieles WHERE fiCod = %s", (fiel.fiCod,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="El código de fiel ya existe")
+        # Asignar el código en el servidor (secuencia atómica)
+        def codigo_ocupado(codigo):
+            cursor.execute("SELECT fiID FROM fieles WHERE fiCod = %s", (codigo,))
+            return cursor.fetchone() is not None
+        fiel.fiCod = asignador_codigos.asignar(test_mode, "fieles", codigo_ocupado)
         
         # Convertir fechas None a NULL para MySQL
         fec_nacido = fiel.fiFecNacido if fiel.fiFecNacido else None
@@ -657,9 +848,11 @@ def crear_fiel(fiel: FielCreate, auth=Depends(get_current_user), test_mode: bool
         cursor.execute(sql, valores)
         conn.commit()
         new_id = conn.insert_id()
+        fiel_guardado(test_mode, new_id, fiel)
+        invalidar_nombres_fieles(cursor)
         
         # Obtener el registro creado
-        cursor.execute("SELECT * FROM fieles WHERE fiID = %s", (new_id,))
+        cursor.execute(f"SELECT {columnas} FROM fieles WHERE fiID = %s", (new_id,))
         nuevo_fiel = cursor.fetchone()
         
         print("✅ Fiel creado correctamente")
@@ -682,7 +875,13 @@ def crear_fiel(fiel: FielCreate, auth=Depends(get_current_user), test_mode: bool
 
 # ================== ENDPOINT PARA ACTUALIZAR FIEL ==================
 @app.put("/fieles/{fiel_id}")
-def actualizar_fiel(fiel_id: int, fiel: FielUpdate, auth=Depends(get_current_user), test_mode: bool = False):
+def actualizar_fiel(
+    fiel_id: int,
+    fiel: FielUpdate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnas: str = Depends(campos("fieles"))
+):
     fiel = convertir_campos_texto_mayusculas(fiel)
     conn = None
     cursor = None
@@ -725,9 +924,11 @@ def actualizar_fiel(fiel_id: int, fiel: FielUpdate, auth=Depends(get_current_use
         
         cursor.execute(sql, valores)
         conn.commit()
+        fiel_guardado(test_mode, fiel_id, fiel)
+        invalidar_nombres_fieles(cursor)
         
         # Obtener el registro actualizado
-        cursor.execute("SELECT * FROM fieles WHERE fiID = %s", (fiel_id,))
+        cursor.execute(f"SELECT {columnas} FROM fieles WHERE fiID = %s", (fiel_id,))
         fiel_actualizado = cursor.fetchone()
         
         print("✅ Fiel actualizado correctamente")
@@ -768,6 +969,7 @@ def eliminar_fiel(fiel_id: int, auth=Depends(get_current_user), test_mode: bool
         # Soft delete - cambiar situación a 0
         cursor.execute("UPDATE fieles SET Situacion = 0 WHERE fiID = %s", (fiel_id,))
         conn.commit()
+        fiel_eliminado(test_mode, fiel_id)
         
         print(f"✅ Fiel '{fiel['fiNombres']} {fiel['fiApellidos']}' eliminado correctamente")
         return {"message": f"Fiel '{fiel['fiNombres']} {fiel['fiApellidos']}' eliminado correctamente"}
@@ -783,9 +985,43 @@ def eliminar_fiel(fiel_id: int, auth=Depends(get_current_user), test_mode: bool
         if conn:
             conn.close()
 
+# ================== BÚSQUEDA INCREMENTAL DE FIELES Y DONANTES ==================
+@app.get("/buscar/fieles")
+def buscar_fieles_endpoint(
+    q: str = Query(..., min_length=1),
+    limite: int = Query(LIMITE_RESULTADOS, ge=1, le=LIMITE_MAXIMO),
+    sede: int = Depends(sede_autorizada),
+    test_mode: bool = False
+):
+    """Primeros fieles activos de la sede cuyo nombre, apellidos, NIF o código empiezan por `q`"""
+    try:
+        return {"success": True, "resultados": buscar_fieles(test_mode, sede, q, limite)}
+    except Exception as e:
+        print(f"❌ ERROR buscando fieles: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/buscar/donantes")
+def buscar_donantes_endpoint(
+    q: str = Query(..., min_length=1),
+    tipo: Optional[int] = None,
+    limite: int = Query(LIMITE_RESULTADOS, ge=1, le=LIMITE_MAXIMO),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """Primeros donantes cuyo nombre o código empiezan por `q` (opcionalmente de un DoTipo)"""
+    try:
+        return {"success": True, "resultados": buscar_donantes(test_mode, q, tipo, limite)}
+    except Exception as e:
+        print(f"❌ ERROR buscando donantes: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
 # ================== ENDPOINTS PARA USUARIOS ==================
 @app.get("/usuarios")
-def obtener_usuarios(auth=Depends(get_current_user), test_mode: bool = False):
+def obtener_usuarios(
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
     """Obtener todos los usuarios - Solo administradores"""
     conn = None
     cursor = None
@@ -795,7 +1031,7 @@ def obtener_usuarios(auth=Depends(get_current_user), test_mode: bool = False):
         
         print("▶️ Obteniendo usuarios")
         conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor = cursor_filas(conn, columnar)
         
         cursor.execute("""
             SELECT UsID, UsCod, UsSedes, UsNivel, UsNombre, UsPermisos, 
@@ -806,7 +1042,7 @@ def obtener_usuarios(auth=Depends(get_current_user), test_mode: bool = False):
         
         usuarios = cursor.fetchall()
         print(f"✅ Encontrados {len(usuarios)} usuarios")
-        return usuarios
+        return RespuestaJSON(tabla_columnar(cursor, usuarios) if columnar else usuarios)
         
     except HTTPException:
         raise
@@ -861,36 +1097,18 @@ def obtener_usuario_detalle(usuario_id: int, auth=Depends(get_current_user), tes
 @app.get("/nuevo-codigo-usuario")
 def obtener_nuevo_codigo_usuario(auth=Depends(get_current_user), test_mode: bool = False):
     """Obtener el siguiente código disponible para usuario"""
-    conn = None
-    cursor = None
     try:
         verificar_admin(auth)
         
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor()
-        
-        # Buscar el siguiente código alfanumérico disponible
-        cursor.execute("SELECT UsCod FROM usuarios ORDER BY UsCod DESC LIMIT 1")
-        resultado = cursor.fetchone()
-        
-        if resultado and resultado[0]:
-            ultimo_codigo = resultado[0]
-            # Extraer número del código (ej: USR001 -> 001)
-            if ultimo_codigo.startswith('USR'):
-                numero = int(ultimo_codigo[3:]) + 1
-            else:
-                numero = 1
-        else:
-            numero = 1
-            
+        # Orientativo: el código definitivo se asigna al crear el usuario
+        numero = asignador_codigos.previsto(test_mode, "usuarios")
         nuevo_codigo = f"USR{numero:03d}"
         return {"nuevoCodigo": nuevo_codigo}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if cursor: cursor.close()
-        if conn: conn.close()
 
 # ================== ENDPOINT PARA CREAR USUARIO ==================
 @app.post("/usuarios")
@@ -906,9 +1124,15 @@ def crear_usuario(usuario: UsuarioCreate, auth=Depends(get_current_user), test_m
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        # Verificar si el código ya existe
-        cursor.execute("SELECT UsID FROM usuarios WHERE UsCod = %s", (usuario.UsCod,))
-        if cursor.fetchone():
+        def codigo_ocupado(codigo):
+            cursor.execute("SELECT UsID FROM usuarios WHERE UsCod = %s", (codigo,))
+            return cursor.fetchone() is not None
+        
+        # Códigos automáticos (vacío o USRnnn) se asignan en el servidor; un login propio se respeta
+        if not usuario.UsCod or re.fullmatch(r"USR\d+", usuario.UsCod.strip()):
+            numero = asignador_codigos.asignar(test_mode, "usuarios", lambda n: codigo_ocupado(f"USR{n:03d}"))
+            usuario.UsCod = f"USR{numero:03d}"
+        elif codigo_ocupado(usuario.UsCod):
             raise HTTPException(status_code=400, detail="El código de usuario ya existe")
         
         # Convertir fechas None a NULL para MySQL
@@ -1114,7 +1338,12 @@ def cambiar_password(usuario_id: int, nueva_password: str, auth=Depends(get_curr
 
 # ================== ENDPOINTS PARA REPORTES ==================
 @app.post("/api/reportes/ingresos-gastos")
-async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mode: bool = False):
+@compartir_lectura(sede=lambda kwargs: kwargs["request"].codigoSede)
+def obtener_ingresos_gastos(
+    request: ReporteIngresosGastosRequest,
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
     print("=== INICIO REPORTE INGRESOS-GASTOS ===")
     print(f"Datos recibidos: {request}")
     
@@ -1124,14 +1353,16 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
         connection = conectar_db(test_mode=test_mode)
         print("Conexión exitosa")
         
-        # Para pymysql, usar DictCursor
+        # Para pymysql, usar DictCursor (tuplas en formato columnar)
         print("Creando cursor...")
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        cursor = cursor_filas(connection, columnar)
         print("Cursor creado exitosamente")
+        asegurar_tablas_archivo(cursor)
+        tabla, params_tabla = fuente_movimientos(cursor, request.codigoSede, request.fechaInicial, request.fechaFinal)
         
         # Construir consulta
         print("Construyendo consulta SQL...")
-        sql_query = """
+        sql_query = f"""
             SELECT 
                 m.MoID,
                 m.MoFecha, 
@@ -1147,7 +1378,7 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
                 m.MoTGas, 
                 m.MoRubr, 
                 l.LoNombre AS Sede
-            FROM movimientos m
+            FROM {tabla} m
             LEFT JOIN locales l ON m.MoSede = l.LoCod
             LEFT JOIN tipinggas t ON m.MoTiMo = t.GaCod
             LEFT JOIN opcionbtns o ON m.MoTiMo = o.OpTipoOp AND m.MoTGas = o.OpCod
@@ -1157,7 +1388,7 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
               AND m.MoFecha <= %s
         """
         
-        params = [request.codigoSede, request.fechaInicial, request.fechaFinal]
+        params = [*params_tabla, request.codigoSede, request.fechaInicial, request.fechaFinal]
         # Filtro de domingos SI está marcado
         if request.soloDomingos:
             sql_query += " AND DAYOFWEEK(m.MoFecha) = 1"
@@ -1179,7 +1410,8 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
         
         # Calcular resumen
         print("Calculando resumen...")
-        resumen = calcular_resumen_movimientos(movimientos)
+        columnas = columnas_cursor(cursor) if columnar else None
+        resumen = calcular_resumen_movimientos(movimientos, columnas)
         print(f"Resumen calculado: {resumen}")
         
         cursor.close()
@@ -1188,7 +1420,7 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
         
         resultado = {
             "success": True,
-            "movimientos": movimientos,
+            "movimientos": {"columns": columnas, "rows": movimientos} if columnar else movimientos,
             "resumen": resumen,
             "parametros": {
                 "sede": request.codigoSede,
@@ -1199,7 +1431,7 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
         }
         
         print("=== REPORTE EXITOSO ===")
-        return resultado
+        return RespuestaJSON(resultado)
         
     except Exception as e:
         print(f"=== ERROR EN REPORTE ===")
@@ -1212,18 +1444,43 @@ async def obtener_ingresos_gastos(request: ReporteIngresosGastosRequest, test_mo
 
 # ================== ENDPOINT PARA DIEZMOS Y OFRENDAS ==================
 @app.post("/api/reportes/diezmos-ofrendas")
-async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_mode: bool = False):
+@compartir_lectura(sede=lambda kwargs: kwargs["request"].codigoSede)
+def obtener_diezmos_ofrendas(
+    request: ReporteDiezmosOfrendasRequest,
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
     print("=== INICIO REPORTE DIEZMOS Y OFRENDAS ===")
     print(f"Datos recibidos: {request}")
     
     try:
         connection = conectar_db(test_mode=test_mode)
-        cursor = connection.cursor(pymysql.cursors.DictCursor)
+        cursor = cursor_filas(connection, columnar)
+        asegurar_tablas_archivo(cursor)
         
         # Consulta SQL según especificaciones del PDF
         if request.soloDomingos:
             # SOBRE LOS INGRESOS EN EL CULTO (DOMINGOS)
-            sql_query = """
+            # Meses cerrados desde el resumen congelado; el tramo abierto desde movimientos
+            asegurar_tablas_resumen(cursor)
+            corte = corte_resumenes(cursor, request.codigoSede, request.fechaInicial)
+            tabla, params_tabla = fuente_movimientos(
+                cursor, request.codigoSede, max(corte, como_fecha(request.fechaInicial)), request.fechaFinal
+            )
+            sql_query = f"""
+                SELECT 
+                    RdoFecha AS MoFecha,
+                    'DIEZMOS+OFRENDAS' AS OpNombre,
+                    'Culto Dominical' AS MoDesc,
+                    RdoCaja AS Caja,
+                    RdoBanco AS Banco,
+                    RdoImporte AS Importe
+                FROM resumen_domingos
+                WHERE RdoSede = %s 
+                AND RdoFecha >= %s 
+                AND RdoFecha <= %s
+                AND RdoFecha < %s
+                UNION ALL
                 SELECT 
                     m.MoFecha,
                     'DIEZMOS+OFRENDAS' AS OpNombre,
@@ -1231,20 +1488,22 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
                     SUM(m.MoCChica) AS Caja,
                     SUM(m.MoImporte) AS Banco,
                     SUM(m.MoCChica + m.MoImporte) AS Importe
-                FROM movimientos m
+                FROM {tabla} m
                 INNER JOIN opcionbtns o ON o.OpTipoOp = m.MoTiMo AND o.OpCod = m.MoTGas
                 WHERE m.MoSede = %s 
                 AND m.MoTiMo = 100 
                 AND m.MoTGas IN (2,3,4,9) 
                 AND m.MoFecha >= %s 
                 AND m.MoFecha <= %s
+                AND m.MoFecha >= %s
                 AND DAYOFWEEK(m.MoFecha) = 1
                 GROUP BY m.MoFecha
-                ORDER BY m.MoFecha, o.OpCod
+                ORDER BY MoFecha
             """
         else:
             # SOBRE LOS INGRESOS: DIEZMOS, OFRENDAS Y OTROS ENTRE FECHAS
-            sql_query = """
+            tabla, params_tabla = fuente_movimientos(cursor, request.codigoSede, request.fechaInicial, request.fechaFinal)
+            sql_query = f"""
                 SELECT 
                     m.MoFecha,
                     o.OpNombre,
@@ -1252,7 +1511,7 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
                     m.MoCChica AS Caja,
                     m.MoImporte AS Banco,
                     (m.MoImporte + m.MoCChica) AS Importe
-                FROM movimientos m
+                FROM {tabla} m
                 INNER JOIN opcionbtns o ON o.OpTipoOp = m.MoTiMo AND o.OpCod = m.MoTGas
                 WHERE m.MoSede = %s 
                 AND m.MoTiMo = 100 
@@ -1263,6 +1522,10 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
             """
         
         params = [request.codigoSede, request.fechaInicial, request.fechaFinal]
+        if request.soloDomingos:
+            params = [*params, corte, *params_tabla, *params, corte]
+        else:
+            params = [*params_tabla, *params]
         
         print(f"SQL: {sql_query}")
         print(f"Parámetros: {params}")
@@ -1273,8 +1536,14 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
         print(f"Movimientos encontrados: {len(movimientos)}")
         
         # Calcular resumen
+        if columnar:
+            tabla = tabla_columnar(cursor, movimientos)
+            i_importe = tabla["columns"].index('Importe')
+            importes = (fila[i_importe] for fila in movimientos)
+        else:
+            importes = (mov.get('Importe', 0) for mov in movimientos)
         resumen = {
-            'totalImporte': sum(float(mov.get('Importe', 0) or 0) for mov in movimientos),
+            'totalImporte': sum(float(importe or 0) for importe in importes),
             'cantidadMovimientos': len(movimientos),
             'porDomingos': request.soloDomingos
         }
@@ -1282,9 +1551,9 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
         cursor.close()
         connection.close()
         
-        return {
+        return RespuestaJSON({
             "success": True,
-            "movimientos": movimientos,
+            "movimientos": tabla if columnar else movimientos,
             "resumen": resumen,
             "parametros": {
                 "sede": request.codigoSede,
@@ -1292,7 +1561,7 @@ async def obtener_diezmos_ofrendas(request: ReporteDiezmosOfrendasRequest, test_
                 "fechaFinal": request.fechaFinal,
                 "soloDomingos": request.soloDomingos
             }
-        }
+        })
         
     except Exception as e:
         print(f"ERROR: {str(e)}")
@@ -1308,18 +1577,22 @@ def obtener_segundo_nivel(tipo: int, sede: int, auth=Depends(get_current_user),
     cursor = None
     try:
         print(f"▶️ Obteniendo segundo nivel: tipo={tipo}, sede={sede}")
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        
-        query = """
-        SELECT MnuCod, MnuNombre, MnuSigAccion 
-        FROM mnusedesbtn 
-        WHERE MnuTipoOp = %s AND mnuSede = %s 
-        ORDER BY mnuPeso
-        """
-        
-        cursor.execute(query, (tipo, sede))
-        opciones = cursor.fetchall()
+        clave_cache = ("mnusedesbtn", test_mode, sede, "segundo-nivel", tipo)
+        opciones = cache_menus.obtener(clave_cache)
+        if opciones is None:
+            conn = conectar_db(test_mode=test_mode)
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+            
+            query = """
+            SELECT MnuCod, MnuNombre, MnuSigAccion 
+            FROM mnusedesbtn 
+            WHERE MnuTipoOp = %s AND mnuSede = %s 
+            ORDER BY mnuPeso
+            """
+            
+            cursor.execute(query, (tipo, sede))
+            opciones = cursor.fetchall()
+            cache_menus.guardar(clave_cache, opciones)
         
         print(f"✅ Encontradas {len(opciones)} opciones")
         return SegundoNivelResult(
@@ -1411,33 +1684,65 @@ def obtener_tercer_nivel(accion: str, sede: int, auth=Depends(get_current_user),
 
 # ================== ENDPOINT PARA CARGA DE MOVIMIENTOS ==================
 @app.get("/movimientos")
-def obtener_movimientos(año: int, mes: int, sede: int, auth=Depends(get_current_user), test_mode: bool = False):
-    """Obtener movimientos de un período específico"""
+@compartir_lectura(sede=lambda kwargs: kwargs["sede"])
+def obtener_movimientos(
+    año: int,
+    mes: int = Query(..., ge=1, le=12),
+    sede: int = Depends(sede_autorizada),
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
+    """Obtener movimientos de un período específico (servidos desde la caché mensual)"""
+    entrada = cache_meses.obtener(test_mode, sede, año, mes, version=lambda: version_sede(test_mode, sede))
+    if entrada is None:
+        entrada = cargar_mes_movimientos(sede, año, mes, test_mode)
+    movimientos = entrada["movimientos"]
+    return RespuestaJSON({
+        "success": True,
+        "movimientos": columnar_mes(movimientos) if columnar else movimientos,
+        "totales": entrada["totales"],
+        "cursor": entrada["cursor"]
+    })
+
+def cargar_mes_movimientos(sede: int, año: int, mes: int, test_mode: bool):
     conn = None
     cursor = None
     try:
         print(f"▶️ Obteniendo movimientos: año={año}, mes={mes}, sede={sede}")
+        generacion = cache_meses.generacion(test_mode, sede)
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_archivo(cursor)
+        # Cursor del feed ANTES de leer: lo que cambie después llegará por /cambios-movimientos
+        cursor_cambios = ultimo_cambio(cursor, sede)
         
         # SQL para obtener movimientos del mes/año/sede
-        query = """
-        SELECT MoID, MoFecha, MoDesc, MoCChica, MoSaldoCaja, MoImporte, MoSaldoBanco
-        FROM movimientos 
+        inicio_mes = datetime(año, mes, 1)
+        tabla, params_tabla = fuente_movimientos(cursor, sede, inicio_mes, inicio_mes)
+        query = f"""
+        SELECT {", ".join(COLUMNAS_MES)}
+        FROM {tabla} m
         WHERE MoSede = %s 
         AND YEAR(MoFecha) = %s 
         AND MONTH(MoFecha) = %s
         ORDER BY MoFecha, MoID
         """
         
-        cursor.execute(query, (sede, año, mes))
+        cursor.execute(query, (*params_tabla, sede, año, mes))
         movimientos = cursor.fetchall()
+        cerrado = (año, mes) in meses_cerrados(cursor, sede, datetime(año, mes, 1))
         
-        print(f"✅ Encontrados {len(movimientos)} movimientos")
-        return {
-            "success": True,
-            "movimientos": movimientos
+        entrada = {
+            "movimientos": movimientos,
+            "totales": calcular_totales(movimientos),
+            "cursor": cursor_cambios
         }
+        cache_meses.guardar(test_mode, sede, año, mes, entrada, cerrado, generacion)
+        
+        print(f"✅ Encontrados {len(movimientos)} movimientos")
+        return entrada
         
     except Exception as e:
         print(f"❌ ERROR obteniendo movimientos: {e}")
@@ -1448,9 +1753,98 @@ def obtener_movimientos(año: int, mes: int, sede: int, auth=Depends(get_current
         if conn:
             conn.close()            
 
+# ================== CAMBIOS DE MOVIMIENTOS (SINCRONIZACIÓN POR DELTAS) ==================
+@app.get("/cambios-movimientos")
+def obtener_cambios_movimientos(
+    desde: int = Query(0, ge=0, description="Cursor devuelto por /movimientos o por la llamada anterior"),
+    limite: int = Query(LIMITE_CAMBIOS, ge=1, le=LIMITE_MAXIMO_PAGINA),
+    sede: int = Depends(sede_autorizada),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """
+    Altas, modificaciones y bajas de movimientos de la sede posteriores al cursor.
+    Los CaID de una sede siguen el orden de commit (cambios.py), así que un
+    cambio confirmado después nunca queda por detrás del cursor.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        resultado = leer_cambios(cursor, sede, desde, limite)
+        purgar_cambios_antiguos(conn)
+        return RespuestaJSON({"success": True, **resultado})
+
+    except Exception as e:
+        print(f"❌ ERROR obteniendo cambios de movimientos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# ================== EVENTOS DE MOVIMIENTOS EN TIEMPO REAL (SSE) ==================
+@app.post("/eventos-movimientos/token")
+def token_eventos_movimientos(
+    sede: int = Depends(sede_autorizada),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """
+    Token corto para abrir /eventos-movimientos con EventSource (que no admite
+    cabeceras). Solo vale para el mismo test_mode con el que se pidió.
+    """
+    return {
+        "token": crear_token_eventos(auth, sede, test_mode),
+        "expira_en": EXPIRACION_TOKEN_EVENTOS_SEGUNDOS
+    }
+
+@app.get("/eventos-movimientos")
+async def eventos_movimientos(
+    sede: int = Depends(sede_autorizada_eventos),
+    test_mode: bool = False,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Server-Sent Events del libro de la sede: movimiento-grabado, movimiento-editado,
+    movimiento-eliminado y saldos-recalculados (y `reiniciar` si hay que recargar).
+    Sustituye al sondeo periódico de /movimientos.
+
+    Autenticación: cabecera Authorization como el resto de la API o, desde el
+    navegador, ?token= con el token de POST /eventos-movimientos/token:
+        const { token } = await api.post(`/eventos-movimientos/token?sede=${sede}`)
+        new EventSource(`/eventos-movimientos?sede=${sede}&token=${token}`)
+    El token solo se comprueba al conectar. Si EventSource no puede reconectar
+    (token caducado, 401), hay que pedir otro token y abrir un EventSource nuevo.
+    """
+    ultimo_id = int(last_event_id) if last_event_id and last_event_id.strip().isdigit() else None
+    suscripcion, pendientes = bus_movimientos.suscribir((test_mode, sede), ultimo_id)
+    if suscripcion is None:
+        raise HTTPException(status_code=503, detail="Demasiadas conexiones de eventos abiertas")
+    return StreamingResponse(
+        flujo_eventos(suscripcion, pendientes),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ================== ENDPOINT PARA GRABAR DE MOVIMIENTOS ==================
 @app.post("/grabar-movimiento")
-def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_user), test_mode: bool = False):
+def grabar_movimiento(
+    movimiento: MovimientoCreate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    idempotency_key: Optional[str] = Header(None)
+):
+    return ejecutar_idempotente(
+        idempotency_key, auth, "grabar-movimiento", test_mode, movimiento,
+        lambda idempotencia: _grabar_movimiento(movimiento, auth, test_mode, idempotencia)
+    )
+
+def _grabar_movimiento(movimiento: MovimientoCreate, auth, test_mode: bool, idempotencia):
+    autorizar_sede(auth, movimiento.sede, test_mode)
     movimiento = convertir_campos_texto_mayusculas(movimiento)
     # 🔍 PRINTS PARA DEBUG
     # print("=" * 50)
@@ -1467,10 +1861,23 @@ def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_use
     try:
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor()
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_diezmos(cursor)
+        previa = idempotencia.reservar(cursor)
+        if previa is not None:
+            return previa
         
         # Crear fecha completa
         fecha = f"{movimiento.año}-{movimiento.mes:02d}-{movimiento.dia:02d}"
 
+        # Un mes cerrado tiene sus totales congelados (resumenes.py): no admite escrituras
+        try:
+            fecha_movimiento = datetime(movimiento.año, movimiento.mes, movimiento.dia).date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Fecha no válida: {movimiento.dia}/{movimiento.mes}/{movimiento.año}")
+        if (movimiento.año, movimiento.mes) in meses_cerrados(cursor, movimiento.sede, fecha_movimiento):
+            raise HTTPException(status_code=400, detail=f"El período {movimiento.mes}/{movimiento.año} está cerrado")
+
         # El frontend ya envía los valores con signo correcto, usar directamente
         if movimiento.origen == "caja":
             caja = movimiento.importe  # Ya viene con signo correcto desde frontend
@@ -1512,7 +1919,7 @@ def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_use
         print(f"🔍 DEBUG - Valores para BD: caja={caja}, banco={banco}")
 
         cursor.execute(query, valores)
-        conn.commit()
+        ids_insertados = [cursor.lastrowid]
 
         # 🔄 NUEVO: Verificar si necesita doble grabación para traspasos
         if (movimiento.tipoOperacion == 300 and 
@@ -1552,6 +1959,7 @@ def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_use
                 )
                 
                 cursor.execute(query_adicional, valores_adicionales)
+                ids_insertados.append(cursor.lastrowid)
                 
             elif movimiento.tercerNivel == 42:
                 # Caso B: Banco a Caja
@@ -1587,15 +1995,30 @@ def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_use
                 )
                 
                 cursor.execute(query_adicional, valores_adicionales)
+                ids_insertados.append(cursor.lastrowid)
 
-        # Commit final para ambos registros
+        # Commit final para ambos registros, el total anual de diezmos (el registro
+        # adicional es un traspaso, no cuenta) y su entrada en el registro de cambios
+        ajustar_diezmos(cursor, altas=[dict(zip(COLUMNAS_MOVIMIENTO, valores))])
+        registrar_cambios(cursor, movimiento.sede, ALTA, ids_insertados)
+        respuesta = {"success": True, "message": "Movimiento grabado correctamente"}
+        idempotencia.guardar(cursor, respuesta)
         conn.commit()  
+        invalidar_mes(test_mode, movimiento.sede, fecha)
+        publicar_movimientos(test_mode, movimiento.sede, MOVIMIENTO_GRABADO,
+                             ids=ids_insertados, fecha=fecha, usuario=auth.get("sub"))
 
         print("✅ Movimiento grabado correctamente")
-        return {"success": True, "message": "Movimiento grabado correctamente"}
+        return respuesta
         
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
     except Exception as e:
         print(f"❌ ERROR grabando movimiento: {e}")
+        if conn:
+            conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
     finally:
         if cursor:
@@ -1603,9 +2026,286 @@ def grabar_movimiento(movimiento: MovimientoCreate, auth=Depends(get_current_use
         if conn:
             conn.close()            
 
+# ============ FUNCION PARA ARMAR LAS FILAS DE UN MOVIMIENTO ==================
+def filas_movimiento(movimiento, fecha, usuario):
+    """Tuplas para insertar_movimientos (con el doble registro de traspasos). Saldos a 0: se recalculan"""
+    caja = movimiento.importe if movimiento.origen == "caja" else 0
+    banco = movimiento.importe if movimiento.origen == "banco" else 0
+    comunes = (movimiento.moDona or 0, movimiento.moPers or 0, movimiento.moSedeDes or 0, usuario)
+
+    filas = [(
+        movimiento.sede, movimiento.tipoOperacion, movimiento.segundoNivel or 0,
+        movimiento.tercerNivel or 0, fecha, movimiento.descripcion,
+        banco, caja, 0, 0, *comunes
+    )]
+
+    if movimiento.tipoOperacion == 300 and movimiento.segundoNivel == 30:
+        if movimiento.tercerNivel == 41:
+            # Caja a Banco: lo que sale de caja entra en banco
+            filas.append((
+                movimiento.sede, movimiento.tipoOperacion, movimiento.segundoNivel,
+                movimiento.tercerNivel, fecha, "DIEZMOS + OFRENDAS DEL CULTO",
+                -caja, 0, 0, 0, *comunes
+            ))
+        elif movimiento.tercerNivel == 42:
+            # Banco a Caja: lo que sale del banco entra en caja
+            filas.append((
+                movimiento.sede, movimiento.tipoOperacion, movimiento.segundoNivel,
+                movimiento.tercerNivel, fecha, "BANCA A CAJA CHICA",
+                0, -banco, 0, 0, *comunes
+            ))
+    return filas
+
+# ================== ENDPOINT PARA GRABAR UN LOTE DE MOVIMIENTOS ==================
+@app.post("/grabar-movimientos-lote")
+def grabar_movimientos_lote(lote: MovimientosLote, auth=Depends(get_current_user), test_mode: bool = False):
+    """Grabar varios movimientos de una sede en una transacción, con un único recálculo de saldos"""
+    autorizar_sede(auth, lote.sede, test_mode)
+    conn = None
+    cursor = None
+    try:
+        print(f"▶️ Grabando lote de {len(lote.movimientos)} movimientos para sede {lote.sede}")
+        if not lote.movimientos:
+            raise HTTPException(status_code=400, detail="El lote no contiene movimientos")
+
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_diezmos(cursor)
+
+        # 1. Validar todos los movimientos antes de grabar ninguno
+        resultados = []
+        fechas = []
+        for indice, movimiento in enumerate(lote.movimientos):
+            error = None
+            fecha = None
+            if movimiento.sede != lote.sede:
+                error = f"La sede {movimiento.sede} no coincide con la del lote"
+            elif movimiento.origen not in ("caja", "banco"):
+                error = f"Origen no válido: {movimiento.origen}"
+            else:
+                try:
+                    fecha = datetime(movimiento.año, movimiento.mes, movimiento.dia).date()
+                except ValueError:
+                    error = f"Fecha no válida: {movimiento.dia}/{movimiento.mes}/{movimiento.año}"
+            fechas.append(fecha)
+            resultados.append({"indice": indice, "success": error is None, "error": error})
+
+        fechas_validas = [fecha for fecha in fechas if fecha]
+        if fechas_validas:
+            cerrados = meses_cerrados(cursor, lote.sede, min(fechas_validas))
+            for resultado, fecha in zip(resultados, fechas):
+                if fecha and (fecha.year, fecha.month) in cerrados:
+                    resultado["success"] = False
+                    resultado["error"] = f"El período {fecha.month}/{fecha.year} está cerrado"
+
+        errores = sum(1 for resultado in resultados if not resultado["success"])
+        if errores:
+            print(f"⚠️ Lote rechazado: {errores} movimientos con errores")
+            return {
+                "success": False,
+                "message": f"Lote rechazado: {errores} movimientos con errores, no se grabó ninguno",
+                "resultados": resultados
+            }
+
+        # 2. Insertar todas las filas (incluidos los dobles registros de traspasos) en una sentencia
+        usuario = auth.get("sub", "XXX")
+        filas = []
+        for resultado, movimiento, fecha in zip(resultados, lote.movimientos, fechas):
+            movimiento = convertir_campos_texto_mayusculas(movimiento)
+            filas_mov = filas_movimiento(movimiento, fecha.isoformat(), usuario)
+            resultado["registros"] = len(filas_mov)
+            filas.extend(filas_mov)
+
+        ids_insertados = insertar_movimientos(cursor, filas)
+
+        # 3. Un solo recálculo desde la fecha más antigua del lote
+        recalculo = recalcular_saldos_desde(cursor, lote.sede, min(fechas))
+        ajustar_diezmos(cursor, altas=[dict(zip(COLUMNAS_MOVIMIENTO, fila)) for fila in filas])
+        registrar_cambios(cursor, lote.sede, ALTA, ids_insertados)
+        registrar_recalculo(cursor, lote.sede, recalculo, excluir=ids_insertados)
+        conn.commit()
+        invalidar_desde(test_mode, lote.sede, min(fechas))
+        publicar_movimientos(test_mode, lote.sede, MOVIMIENTO_GRABADO,
+                             ids=ids_insertados, fecha=min(fechas), usuario=usuario)
+        publicar_recalculo(test_mode, lote.sede, recalculo)
+
+        print(f"✅ Lote grabado: {len(filas)} registros, {recalculo['movimientos_actualizados']} saldos actualizados")
+        return {
+            "success": True,
+            "message": f"{len(lote.movimientos)} movimientos grabados correctamente",
+            "resultados": resultados,
+            "registros_insertados": len(filas),
+            "movimientos_recalculados": recalculo["movimientos_recalculados"],
+            "saldo_final_caja": recalculo["saldo_final_caja"],
+            "saldo_final_banco": recalculo["saldo_final_banco"]
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ ERROR grabando lote de movimientos: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# ================== ENDPOINT PARA IMPORTAR EXTRACTO BANCARIO (CSV) ==================
+FILAS_POR_LOTE_EXTRACTO = 500
+MAX_INCIDENCIAS_EXTRACTO = 500
+
+@app.post("/importar-extracto-banco")
+def importar_extracto_banco(
+    sede: int = Form(...),
+    archivo: UploadFile = File(...),
+    col_fecha: str = Form("Fecha"),
+    col_descripcion: str = Form("Concepto"),
+    col_importe: str = Form("Importe"),
+    separador: str = Form(";"),
+    formato_fecha: str = Form("%d/%m/%Y"),
+    decimal: str = Form(","),
+    codificacion: str = Form("utf-8-sig"),
+    tiene_cabecera: bool = Form(True),
+    reglas: Optional[str] = Form(None),
+    simular: bool = Form(False),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """Importar un extracto bancario CSV como movimientos de banco, marcando duplicados"""
+    autorizar_sede(auth, sede, test_mode)
+    try:
+        reglas_clasificacion = json.loads(reglas) if reglas else REGLAS_EXTRACTO_BANCO
+        if not isinstance(reglas_clasificacion, list):
+            raise ValueError("se esperaba una lista")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Reglas de clasificación no válidas: {e}")
+
+    conn = None
+    cursor = None
+    try:
+        print(f"▶️ Importando extracto '{archivo.filename}' para sede {sede}")
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+
+        # Los duplicados se buscan solo entre los movimientos anteriores a la importación
+        cursor.execute("SELECT COALESCE(MAX(MoID), 0) AS ultimo FROM movimientos")
+        ultimo_id_previo = cursor.fetchone()['ultimo']
+
+        usuario = auth.get("sub", "XXX")
+        resumen = {"filas_leidas": 0, "filas_importadas": 0, "duplicadas": 0, "rechazadas": 0}
+        incidencias = []
+        fechas_importadas = []
+        ids_importados = []
+
+        def anotar(tipo, linea, motivo, fecha=None, descripcion=None, importe=None):
+            resumen[tipo] += 1
+            if len(incidencias) < MAX_INCIDENCIAS_EXTRACTO:
+                incidencias.append({
+                    "linea": linea, "tipo": tipo, "motivo": motivo,
+                    "fecha": fecha, "descripcion": descripcion, "importe": importe
+                })
+
+        def procesar_lote(lote):
+            fechas = [fila[1] for fila in lote]
+            cerrados = meses_cerrados(cursor, sede, min(fechas))
+            cursor.execute("""
+            SELECT MoFecha, MoImporte, MoDesc
+            FROM movimientos
+            WHERE MoSede = %s AND MoFecha BETWEEN %s AND %s
+            AND MoDona != 9999 AND MoID <= %s
+            """, (sede, min(fechas), max(fechas), ultimo_id_previo))
+            existentes = {
+                (solo_fecha(fila['MoFecha']), round(float(fila['MoImporte'] or 0), 2), normalizar_descripcion(fila['MoDesc']))
+                for fila in cursor.fetchall()
+            }
+
+            filas = []
+            for linea, fecha, descripcion, importe, (timo, tgas, rubr) in lote:
+                if (fecha.year, fecha.month) in cerrados:
+                    anotar("rechazadas", linea, f"El período {fecha.month}/{fecha.year} está cerrado", fecha, descripcion, importe)
+                elif (fecha, importe, descripcion) in existentes:
+                    anotar("duplicadas", linea, "Ya existe un movimiento con la misma fecha, importe y descripción", fecha, descripcion, importe)
+                else:
+                    filas.append((sede, timo, tgas, rubr, fecha.isoformat(), descripcion, importe, 0, 0, 0, 0, 0, 0, usuario))
+                    fechas_importadas.append(fecha)
+
+            ids_importados.extend(insertar_movimientos(cursor, filas))
+            resumen["filas_importadas"] += len(filas)
+
+        # 1. Leer el CSV fila a fila y grabar por lotes
+        lote = []
+        for linea, fecha, descripcion, importe, error in leer_extracto(
+            archivo.file, col_fecha, col_descripcion, col_importe, separador,
+            formato_fecha, decimal, codificacion, tiene_cabecera
+        ):
+            resumen["filas_leidas"] += 1
+            if error:
+                anotar("rechazadas", linea, error)
+                continue
+            clasificacion = clasificar(descripcion, importe, reglas_clasificacion)
+            if clasificacion is None:
+                anotar("rechazadas", linea, "Ninguna regla de clasificación coincide", fecha, descripcion, importe)
+                continue
+            lote.append((linea, fecha, descripcion, importe, clasificacion))
+            if len(lote) >= FILAS_POR_LOTE_EXTRACTO:
+                procesar_lote(lote)
+                lote = []
+        if lote:
+            procesar_lote(lote)
+
+        # 2. Un único recálculo de saldos desde la fecha más antigua importada
+        recalculo = None
+        if fechas_importadas:
+            recalculo = recalcular_saldos_desde(cursor, sede, min(fechas_importadas))
+            registrar_cambios(cursor, sede, ALTA, ids_importados)
+            registrar_recalculo(cursor, sede, recalculo, excluir=ids_importados)
+
+        if simular:
+            conn.rollback()
+        else:
+            conn.commit()
+            if ids_importados:
+                invalidar_desde(test_mode, sede, min(fechas_importadas))
+                publicar_movimientos(test_mode, sede, MOVIMIENTO_GRABADO,
+                                     ids=ids_importados, fecha=min(fechas_importadas), usuario=usuario)
+                publicar_recalculo(test_mode, sede, recalculo)
+
+        print(f"✅ Extracto procesado: {resumen}")
+        return {
+            "success": True,
+            "message": "Simulación de importación completada" if simular else "Extracto importado correctamente",
+            "simulacion": simular,
+            **resumen,
+            "incidencias": incidencias,
+            "movimientos_recalculados": recalculo["movimientos_recalculados"] if recalculo else 0
+        }
+
+    except (ErrorExtracto, UnicodeDecodeError, csv.Error) as e:
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=400, detail=f"No se puede leer el extracto: {e}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ ERROR importando extracto: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 # ================== OBTENER CIERRES EXISTENTES ==================
 @app.get("/cierres/{anyo}")
-def obtener_cierres(anyo: int, sede: int = Query(...), auth=Depends(get_current_user), test_mode: bool = False):
+@compartir_lectura(sede=lambda kwargs: kwargs["sede"])
+def obtener_cierres(anyo: int, sede: int = Depends(sede_autorizada), auth=Depends(get_current_user), test_mode: bool = False):
     """Obtener cierres mensuales de un año específico"""
     conn = None
     cursor = None
@@ -1644,10 +2344,22 @@ def obtener_cierres(anyo: int, sede: int = Query(...), auth=Depends(get_current_
 
 # ================== CREAR CIERRE TEMPORAL ==================
 @app.post("/crear-cierre-temporal")
-def crear_cierre_temporal(cierre: CierreCreateTemporal, auth=Depends(get_current_user), test_mode: bool = False):
+def crear_cierre_temporal(
+    cierre: CierreCreateTemporal,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    idempotency_key: Optional[str] = Header(None)
+):
     """Crear cierre temporal - busca último registro del mes y crea cierre para revisión"""
+    return ejecutar_idempotente(
+        idempotency_key, auth, "crear-cierre-temporal", test_mode, cierre,
+        lambda idempotencia: _crear_cierre_temporal(cierre, auth, test_mode, idempotencia)
+    )
+
+def _crear_cierre_temporal(cierre: CierreCreateTemporal, auth, test_mode: bool, idempotencia):
     print("🚀 ENDPOINT crear-cierre-temporal INICIADO")
     print(f"📦 Datos recibidos: {cierre}")
+    autorizar_sede(auth, cierre.sede, test_mode)
     conn = None
     cursor = None
     meses_nombres = {
@@ -1658,6 +2370,11 @@ def crear_cierre_temporal(cierre: CierreCreateTemporal, auth=Depends(get_current
         print(f"▶️ Creando cierre temporal: {cierre}")
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_resumen(cursor)
+        previa = idempotencia.reservar(cursor)
+        if previa is not None:
+            return previa
 
         # En la validación, buscar en el mes SIGUIENTE:
         mes_a_verificar = cierre.mes + 1 if cierre.mes < 12 else 1
@@ -1677,28 +2394,17 @@ def crear_cierre_temporal(cierre: CierreCreateTemporal, auth=Depends(get_current
         if existe:
             raise HTTPException(status_code=400, detail=f"Ya existe un cierre para {cierre.mes}/{cierre.anyo}")
         
-        # Buscar último movimiento del mes para obtener saldos
+        # Saldos al final del último día del mes (último cierre + último movimiento desde él)
         import calendar
         ultimo_dia = calendar.monthrange(cierre.anyo, cierre.mes)[1]
-        fecha_fin = f"{cierre.anyo}-{cierre.mes:02d}-{ultimo_dia}"
-        
-        query_saldos = """
-        SELECT MoSaldoCaja, MoSaldoBanco
-        FROM movimientos 
-        WHERE MoSede = %s 
-        AND MoFecha <= %s
-        ORDER BY MoFecha DESC, MoID DESC
-        LIMIT 1
-        """
-        
-        cursor.execute(query_saldos, (cierre.sede, fecha_fin))
-        resultado_saldos = cursor.fetchone()
+        fecha_fin = datetime(cierre.anyo, cierre.mes, ultimo_dia).date()
+        resultado_saldos = saldos_en_fechas(cursor, cierre.sede, [fecha_fin])[fecha_fin]
         
-        if not resultado_saldos:
+        if resultado_saldos["origen"] == "sin_movimientos":
             raise HTTPException(status_code=400, detail=f"No hay movimientos registrados hasta {cierre.mes}/{cierre.anyo}")
         
-        saldo_caja = float(resultado_saldos['MoSaldoCaja'] or 0)
-        saldo_banco = float(resultado_saldos['MoSaldoBanco'] or 0)
+        saldo_caja = resultado_saldos['saldo_caja']
+        saldo_banco = resultado_saldos['saldo_banco']
         
         # Crear fecha del primer día del mes siguiente
         mes_siguiente = cierre.mes + 1 if cierre.mes < 12 else 1
@@ -1730,12 +2436,11 @@ def crear_cierre_temporal(cierre: CierreCreateTemporal, auth=Depends(get_current
         
         cursor.execute(query_crear, valores)
         cierre_id = cursor.lastrowid
-        conn.commit()
-        
-        print(f"✅ Cierre temporal creado con ID: {cierre_id}")
-        
-        # Devolver datos del cierre para revisión
-        return {
+        # Totales del mes congelados en la misma transacción que el cierre
+        crear_resumen_mes(cursor, cierre.sede, cierre.anyo, cierre.mes)
+        registrar_cambios(cursor, cierre.sede, ALTA, [cierre_id])
+        # Datos del cierre para revisión
+        respuesta = {
             "success": True,
             "message": "Cierre temporal creado para revisión",
             "cierre": {
@@ -1746,7 +2451,20 @@ def crear_cierre_temporal(cierre: CierreCreateTemporal, auth=Depends(get_current
                 "fecha": fecha_cierre
             }
         }
+        idempotencia.guardar(cursor, respuesta)
+        conn.commit()
+        # El mes pasa a estar cerrado (y el cierre aparece en el mes siguiente)
+        invalidar_desde(test_mode, cierre.sede, f"{cierre.anyo}-{cierre.mes:02d}-01")
+        publicar_movimientos(test_mode, cierre.sede, MOVIMIENTO_GRABADO,
+                             ids=[cierre_id], fecha=fecha_cierre, cierre=True, usuario=auth.get("sub"))
+        
+        print(f"✅ Cierre temporal creado con ID: {cierre_id}")
+        return respuesta
         
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
     except Exception as e:
         print(f"❌ ERROR creando cierre temporal: {e}")
         if conn:
@@ -1809,10 +2527,13 @@ def eliminar_cierre(cierre_id: int, auth=Depends(get_current_user), test_mode: b
        print(f"▶️ Eliminando cierre ID: {cierre_id}")
        conn = conectar_db(test_mode=test_mode)
        cursor = conn.cursor(pymysql.cursors.DictCursor)
+       asegurar_tabla_cambios(cursor)
+       asegurar_tablas_resumen(cursor)
+       asegurar_tablas_archivo(cursor)
        
        # 1. Obtener IDFinal (último cierre)
        query_ultimo = """
-       SELECT MoID AS IDFinal FROM movimientos 
+       SELECT MoID AS IDFinal, MoSede, MoFecha FROM movimientos 
        WHERE MoDona = 9999 ORDER BY MoFecha DESC LIMIT 1
        """
        
@@ -1823,14 +2544,30 @@ def eliminar_cierre(cierre_id: int, auth=Depends(get_current_user), test_mode: b
        if not ultimo or ultimo['IDFinal'] != cierre_id:
            raise HTTPException(status_code=400, detail="Solo se puede eliminar el último cierre mensual")
        
+       # El cierre está en el día 1 del mes siguiente al que cerraba: ese mes vuelve a estar abierto
+       fecha_cierre = ultimo['MoFecha']
+       año_cerrado, mes_cerrado = (fecha_cierre.year, fecha_cierre.month - 1) if fecha_cierre.month > 1 else (fecha_cierre.year - 1, 12)
+       # Un año archivado no se puede reabrir: sus movimientos ya no están en `movimientos`
+       if año_cerrado in años_archivados(cursor, ultimo['MoSede']):
+           raise HTTPException(status_code=400, detail=f"No se puede eliminar: el año {año_cerrado} está archivado")
+
        # 3. Eliminar el cierre
        query_eliminar = "DELETE FROM movimientos WHERE MoID = %s"
        cursor.execute(query_eliminar, (cierre_id,))
+       eliminar_resumen_mes(cursor, ultimo['MoSede'], año_cerrado, mes_cerrado)
+       registrar_cambios(cursor, ultimo['MoSede'], BAJA, [cierre_id])
        conn.commit()
+       invalidar_desde(test_mode, ultimo['MoSede'], f"{año_cerrado}-{mes_cerrado:02d}-01")
+       publicar_movimientos(test_mode, ultimo['MoSede'], MOVIMIENTO_ELIMINADO,
+                            ids=[cierre_id], cierre=True, usuario=auth.get("sub"))
        
        print("✅ Cierre eliminado correctamente")
        return {"success": True, "message": "Cierre eliminado correctamente"}
        
+   except HTTPException:
+       if conn:
+           conn.rollback()
+       raise
    except Exception as e:
        print(f"❌ ERROR eliminando cierre: {e}")
        if conn:
@@ -1844,98 +2581,46 @@ def eliminar_cierre(cierre_id: int, auth=Depends(get_current_user), test_mode: b
 
 # ================== PARA RE-CALCULAR LOS SALDOS ==================
 @app.post("/recalcular-saldos")
-def recalcular_saldos(sede: int = Query(...), auth=Depends(get_current_user), test_mode: bool = False):
+def recalcular_saldos(sede: int = Depends(sede_autorizada), auth=Depends(get_current_user), test_mode: bool = False):
     """Recalcular saldos desde el último cierre mensual"""
+    return _recalcular_saldos(sede, test_mode)
+
+def _recalcular_saldos(sede: int, test_mode: bool, progreso=None):
     conn = None
     cursor = None
     try:
         print(f"▶️ Iniciando recálculo de saldos para sede: {sede}")
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
         
-        # 1. Buscar último cierre mensual (saldo base)
-        print("🔍 Buscando último cierre mensual...")
-        query_ultimo_cierre = """
-        SELECT MoSaldoCaja, MoSaldoBanco, MoFecha 
-        FROM movimientos 
-        WHERE MoSede = %s AND MoDona = 9999 
-        ORDER BY MoFecha DESC LIMIT 1
-        """
-        
-        cursor.execute(query_ultimo_cierre, (sede,))
-        ultimo_cierre = cursor.fetchone()
+        # Recalcular desde el último cierre mensual (o desde el inicio si no hay cierres)
+        recalculo = recalcular_saldos_desde(cursor, sede, progreso=progreso)
         
-        if not ultimo_cierre:
-            # Si no hay cierres, empezar desde el primer movimiento con saldos en 0
-            print("⚠️ No hay cierres previos, recalculando desde el inicio")
-            saldo_caja_inicial = 0
-            saldo_banco_inicial = 0
-            fecha_desde = '1900-01-01'  # Desde el inicio
-        else:
-            print(f"✅ Último cierre encontrado: {ultimo_cierre['MoFecha']}")
-            saldo_caja_inicial = float(ultimo_cierre['MoSaldoCaja'] or 0)
-            saldo_banco_inicial = float(ultimo_cierre['MoSaldoBanco'] or 0)
-            fecha_desde = ultimo_cierre['MoFecha']
-        
-        # 2. Obtener movimientos desde esa fecha (excluyendo cierres)
-        print(f"📊 Obteniendo movimientos desde: {fecha_desde}")
-        query_movimientos = """
-        SELECT MoID, MoCChica, MoImporte
-        FROM movimientos 
-        WHERE MoSede = %s 
-        AND MoFecha >= %s 
-        AND MoDona != 9999
-        ORDER BY MoFecha, MoID
-        """
-        
-        cursor.execute(query_movimientos, (sede, fecha_desde))
-        movimientos = cursor.fetchall()
-        
-        print(f"📝 Encontrados {len(movimientos)} movimientos para recalcular")
-        
-        if len(movimientos) == 0:
+        if recalculo["movimientos_recalculados"] == 0:
             return {
                 "success": True,
                 "message": "No hay movimientos para recalcular",
                 "movimientos_actualizados": 0
             }
         
-        # 3. Recalcular con variables acumulativas
-        saldo_caja_acum = saldo_caja_inicial
-        saldo_banco_acum = saldo_banco_inicial
-        movimientos_actualizados = 0
-        
-        print("🔄 Iniciando recálculo...")
-        
-        for movimiento in movimientos:
-            # Acumular saldos
-            saldo_caja_acum += float(movimiento['MoCChica'] or 0)
-            saldo_banco_acum += float(movimiento['MoImporte'] or 0)
-            
-            # Actualizar registro
-            query_update = """
-            UPDATE movimientos 
-            SET MoSaldoCaja = %s, MoSaldoBanco = %s 
-            WHERE MoID = %s
-            """
-            
-            cursor.execute(query_update, (saldo_caja_acum, saldo_banco_acum, movimiento['MoID']))
-            movimientos_actualizados += 1
-            
-            if movimientos_actualizados % 100 == 0:  # Log cada 100 registros
-                print(f"📈 Procesados {movimientos_actualizados} movimientos...")
-        
-        # Confirmar cambios
+        # Solo se reescriben (y se anotan en el registro de cambios) los saldos que no cuadraban
+        registrar_recalculo(cursor, sede, recalculo)
         conn.commit()
+        if recalculo["movimientos_actualizados"]:
+            invalidar_desde(test_mode, sede, recalculo["fecha_desde"])
+        publicar_recalculo(test_mode, sede, recalculo)
         
-        print(f"✅ Recálculo completado: {movimientos_actualizados} movimientos actualizados")
+        print(f"✅ Recálculo completado: {recalculo['movimientos_recalculados']} movimientos, "
+              f"{recalculo['movimientos_actualizados']} saldos corregidos")
         
         return {
             "success": True,
             "message": f"Recálculo completado exitosamente",
-            "movimientos_actualizados": movimientos_actualizados,
-            "saldo_final_caja": saldo_caja_acum,
-            "saldo_final_banco": saldo_banco_acum
+            "movimientos_actualizados": recalculo["movimientos_recalculados"],
+            "saldos_corregidos": recalculo["movimientos_actualizados"],
+            "saldo_final_caja": recalculo["saldo_final_caja"],
+            "saldo_final_banco": recalculo["saldo_final_banco"]
         }
         
     except Exception as e:
@@ -1949,9 +2634,145 @@ def recalcular_saldos(sede: int = Query(...), auth=Depends(get_current_user), te
         if conn:
             conn.close()
 
+# ================== SALDOS DE CAJA Y BANCO A UNA FECHA ==================
+# Saldos al final del día pedido: último cierre hasta esa fecha + búsqueda por
+# índice del último movimiento desde él. Varias fechas (p.ej. para gráficas) en
+# dos consultas por sede.
+MAX_FECHAS_SALDOS = 500
+
+def _fecha_consulta(texto):
+    try:
+        return datetime.strptime(texto, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Fecha no válida: {texto} (formato AAAA-MM-DD)")
+
+def _consultar_saldos(fechas_por_sede, test_mode: bool):
+    """{sede: [date, ...]} -> {sede: {date: saldos}}"""
+    if sum(len(fechas) for fechas in fechas_por_sede.values()) > MAX_FECHAS_SALDOS:
+        raise HTTPException(status_code=400, detail=f"Como máximo {MAX_FECHAS_SALDOS} fechas por consulta")
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        return {sede: saldos_en_fechas(cursor, sede, fechas) for sede, fechas in fechas_por_sede.items()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ ERROR consultando saldos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.get("/saldos-en-fecha")
+def obtener_saldos_en_fecha(
+    sede: int = Depends(sede_autorizada),
+    fecha: List[str] = Query(...),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """Saldos de la sede al final de una o varias fechas (?fecha=AAAA-MM-DD&fecha=...)"""
+    fechas = [_fecha_consulta(texto) for texto in fecha]
+    saldos = _consultar_saldos({sede: fechas}, test_mode)[sede]
+    return {"success": True, "sede": sede, "saldos": [saldos[f] for f in fechas]}
+
+@app.post("/saldos-en-fecha")
+def obtener_saldos_en_fechas(request: SaldosFechasRequest, auth=Depends(get_current_user), test_mode: bool = False):
+    """Saldos para varios pares (sede, fecha), en el orden pedido"""
+    consultas = [(consulta.sede, _fecha_consulta(consulta.fecha)) for consulta in request.consultas]
+    fechas_por_sede = {}
+    for sede, fecha in consultas:
+        fechas_por_sede.setdefault(sede, []).append(fecha)
+    for sede in fechas_por_sede:
+        autorizar_sede(auth, sede, test_mode)
+    saldos = _consultar_saldos(fechas_por_sede, test_mode)
+    return {
+        "success": True,
+        "saldos": [{"sede": sede, **saldos[sede][fecha]} for sede, fecha in consultas]
+    }
+
+# ================== PANEL DE SALDOS DE TODAS LAS SEDES ==================
+# Saldo actual, fecha del último movimiento y movimientos del período abierto
+# (desde el último cierre) de cada local activo, en una sola consulta.
+# La clave de la caché lleva el cursor de cambios de cada sede (MAX(CaID), una
+# búsqueda por índice): cualquier escritura confirmada en una de ellas, desde
+# este proceso, otro worker o reconstruir_ledger.py, hace que la siguiente
+# lectura vaya a MySQL. El TTL cubre el SQL escrito a mano, que no deja cambios.
+cache_panel_saldos = CacheTTL(ttl_segundos=300, max_items=64)
+
+@app.get("/panel-saldos")
+def obtener_panel_saldos(auth=Depends(get_current_user), test_mode: bool = False):
+    """Saldos de caja y banco de todas las sedes activas del usuario"""
+    codigos = sorted(sedes_permitidas(auth, test_mode))
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        clave_cache = (test_mode, tuple(codigos), versiones_sedes(cursor, codigos))
+        panel = cache_panel_saldos.obtener(clave_cache)
+        if panel is not None:
+            return RespuestaJSON(panel)
+
+        sedes = []
+        if codigos:
+            placeholders = ",".join(["%s"] * len(codigos))
+            # Por sede: último movimiento y último cierre, cada uno con una búsqueda por índice
+            cursor.execute(f"""
+            SELECT l.LoCod AS sede, l.LoNombre AS nombre,
+                   COALESCE(u.MoSaldoCaja, c.MoSaldoCaja, 0) AS saldo_caja,
+                   COALESCE(u.MoSaldoBanco, c.MoSaldoBanco, 0) AS saldo_banco,
+                   u.MoFecha AS fecha_ultimo_movimiento,
+                   c.MoFecha AS fecha_ultimo_cierre,
+                   (SELECT COUNT(*) FROM movimientos a
+                    WHERE a.MoSede = l.LoCod AND a.MoDona != 9999
+                    AND a.MoFecha >= COALESCE(c.MoFecha, '1900-01-01')) AS movimientos_periodo_abierto
+            FROM locales l
+            LEFT JOIN movimientos u ON u.MoID = (
+                SELECT m.MoID FROM movimientos m
+                WHERE m.MoSede = l.LoCod AND m.MoDona != 9999
+                ORDER BY m.MoFecha DESC, m.MoID DESC LIMIT 1
+            )
+            LEFT JOIN movimientos c ON c.MoID = (
+                SELECT m.MoID FROM movimientos m
+                WHERE m.MoSede = l.LoCod AND m.MoDona = 9999
+                ORDER BY m.MoFecha DESC, m.MoID DESC LIMIT 1
+            )
+            WHERE l.LoSituacion = 1 AND l.LoCod IN ({placeholders})
+            ORDER BY l.LoNombre
+            """, codigos)
+            sedes = cursor.fetchall()
+
+        panel = {
+            "success": True,
+            "sedes": sedes,
+            "totales": {
+                "saldo_caja": round(sum(float(s['saldo_caja'] or 0) for s in sedes), 2),
+                "saldo_banco": round(sum(float(s['saldo_banco'] or 0) for s in sedes), 2),
+                "movimientos_periodo_abierto": sum(int(s['movimientos_periodo_abierto'] or 0) for s in sedes)
+            },
+            "generado": datetime.now()
+        }
+        cache_panel_saldos.guardar(clave_cache, panel)
+        print(f"✅ Panel de saldos: {len(sedes)} sedes")
+        return RespuestaJSON(panel)
+
+    except Exception as e:
+        print(f"❌ ERROR obteniendo panel de saldos: {e}")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 # ================== PARA VERIFICAR SI UN PERIODO YA ESTA CERRADO Y EVITAR MODIFICACIONES ==================
 @app.get("/verificar-periodo-cerrado")
-def verificar_periodo_cerrado(sede: int = Query(...), año: int = Query(...), mes: int = Query(...), auth=Depends(get_current_user), test_mode: bool = False):
+def verificar_periodo_cerrado(sede: int = Depends(sede_autorizada), año: int = Query(...), mes: int = Query(...), auth=Depends(get_current_user), test_mode: bool = False):
     """Verificar si un período está cerrado"""
     conn = None
     cursor = None
@@ -1996,7 +2817,20 @@ def verificar_periodo_cerrado(sede: int = Query(...), año: int = Query(...), me
 
 # ================== PARA MODIFICAR UN REGISTRO DE MOVIMIENTOS ==================
 @app.put("/editar-movimiento/{movimiento_id}")
-def editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth=Depends(get_current_user), test_mode: bool = False):
+def editar_movimiento(
+    movimiento_id: int,
+    movimiento: MovimientoCreate,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    idempotency_key: Optional[str] = Header(None)
+):
+    return ejecutar_idempotente(
+        idempotency_key, auth, f"editar-movimiento/{movimiento_id}", test_mode, movimiento,
+        lambda idempotencia: _editar_movimiento(movimiento_id, movimiento, auth, test_mode, idempotencia)
+    )
+
+def _editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth, test_mode: bool, idempotencia):
+    autorizar_sede(auth, movimiento.sede, test_mode)
     movimiento = convertir_campos_texto_mayusculas(movimiento)
     conn = None
     cursor = None
@@ -2015,15 +2849,25 @@ def editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth=Dep
 
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_diezmos(cursor)
+        previa = idempotencia.reservar(cursor)
+        if previa is not None:
+            return previa
         
         # 1. Verificar que el movimiento existe y obtener datos originales
-        query_original = "SELECT * FROM movimientos WHERE MoID = %s"
+        query_original = """
+        SELECT MoSede, MoDona, MoFecha, MoTiMo, MoTGas, MoPers, MoImporte, MoCChica
+        FROM movimientos WHERE MoID = %s
+        """
         cursor.execute(query_original, (movimiento_id,))
         movimiento_original = cursor.fetchone()
         
         if not movimiento_original:
             raise HTTPException(status_code=404, detail="Movimiento no encontrado")
         
+        autorizar_sede(auth, movimiento_original['MoSede'], test_mode)
+        
         # 2. Verificar que no es un registro de cierre
         if movimiento_original['MoDona'] == 9999:
             raise HTTPException(status_code=400, detail="No se pueden editar registros de cierre")
@@ -2058,6 +2902,14 @@ def editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth=Dep
         if resultado_periodo['cantidad'] > 0:
             raise HTTPException(status_code=400, detail=f"No se puede editar: el período original {mes_original}/{año_original} está cerrado")
         
+        # La nueva fecha tampoco puede caer en un mes cerrado (sus totales están congelados)
+        try:
+            fecha_nueva = datetime(movimiento.año, movimiento.mes, movimiento.dia).date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Fecha no válida: {movimiento.dia}/{movimiento.mes}/{movimiento.año}")
+        if (movimiento.año, movimiento.mes) in meses_cerrados(cursor, movimiento_original['MoSede'], fecha_nueva):
+            raise HTTPException(status_code=400, detail=f"No se puede editar: el período {movimiento.mes}/{movimiento.año} de la nueva fecha está cerrado")
+
         # 4. Determinar valores según origen
         nuevo_caja = movimiento.cChica if hasattr(movimiento, 'cChica') else (movimiento.importe if movimiento.origen == "caja" else 0)
         nuevo_banco = movimiento.importe if movimiento.origen == "banco" else 0
@@ -2080,70 +2932,35 @@ def editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth=Dep
             movimiento_id
         ))
         
-        conn.commit()
         
-        # 7. Recalcular saldos desde el último cierre
+        # 7. Recalcular saldos desde el último cierre, en la misma transacción que la edición
         print("🔄 Iniciando recálculo de saldos después de edición...")
-        
-        # Buscar último cierre
-        query_ultimo_cierre = """
-        SELECT MoSaldoCaja, MoSaldoBanco, MoFecha 
-        FROM movimientos 
-        WHERE MoSede = %s AND MoDona = 9999 
-        ORDER BY MoFecha DESC LIMIT 1
-        """
-        
-        cursor.execute(query_ultimo_cierre, (movimiento.sede,))
-        ultimo_cierre = cursor.fetchone()
-        
-        if ultimo_cierre:
-            saldo_caja_inicial = float(ultimo_cierre['MoSaldoCaja'] or 0)
-            saldo_banco_inicial = float(ultimo_cierre['MoSaldoBanco'] or 0)
-            fecha_desde = ultimo_cierre['MoFecha']
-        else:
-            saldo_caja_inicial = 0
-            saldo_banco_inicial = 0
-            fecha_desde = '1900-01-01'
-        
-        # Obtener movimientos a recalcular
-        query_movimientos = """
-        SELECT MoID, MoCChica, MoImporte
-        FROM movimientos 
-        WHERE MoSede = %s 
-        AND MoFecha >= %s 
-        AND MoDona != 9999
-        ORDER BY MoFecha, MoID
-        """
-        
-        cursor.execute(query_movimientos, (movimiento.sede, fecha_desde))
-        movimientos_recalcular = cursor.fetchall()
-        
-        # Recalcular saldos
-        saldo_caja_acum = saldo_caja_inicial
-        saldo_banco_acum = saldo_banco_inicial
-        
-        for mov in movimientos_recalcular:
-            saldo_caja_acum += float(mov['MoCChica'] or 0)
-            saldo_banco_acum += float(mov['MoImporte'] or 0)
-            
-            query_update_saldos = """
-            UPDATE movimientos 
-            SET MoSaldoCaja = %s, MoSaldoBanco = %s 
-            WHERE MoID = %s
-            """
-            
-            cursor.execute(query_update_saldos, (saldo_caja_acum, saldo_banco_acum, mov['MoID']))
-        
-        conn.commit()
-        
-        print(f"✅ Movimiento editado y saldos recalculados: {len(movimientos_recalcular)} registros")
-        
-        return {
+        recalculo = recalcular_saldos_desde(cursor, movimiento.sede)
+        movimiento_nuevo = dict(movimiento_original, MoFecha=nueva_fecha, MoImporte=nuevo_banco, MoCChica=nuevo_caja)
+        ajustar_diezmos(cursor, altas=[movimiento_nuevo], bajas=[movimiento_original])
+        registrar_cambios(cursor, movimiento.sede, MODIFICACION, [movimiento_id])
+        registrar_recalculo(cursor, movimiento.sede, recalculo, excluir=[movimiento_id])
+        respuesta = {
             "success": True,
             "message": "Movimiento actualizado y saldos recalculados correctamente",
-            "movimientos_recalculados": len(movimientos_recalcular)
+            "movimientos_recalculados": recalculo["movimientos_recalculados"]
         }
+        idempotencia.guardar(cursor, respuesta)
+        conn.commit()
+        # Mes original y mes nuevo, y los siguientes por los saldos acumulados
+        invalidar_desde(test_mode, movimiento.sede, fecha_original)
+        invalidar_desde(test_mode, movimiento.sede, nueva_fecha)
+        publicar_movimientos(test_mode, movimiento.sede, MOVIMIENTO_EDITADO,
+                             ids=[movimiento_id], fecha=nueva_fecha, usuario=auth.get("sub"))
+        publicar_recalculo(test_mode, movimiento.sede, recalculo)
         
+        print(f"✅ Movimiento editado y saldos recalculados: {recalculo['movimientos_recalculados']} registros")
+        return respuesta
+        
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
     except Exception as e:
         print(f"❌ ERROR editando movimiento: {e}")
         if conn:
@@ -2157,8 +2974,19 @@ def editar_movimiento(movimiento_id: int, movimiento: MovimientoCreate, auth=Dep
 
 # ================== PARA ELIMINAR UN REGISTRO DE MOVIMIENTOS ==================
 @app.delete("/eliminar-movimiento/{movimiento_id}")
-def eliminar_movimiento(movimiento_id: int, auth=Depends(get_current_user), test_mode: bool = False):
+def eliminar_movimiento(
+    movimiento_id: int,
+    auth=Depends(get_current_user),
+    test_mode: bool = False,
+    idempotency_key: Optional[str] = Header(None)
+):
     """Eliminar un movimiento y recalcular saldos"""
+    return ejecutar_idempotente(
+        idempotency_key, auth, f"eliminar-movimiento/{movimiento_id}", test_mode, None,
+        lambda idempotencia: _eliminar_movimiento(movimiento_id, auth, test_mode, idempotencia)
+    )
+
+def _eliminar_movimiento(movimiento_id: int, auth, test_mode: bool, idempotencia):
     conn = None
     cursor = None
     try:
@@ -2166,15 +2994,25 @@ def eliminar_movimiento(movimiento_id: int, auth=Depends(get_current_user), test
         
         conn = conectar_db(test_mode=test_mode)
         cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_diezmos(cursor)
+        previa = idempotencia.reservar(cursor)
+        if previa is not None:
+            return previa
         
         # 1. Verificar que el movimiento existe y obtener datos
-        query_movimiento = "SELECT * FROM movimientos WHERE MoID = %s"
+        query_movimiento = """
+        SELECT MoSede, MoDona, MoFecha, MoTiMo, MoTGas, MoPers, MoImporte, MoCChica
+        FROM movimientos WHERE MoID = %s
+        """
         cursor.execute(query_movimiento, (movimiento_id,))
         movimiento = cursor.fetchone()
         
         if not movimiento:
             raise HTTPException(status_code=404, detail="Movimiento no encontrado")
         
+        autorizar_sede(auth, movimiento['MoSede'], test_mode)
+        
         # 2. Verificar que no es un registro de cierre
         if movimiento['MoDona'] == 9999:
             raise HTTPException(status_code=400, detail="No se pueden eliminar registros de cierre")
@@ -2209,71 +3047,33 @@ def eliminar_movimiento(movimiento_id: int, auth=Depends(get_current_user), test
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Movimiento no encontrado para eliminar")
         
-        conn.commit()
         print(f"✅ Movimiento {movimiento_id} eliminado")
         
-        # 5. Recalcular saldos desde el último cierre
+        # 5. Recalcular saldos desde el último cierre, en la misma transacción que el borrado
         print("🔄 Iniciando recálculo de saldos después de eliminación...")
-        
-        # Buscar último cierre
-        query_ultimo_cierre = """
-        SELECT MoSaldoCaja, MoSaldoBanco, MoFecha 
-        FROM movimientos 
-        WHERE MoSede = %s AND MoDona = 9999 
-        ORDER BY MoFecha DESC LIMIT 1
-        """
-        
-        cursor.execute(query_ultimo_cierre, (sede_mov,))
-        ultimo_cierre = cursor.fetchone()
-        
-        if ultimo_cierre:
-            saldo_caja_inicial = float(ultimo_cierre['MoSaldoCaja'] or 0)
-            saldo_banco_inicial = float(ultimo_cierre['MoSaldoBanco'] or 0)
-            fecha_desde = ultimo_cierre['MoFecha']
-        else:
-            saldo_caja_inicial = 0
-            saldo_banco_inicial = 0
-            fecha_desde = '1900-01-01'
-        
-        # Obtener movimientos a recalcular
-        query_movimientos = """
-        SELECT MoID, MoCChica, MoImporte
-        FROM movimientos 
-        WHERE MoSede = %s 
-        AND MoFecha >= %s 
-        AND MoDona != 9999
-        ORDER BY MoFecha, MoID
-        """
-        
-        cursor.execute(query_movimientos, (sede_mov, fecha_desde))
-        movimientos_recalcular = cursor.fetchall()
-        
-        # Recalcular saldos
-        saldo_caja_acum = saldo_caja_inicial
-        saldo_banco_acum = saldo_banco_inicial
-        
-        for mov in movimientos_recalcular:
-            saldo_caja_acum += float(mov['MoCChica'] or 0)
-            saldo_banco_acum += float(mov['MoImporte'] or 0)
-            
-            query_update_saldos = """
-            UPDATE movimientos 
-            SET MoSaldoCaja = %s, MoSaldoBanco = %s 
-            WHERE MoID = %s
-            """
-            
-            cursor.execute(query_update_saldos, (saldo_caja_acum, saldo_banco_acum, mov['MoID']))
-        
-        conn.commit()
-        
-        print(f"✅ Movimiento eliminado y saldos recalculados: {len(movimientos_recalcular)} registros")
-        
-        return {
+        recalculo = recalcular_saldos_desde(cursor, sede_mov)
+        ajustar_diezmos(cursor, bajas=[movimiento])
+        registrar_cambios(cursor, sede_mov, BAJA, [movimiento_id])
+        registrar_recalculo(cursor, sede_mov, recalculo)
+        respuesta = {
             "success": True,
             "message": "Movimiento eliminado y saldos recalculados correctamente",
-            "movimientos_recalculados": len(movimientos_recalcular)
+            "movimientos_recalculados": recalculo["movimientos_recalculados"]
         }
+        idempotencia.guardar(cursor, respuesta)
+        conn.commit()
+        invalidar_desde(test_mode, sede_mov, fecha_mov)
+        publicar_movimientos(test_mode, sede_mov, MOVIMIENTO_ELIMINADO,
+                             ids=[movimiento_id], fecha=str(fecha_mov), usuario=auth.get("sub"))
+        publicar_recalculo(test_mode, sede_mov, recalculo)
+        
+        print(f"✅ Movimiento eliminado y saldos recalculados: {recalculo['movimientos_recalculados']} registros")
+        return respuesta
         
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
     except Exception as e:
         print(f"❌ ERROR eliminando movimiento: {e}")
         if conn:
@@ -2287,44 +3087,33 @@ def eliminar_movimiento(movimiento_id: int, auth=Depends(get_current_user), test
 
 # ================== REPORTE DIEZMOS POR PERSONA ==================
 @app.post("/api/reportes/diezmos-por-persona")
-async def obtener_diezmos_por_persona(request: ReporteDiezmosPorPersonaRequest, test_mode: bool = False):
+@compartir_lectura(sede=lambda kwargs: kwargs["request"].codigoSede)
+def obtener_diezmos_por_persona(
+    request: ReporteDiezmosPorPersonaRequest,
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
     try:
         connection = conectar_db(test_mode=test_mode)
         cursor = connection.cursor(pymysql.cursors.DictCursor)
-        
-        sql_query = """
-        SELECT fiCod AS Codigo, 
-               CONCAT_WS(' ', fiNombres, fiApellidos) AS Nombres,
-               SUM(MoImporte + MoCChica) AS Total
-        FROM movimientos
-        LEFT JOIN fieles ON MoSede = FiSede AND MoPers = FiCod
-        WHERE MoSede = %s 
-          AND MoTiMo = 100 
-          AND MoTGas = 2 
-          AND MoPers > 0 
-          AND YEAR(MoFecha) = %s
-        GROUP BY MoPers, YEAR(MoFecha)
-        ORDER BY Nombres
-        """
-        
-        cursor.execute(sql_query, (request.codigoSede, request.año))
-        resultados = cursor.fetchall()
-        
-        # Calcular total general
-        total_general = sum(float(row.get('Total', 0) or 0) for row in resultados)
-        
+        asegurar_tablas_archivo(cursor)
+
+        # Totales anuales mantenidos al grabar (diezmos.py); los calcula /trabajos/reconstruir-diezmos
+        resultados = diezmos_por_persona(cursor, request.codigoSede, request.año)
+        total_general = sum(float(fila['Total'] or 0) for fila in resultados)
+
         cursor.close()
         connection.close()
         
-        return {
+        return RespuestaJSON({
             "success": True,
-            "diezmos": resultados,
+            "diezmos": dicts_a_columnar(resultados) if columnar else resultados,
             "total_general": total_general,
             "parametros": {
                 "sede": request.codigoSede,
                 "año": request.año
             }
-        }
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -2332,6 +3121,9 @@ async def obtener_diezmos_por_persona(request: ReporteDiezmosPorPersonaRequest,
 # ================== ENDPOINT PARA PROCESAR TRANSPOSICIÓN ==================
 @app.post("/api/reportes/procesar-transposicion")
 async def procesar_transposicion(request: TransposicionRequest, test_mode: bool = False):
+    return await run_in_threadpool(_procesar_transposicion, request, test_mode)
+
+def _procesar_transposicion(request: TransposicionRequest, test_mode: bool, progreso=None):
     print("=== INICIO TRANSPOSICIÓN DATOS ECONÓMICOS ===")
     print(f"Datos recibidos: {request}")
     
@@ -2340,6 +3132,8 @@ async def procesar_transposicion(request: TransposicionRequest, test_mode: bool
     try:
         connection = conectar_db(test_mode=test_mode)
         cursor = connection.cursor(pymysql.cursors.DictCursor)
+        asegurar_tablas_resumen(cursor)
+        asegurar_tablas_archivo(cursor)
         
         # 1. Limpiar tabla ingresosygastos si se solicita
         if request.limpiarTabla:
@@ -2349,19 +3143,38 @@ async def procesar_transposicion(request: TransposicionRequest, test_mode: bool
         
         # 2. Obtener datos base (reutilizamos la consulta del primer endpoint)
         print("📊 Obteniendo datos base...")
-        sql_datos = """
-            SELECT MoSede, MoTiMo, MoTGas, MoRubr, OpNombre, MONTH(MoFecha) AS Mes,
-                   IF(MoTiMo>0, SUM(MoImporte), MoSaldoBanco) AS Importe
-            FROM movimientos
-            LEFT JOIN opcionbtns ON OpTipoOp=MoTiMo AND OpCod=MoTGas
-            WHERE MoSede = %s AND YEAR(MoFecha) = %s
-            GROUP BY MoTiMo, MoTGas, YEAR(MoFecha), MONTH(MoFecha)
-            ORDER BY MoTiMo, MoTGas, MONTH(MoFecha)
+        # Meses cerrados desde resumen_conceptos; el tramo abierto desde movimientos.
+        # Misma regla en los dos: rubro mínimo y, para MoTiMo = 0, el saldo del
+        # último movimiento del mes (RcSaldoBanco ya lo guarda igual en cada rubro)
+        corte = corte_resumenes(cursor, request.codigoSede, datetime(request.año, 1, 1))
+        tabla, params_tabla = fuente_movimientos(cursor, request.codigoSede, corte, datetime(request.año, 12, 31))
+        sql_datos = f"""
+            SELECT d.MoSede, d.MoTiMo, d.MoTGas, d.MoRubr, OpNombre, d.Mes, d.Importe
+            FROM (
+                SELECT RcSede AS MoSede, RcTiMo AS MoTiMo, RcTGas AS MoTGas, MIN(RcRubr) AS MoRubr,
+                       RcMes AS Mes, IF(RcTiMo>0, SUM(RcBanco), MAX(RcSaldoBanco)) AS Importe
+                FROM resumen_conceptos
+                WHERE RcSede = %s AND RcAnyo = %s AND RcMes < %s
+                GROUP BY RcSede, RcTiMo, RcTGas, RcMes
+                UNION ALL
+                SELECT MoSede, MoTiMo, MoTGas, MIN(COALESCE(MoRubr, 0)) AS MoRubr, MONTH(MoFecha) AS Mes,
+                       IF(MoTiMo>0, SUM(MoImporte), {SQL_ULTIMO_SALDO_BANCO}) AS Importe
+                FROM {tabla} m
+                WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s
+                GROUP BY MoTiMo, MoTGas, MONTH(MoFecha)
+            ) d
+            LEFT JOIN opcionbtns ON OpTipoOp=d.MoTiMo AND OpCod=d.MoTGas
+            ORDER BY d.MoTiMo, d.MoTGas, d.Mes
         """
         
-        cursor.execute(sql_datos, (request.codigoSede, request.año))
+        cursor.execute(sql_datos, (
+            request.codigoSede, request.año, mes_corte_en_año(corte, request.año),
+            *params_tabla, request.codigoSede, corte, datetime(request.año + 1, 1, 1)
+        ))
         datos_verticales = cursor.fetchall()
         print(f"📝 Obtenidos {len(datos_verticales)} registros verticales")
+        if progreso:
+            progreso(0.4, "Datos base obtenidos")
         
         # 3. Procesar transposición (lógica similar al código Delphi del PDF)
         print("🔄 Procesando transposición...")
@@ -2418,6 +3231,8 @@ async def procesar_transposicion(request: TransposicionRequest, test_mode: bool
         
         # 5. Insertar en tabla ingresosygastos
         print(f"💾 Insertando {len(registros_insertar)} registros en tabla...")
+        if progreso:
+            progreso(0.6, "Insertando registros")
         
         sql_insert = """
         INSERT INTO ingresosygastos (
@@ -2430,6 +3245,8 @@ async def procesar_transposicion(request: TransposicionRequest, test_mode: bool
         
         cursor.executemany(sql_insert, registros_insertar)
         connection.commit()
+        if progreso:
+            progreso(0.9, "Transposición grabada")
         
         print(f"✅ Transposición completada: {len(registros_insertar)} registros insertados")
         
@@ -2472,9 +3289,204 @@ async def procesar_transposicion(request: TransposicionRequest, test_mode: bool
         if conn:
             conn.close()
 
+# ================== TRABAJOS EN SEGUNDO PLANO ==================
+# Versiones asíncronas de las operaciones largas: devuelven el id del trabajo
+# al momento y el resultado se consulta después en /trabajos/{id}/resultado
+def respuesta_trabajo(trabajo):
+    return {"success": True, "trabajo": trabajo.resumen(), "estado_url": f"/trabajos/{trabajo.id}"}
+
+@app.post("/trabajos/recalcular-saldos", status_code=202)
+def trabajo_recalcular_saldos(sede: int = Depends(sede_autorizada), auth=Depends(get_current_user), test_mode: bool = False):
+    """Encolar el recálculo de saldos de la sede"""
+    trabajo = gestor_trabajos.enviar(
+        "recalcular-saldos", ("recalcular-saldos", test_mode, sede), auth.get("sub"),
+        lambda progreso: _recalcular_saldos(sede, test_mode, progreso)
+    )
+    return respuesta_trabajo(trabajo)
+
+@app.post("/trabajos/procesar-transposicion", status_code=202)
+def trabajo_procesar_transposicion(request: TransposicionRequest, auth=Depends(get_current_user), test_mode: bool = False):
+    """Encolar la transposición del informe anual de la sede"""
+    autorizar_sede(auth, request.codigoSede, test_mode)
+    trabajo = gestor_trabajos.enviar(
+        "procesar-transposicion",
+        ("procesar-transposicion", test_mode, request.codigoSede, request.año, request.limpiarTabla),
+        auth.get("sub"),
+        lambda progreso: _procesar_transposicion(request, test_mode, progreso)
+    )
+    return respuesta_trabajo(trabajo)
+
+def _generar_resumenes(sede: int, test_mode: bool, progreso=None):
+    """Resúmenes de los meses que se cerraron antes de que existieran (o se perdieron)"""
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tablas_resumen(cursor)
+        pendientes = resumenes_pendientes(cursor, sede)
+        # Un commit por mes: cada resumen es independiente y así no se bloquea la sede entera
+        for indice, (año, mes) in enumerate(pendientes):
+            crear_resumen_mes(cursor, sede, año, mes)
+            conn.commit()
+            if progreso:
+                progreso((indice + 1) / len(pendientes), f"Resumen {mes:02d}/{año}")
+        print(f"✅ Resúmenes generados para sede {sede}: {len(pendientes)}")
+        return {
+            "success": True,
+            "meses_generados": [f"{año}-{mes:02d}" for año, mes in pendientes]
+        }
+    except Exception as e:
+        print(f"❌ ERROR generando resúmenes: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.post("/trabajos/generar-resumenes", status_code=202)
+def trabajo_generar_resumenes(sede: int = Depends(sede_autorizada), auth=Depends(get_current_user), test_mode: bool = False):
+    """Encolar la generación de los resúmenes de meses cerrados que aún no lo tienen"""
+    trabajo = gestor_trabajos.enviar(
+        "generar-resumenes", ("generar-resumenes", test_mode, sede), auth.get("sub"),
+        lambda progreso: _generar_resumenes(sede, test_mode, progreso)
+    )
+    return respuesta_trabajo(trabajo)
+
+def _reconstruir_diezmos(sede: int, test_mode: bool, progreso=None):
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tablas_diezmos(cursor)
+        filas = reconstruir_diezmos(cursor, sede)
+        conn.commit()
+        print(f"✅ Totales de diezmos de la sede {sede} reconstruidos: {filas} filas")
+        return {"success": True, "sede": sede, "filas": filas}
+    except Exception as e:
+        print(f"❌ ERROR reconstruyendo diezmos: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.post("/trabajos/reconstruir-diezmos", status_code=202)
+def trabajo_reconstruir_diezmos(sede: int = Depends(sede_autorizada), auth=Depends(get_current_user), test_mode: bool = False):
+    """Encolar el recálculo desde cero de los totales anuales de diezmos por persona de la sede"""
+    trabajo = gestor_trabajos.enviar(
+        "reconstruir-diezmos", ("reconstruir-diezmos", test_mode, sede), auth.get("sub"),
+        lambda progreso: _reconstruir_diezmos(sede, test_mode, progreso)
+    )
+    return respuesta_trabajo(trabajo)
+
+def _archivar_anyo(sede: int, año: int, test_mode: bool, progreso=None):
+    conn = None
+    cursor = None
+    try:
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        asegurar_tablas_archivo(cursor)
+        archivados = archivar_anyo(cursor, sede, año)
+        conn.commit()
+        invalidar_años_archivados(cursor, sede)
+        print(f"✅ Año {año} de la sede {sede} archivado: {archivados} movimientos")
+        return {"success": True, "sede": sede, "año": año, "movimientos_archivados": archivados}
+    except ErrorArchivo as e:
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        print(f"❌ ERROR archivando año: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.post("/trabajos/archivar-anyo", status_code=202)
+def trabajo_archivar_anyo(
+    sede: int = Depends(sede_autorizada),
+    anyo: int = Query(...),
+    auth=Depends(get_current_user),
+    test_mode: bool = False
+):
+    """Encolar el paso de un año cerrado de la sede a movimientos_archivo (solo administradores)"""
+    verificar_admin(auth)
+    trabajo = gestor_trabajos.enviar(
+        "archivar-anyo", ("archivar-anyo", test_mode, sede, anyo), auth.get("sub"),
+        lambda progreso: _archivar_anyo(sede, anyo, test_mode, progreso)
+    )
+    return respuesta_trabajo(trabajo)
+
+@app.post("/trabajos/verificar-saldos", status_code=202)
+def trabajo_verificar_saldos(sede: Optional[int] = None, auth=Depends(get_current_user), test_mode: bool = False):
+    """
+    Encolar la verificación (solo lectura) de los saldos guardados de una sede,
+    o de todas las sedes del usuario si no se indica ninguna
+    """
+    if sede is not None:
+        autorizar_sede(auth, sede, test_mode)
+        sedes = [sede]
+    else:
+        sedes = sorted(sedes_permitidas(auth, test_mode))
+
+    def verificar(progreso):
+        resultados = verificar_sedes(sedes, lambda: conectar_db(test_mode=test_mode), progreso)
+        return {
+            "success": True,
+            "sedes_verificadas": len(resultados),
+            "sedes_con_descuadres": [r["sede"] for r in resultados if "error" not in r and not r["cuadra"]],
+            "sedes_con_error": [r["sede"] for r in resultados if "error" in r],
+            "resultados": resultados
+        }
+
+    trabajo = gestor_trabajos.enviar(
+        "verificar-saldos", ("verificar-saldos", test_mode, tuple(sedes)), auth.get("sub"), verificar
+    )
+    return respuesta_trabajo(trabajo)
+
+@app.get("/trabajos/{trabajo_id}")
+def estado_trabajo(trabajo_id: str, auth=Depends(get_current_user)):
+    """Estado y progreso de un trabajo"""
+    trabajo = gestor_trabajos.obtener(trabajo_id, auth.get("sub"))
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o caducado")
+    return {"success": True, "trabajo": trabajo.resumen()}
+
+@app.get("/trabajos/{trabajo_id}/resultado")
+def resultado_trabajo(trabajo_id: str, auth=Depends(get_current_user)):
+    """
+    Resultado de un trabajo terminado (409 si aún no ha terminado). Si falló,
+    responde con el mismo código que habría dado el endpoint síncrono.
+    """
+    trabajo = gestor_trabajos.obtener(trabajo_id, auth.get("sub"))
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado o caducado")
+    if trabajo.estado == ERROR:
+        raise HTTPException(status_code=trabajo.codigo_error or 500, detail=trabajo.error)
+    if trabajo.estado != COMPLETADO:
+        raise HTTPException(status_code=409, detail=f"El trabajo aún no ha terminado ({trabajo.estado})")
+    return RespuestaJSON(trabajo.resultado)
+
 # ================== ENDPOINT PARA REPORTE ECONÓMICO FINAL ==================
 @app.post("/api/reportes/listado-economico-anual")
-async def obtener_listado_economico_anual(request: ReporteEconomicoFinalRequest, test_mode: bool = False):
+@compartir_lectura(sede=lambda kwargs: kwargs["request"].codigoSede)
+def obtener_listado_economico_anual(
+    request: ReporteEconomicoFinalRequest,
+    test_mode: bool = False,
+    columnar: bool = Depends(formato_columnar)
+):
     print("=== INICIO REPORTE ECONÓMICO FINAL ===")
     print(f"Datos recibidos: {request}")
     
@@ -2517,9 +3529,10 @@ async def obtener_listado_economico_anual(request: ReporteEconomicoFinalRequest,
         cursor.close()
         connection.close()
         
-        return {
+        return RespuestaJSON({
             "success": True,
-            "reporte": datos_procesados,
+            # El post-proceso trabaja con dicts: aquí solo se ahorra tamaño de respuesta
+            "reporte": dicts_a_columnar(datos_procesados) if columnar else datos_procesados,
             "total_registros": len(datos_procesados),
             "metadatos": {
                 "sede": request.codigoSede,
@@ -2528,7 +3541,7 @@ async def obtener_listado_economico_anual(request: ReporteEconomicoFinalRequest,
                 "post_procesamiento_aplicado": request.aplicarPostProceso,
                 "fecha_generacion": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-        }
+        })
         
     except Exception as e:
         print(f"❌ ERROR en reporte económico final: {e}")
@@ -2847,18 +3860,22 @@ def obtener_menu_sede_botones(
     cursor = None
     try:
         print(f"▶️ Obteniendo menú sede: tipo={tipo_operacion}, sede={sede}")
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
-        
-        cursor.execute("""
-            SELECT MnuID, MnuTipoOp, MnuSede, MnuCod, MnuNombre, MnuSigAccion, 
-                   MnuAuxiliar, MnuPeso
-            FROM mnusedesbtn 
-            WHERE MnuTipoOp = %s AND MnuSede = %s
-            ORDER BY MnuPeso
-        """, (tipo_operacion, sede))
-        
-        menu_sede = cursor.fetchall()
+        clave_cache = ("mnusedesbtn", test_mode, sede, "menu-sede", tipo_operacion)
+        menu_sede = cache_menus.obtener(clave_cache)
+        if menu_sede is None:
+            conn = conectar_db(test_mode=test_mode)
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+            
+            cursor.execute("""
+                SELECT MnuID, MnuTipoOp, MnuSede, MnuCod, MnuNombre, MnuSigAccion, 
+                       MnuAuxiliar, MnuPeso
+                FROM mnusedesbtn 
+                WHERE MnuTipoOp = %s AND MnuSede = %s
+                ORDER BY MnuPeso
+            """, (tipo_operacion, sede))
+            
+            menu_sede = cursor.fetchall()
+            cache_menus.guardar(clave_cache, menu_sede)
         print(f"✅ Encontrados {len(menu_sede)} elementos en menú sede")
         
         return {
@@ -2891,18 +3908,22 @@ def obtener_rubros_sede(
     cursor = None
     try:
         print(f"▶️ Obteniendo rubros sede: {sede}")
-        conn = conectar_db(test_mode=test_mode)
-        cursor = conn.cursor(pymysql.cursors.DictCursor)
         
         # Solo buscar si tip_gasto > 0
         if tip_gasto > 0:
-            cursor.execute("""
-                SELECT RuID, RuSede, RuTipGasto, RuCod, RuNombre, RuOrden
-                FROM rubingassede 
-                WHERE RuSede = %s AND RuTipGasto = %s
-                ORDER BY RuTipGasto, RuOrden
-            """, (sede, tip_gasto))
-            rubros_sede = cursor.fetchall()
+            clave_cache = ("rubingassede", test_mode, sede, "rubros-sede", tip_gasto)
+            rubros_sede = cache_menus.obtener(clave_cache)
+            if rubros_sede is None:
+                conn = conectar_db(test_mode=test_mode)
+                cursor = conn.cursor(pymysql.cursors.DictCursor)
+                cursor.execute("""
+                    SELECT RuID, RuSede, RuTipGasto, RuCod, RuNombre, RuOrden
+                    FROM rubingassede 
+                    WHERE RuSede = %s AND RuTipGasto = %s
+                    ORDER BY RuTipGasto, RuOrden
+                """, (sede, tip_gasto))
+                rubros_sede = cursor.fetchall()
+                cache_menus.guardar(clave_cache, rubros_sede)
         else:
             rubros_sede = []  # No devolver nada si tip_gasto = 0
 
@@ -2960,6 +3981,7 @@ def agregar_menu_sede(item: MenuSedeItem, auth=Depends(get_current_user), test_m
               item.sig_accion, item.auxiliar, nuevo_peso))
         
         conn.commit()
+        invalidar_menus(test_mode, "mnusedesbtn", item.sede)
         nuevo_id = cursor.lastrowid
         
         print(f"✅ Elemento agregado con ID: {nuevo_id}")
@@ -2993,7 +4015,7 @@ def eliminar_menu_sede(elemento_id: int, auth=Depends(get_current_user), test_mo
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
         # Verificar que existe
-        cursor.execute("SELECT * FROM mnusedesbtn WHERE MnuID = %s", (elemento_id,))
+        cursor.execute("SELECT MnuID, MnuNombre FROM mnusedesbtn WHERE MnuID = %s", (elemento_id,))
         elemento = cursor.fetchone()
         
         if not elemento:
@@ -3002,6 +4024,7 @@ def eliminar_menu_sede(elemento_id: int, auth=Depends(get_current_user), test_mo
         # Eliminar
         cursor.execute("DELETE FROM mnusedesbtn WHERE MnuID = %s", (elemento_id,))
         conn.commit()
+        invalidar_menus(test_mode, "mnusedesbtn")
         
         print(f"✅ Elemento eliminado: {elemento['MnuNombre']}")
         
@@ -3037,6 +4060,7 @@ async def actualizar_orden_menu_sede(elemento_id: int, request: dict, test_mode:
         """, (peso, elemento_id))
         
         conn.commit()
+        invalidar_menus(test_mode, "mnusedesbtn")
         
         if cursor.rowcount > 0:
             return {"message": "Peso actualizado correctamente"}
@@ -3066,6 +4090,7 @@ async def actualizar_orden_rubro_sede(rubro_id: int, request: dict, test_mode: b
         """, (orden, rubro_id))
         
         conn.commit()
+        invalidar_menus(test_mode, "rubingassede")
         
         if cursor.rowcount > 0:
             return {"message": "Orden actualizado correctamente"}
@@ -3079,6 +4104,104 @@ async def actualizar_orden_rubro_sede(rubro_id: int, request: dict, test_mode: b
         cursor.close()
         conn.close()
 
+# ================== REORDENACIÓN EN BLOQUE (ARRASTRAR Y SOLTAR) ==================
+def reordenar_en_bloque(cursor, tabla, columna_id, columna_orden, ids, filtros):
+    """
+    Asigna columna_orden = 1..n según la posición de cada id en `ids` con un
+    único UPDATE ... CASE. `filtros` ({columna: valor}) limita la lista a la
+    sede/tipo y todos los ids deben pertenecer a ella. No hace commit.
+    """
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="La lista de orden contiene elementos repetidos")
+    placeholders = ", ".join(["%s"] * len(ids))
+    where = " AND ".join(f"{columna} = %s" for columna in filtros)
+    
+    cursor.execute(
+        f"SELECT COUNT(*) AS cantidad FROM {tabla} WHERE {columna_id} IN ({placeholders}) AND {where}",
+        list(ids) + list(filtros.values())
+    )
+    if cursor.fetchone()['cantidad'] != len(ids):
+        raise HTTPException(status_code=404, detail="Algún elemento no existe o no pertenece a esta lista")
+    
+    casos = " ".join(["WHEN %s THEN %s"] * len(ids))
+    params = [valor for posicion, id_elemento in enumerate(ids, 1) for valor in (id_elemento, posicion)]
+    cursor.execute(
+        f"UPDATE {tabla} SET {columna_orden} = CASE {columna_id} {casos} END "
+        f"WHERE {columna_id} IN ({placeholders}) AND {where}",
+        params + list(ids) + list(filtros.values())
+    )
+    return cursor.rowcount
+
+@app.put("/api/reordenar-menu-sede")
+def reordenar_menu_sede(datos: ReordenarMenuSede, auth=Depends(get_current_user), test_mode: bool = False):
+    """Aplica el orden completo (MnuPeso) de los botones del menú de una sede en una transacción"""
+    autorizar_sede(auth, datos.sede, test_mode)
+    if not datos.ids:
+        return {"success": True, "actualizados": 0}
+    conn = None
+    cursor = None
+    try:
+        print(f"▶️ Reordenando menú sede {datos.sede}, tipo {datos.tipo_operacion}: {len(datos.ids)} elementos")
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        actualizados = reordenar_en_bloque(
+            cursor, "mnusedesbtn", "MnuID", "MnuPeso", datos.ids,
+            {"MnuSede": datos.sede, "MnuTipoOp": datos.tipo_operacion}
+        )
+        conn.commit()
+        invalidar_menus(test_mode, "mnusedesbtn", datos.sede)
+        print(f"✅ Menú reordenado: {actualizados} pesos cambiados")
+        return {"success": True, "actualizados": actualizados}
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
+    except Exception as e:
+        print(f"❌ ERROR reordenando menú sede: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@app.put("/api/reordenar-rubros-sede")
+def reordenar_rubros_sede(datos: ReordenarRubrosSede, auth=Depends(get_current_user), test_mode: bool = False):
+    """Aplica el orden completo (RuOrden) de los rubros de una sede en una transacción"""
+    autorizar_sede(auth, datos.sede, test_mode)
+    if not datos.ids:
+        return {"success": True, "actualizados": 0}
+    conn = None
+    cursor = None
+    try:
+        print(f"▶️ Reordenando rubros sede {datos.sede}, tipo gasto {datos.tip_gasto}: {len(datos.ids)} elementos")
+        conn = conectar_db(test_mode=test_mode)
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        actualizados = reordenar_en_bloque(
+            cursor, "rubingassede", "RuID", "RuOrden", datos.ids,
+            {"RuSede": datos.sede, "RuTipGasto": datos.tip_gasto}
+        )
+        conn.commit()
+        invalidar_menus(test_mode, "rubingassede", datos.sede)
+        print(f"✅ Rubros reordenados: {actualizados} órdenes cambiados")
+        return {"success": True, "actualizados": actualizados}
+    except HTTPException:
+        if conn:
+            conn.rollback()
+        raise
+    except Exception as e:
+        print(f"❌ ERROR reordenando rubros sede: {e}")
+        if conn:
+            conn.rollback()
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
 # Agregar rubro a personalizados (AInf → BInf)
 @app.post("/api/agregar-rubro-sede")
 async def agregar_rubro_sede(request: dict, test_mode: bool = False):
@@ -3110,6 +4233,7 @@ async def agregar_rubro_sede(request: dict, test_mode: bool = False):
         """, (sede, tip_gasto, rubro_cod, nombre, orden))
         
         conn.commit()
+        invalidar_menus(test_mode, "rubingassede")
         return {"message": "Rubro agregado correctamente"}
         
     except HTTPException:
@@ -3137,6 +4261,7 @@ async def eliminar_rubro_sede(rubro_id: int, test_mode: bool = False):
         """, (rubro_id))
         
         conn.commit()
+        invalidar_menus(test_mode, "rubingassede")
         
         if cursor.rowcount > 0:
             return {"message": "Rubro eliminado correctamente"}
@@ -3150,6 +4275,20 @@ async def eliminar_rubro_sede(rubro_id: int, test_mode: bool = False):
         cursor.close()
         conn.close()
 
+# ================== MÉTRICAS DE COMPRESIÓN ==================
+@app.get("/api/metricas/compresion")
+def obtener_metricas_compresion(reiniciar: bool = False, auth=Depends(get_current_user)):
+    """Bytes ahorrados por la compresión de respuestas, por ruta - Solo administradores"""
+    verificar_admin(auth)
+    rutas = metricas_compresion.resumen()
+    if reiniciar:
+        metricas_compresion.reiniciar()
+    return {
+        "success": True,
+        "bytes_ahorrados": sum(ruta["bytes_ahorrados"] for ruta in rutas),
+        "rutas": rutas
+    }
+
 # ================== PARA COMPROBRA SI FUNCIONA EL SERVIDOR ==================
 @app.get("/")
 def inicio():
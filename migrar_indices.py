@@ -0,0 +1,40 @@
+# migrar_indices.py
+"""
+Crea (una sola vez, fuera de línea) los índices de `movimientos` que usan
+las consultas de saldos. La API no los crea: construir un índice en una
+tabla grande bloquea la petición que lo lanza y necesita permiso ALTER.
+
+Uso:
+  python migrar_indices.py [--prueba]
+
+  --prueba  base de datos de prueba/capacitación (mlmdesal_jetro)
+Se puede repetir sin riesgo: si el índice ya existe no hace nada.
+"""
+import argparse
+import sys
+import time
+from db import conectar_db
+from saldos import asegurar_indice_movimientos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crea los índices de movimientos para las consultas de saldos")
+    parser.add_argument("--prueba", action="store_true", help="usar la base de datos de prueba")
+    args = parser.parse_args()
+
+    conn = conectar_db(test_mode=args.prueba)
+    try:
+        inicio = time.monotonic()
+        with conn.cursor() as cursor:
+            asegurar_indice_movimientos(cursor)
+        print(f"✅ Índices de movimientos al día ({time.monotonic() - inicio:.1f}s)")
+        return 0
+    except Exception as e:
+        print(f"❌ ERROR creando índices: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
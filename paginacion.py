@@ -0,0 +1,62 @@
+# paginacion.py
+"""
+Paginación por clave (keyset) para listados grandes.
+El cliente recibe en `siguiente` un cursor opaco con los valores de la
+clave de orden de la última fila y lo devuelve para pedir la página
+siguiente; la consulta continúa con WHERE (clave) > (cursor) en lugar de
+OFFSET, así el coste por página no crece con el número de página.
+"""
+import base64
+import json
+from fastapi import HTTPException
+
+LIMITE_MAXIMO_PAGINA = 1000
+
+
+def codificar_cursor(valores):
+    texto = json.dumps(list(valores), default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor, cantidad):
+    """Valores de la clave guardados en el cursor; 400 si no es un cursor válido"""
+    try:
+        relleno = "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno))
+    except (ValueError, TypeError):
+        valores = None
+    if not isinstance(valores, list) or len(valores) != cantidad:
+        raise HTTPException(status_code=400, detail="Cursor de paginación no válido")
+    return valores
+
+
+def condicion_despues_de(columnas):
+    """
+    WHERE equivalente a (c1, c2, ..., cn) > (%s, ..., %s), desarrollado en
+    OR/AND para que MySQL pueda usar el índice. Devuelve (sql, orden de
+    los parámetros como índices de la clave).
+    """
+    if len(columnas) == 1:
+        return f"{columnas[0]} > %s", [0]
+    resto, indices_resto = condicion_despues_de(columnas[1:])
+    sql = f"({columnas[0]} > %s OR ({columnas[0]} = %s AND {resto}))"
+    return sql, [0, 0] + [i + 1 for i in indices_resto]
+
+
+def parametros_despues_de(valores, indices):
+    return [valores[i] for i in indices]
+
+
+def orden_sin_nulos(columnas, admiten_nulos):
+    """
+    Expresiones de la clave de orden: las columnas que admiten NULL van como
+    COALESCE(col, ''). Comparar con NULL da NULL, así que sin esto las filas
+    con NULL se saltarían y un cursor con NULL devolvería una página vacía.
+    Usar las mismas expresiones en el ORDER BY y en condicion_despues_de.
+    """
+    return tuple(f"COALESCE({columna}, '')" if columna in admiten_nulos else columna for columna in columnas)
+
+
+def valores_sin_nulos(valores):
+    """Valores de la clave tal como los compara orden_sin_nulos (NULL -> '')"""
+    return ["" if valor is None else valor for valor in valores]
@@ -0,0 +1,243 @@
+# reconstruir_ledger.py
+"""
+Reconstrucción completa (fuera de línea) de los saldos acumulados y de los
+cierres mensuales de todas las sedes, desde el primer movimiento.
+
+/recalcular-saldos solo recalcula desde el último cierre y dentro de una
+petición HTTP. Después de corregir datos históricos, esta herramienta:
+  - recorre cada sede en orden (MoFecha, MoID) por tramos de TAMAÑO_TRAMO filas,
+  - recalcula MoSaldoCaja / MoSaldoBanco y el saldo de cada cierre con lo
+    acumulado hasta él (si la sede no tiene movimientos antes de su primer
+    cierre, ese cierre es el saldo de apertura y no se toca),
+  - reescribe solo lo que no cuadra, con UPDATE en bloque (saldos.actualizar_saldos),
+  - anota las filas cambiadas en el feed de cambios y regenera el resumen del
+    mes de los cierres corregidos,
+  - guarda en `reconstruccion_ledger`, en el mismo commit que cada tramo,
+    dónde se ha quedado, para continuar tras una interrupción.
+Las sedes se procesan en paralelo, cada una con su conexión.
+
+Uso:
+  python reconstruir_ledger.py [--prueba] [--sedes 3,7] [--paralelo 4] [--reiniciar]
+
+  --prueba     base de datos de prueba/capacitación (mlmdesal_jetro)
+  --sedes      solo esas sedes (por defecto todas las que tienen movimientos)
+  --reiniciar  descarta los puntos de control y empieza desde el principio
+Ejecutar con la API parada o sin uso: la API guarda en memoria los meses
+cerrados (vista_mensual.py), así que hay que reiniciarla al terminar.
+"""
+import argparse
+import sys
+import time
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from db import conectar_db, asegurar_tabla
+from cambios import asegurar_tabla_cambios, registrar_cambios, MODIFICACION
+from paginacion import condicion_despues_de, parametros_despues_de
+from resumenes import asegurar_tablas_resumen, crear_resumen_mes
+from saldos import actualizar_saldos, asegurar_indice_movimientos, como_fecha, saldo_difiere
+
+TAMAÑO_TRAMO = 5000
+MAX_SEDES_EN_PARALELO = 4
+
+DDL_RECONSTRUCCION = """
+CREATE TABLE IF NOT EXISTS reconstruccion_ledger (
+    RlSede INT NOT NULL,
+    RlFecha DATETIME NULL,
+    RlMoID INT NULL,
+    RlSaldoCaja DECIMAL(14,2) NOT NULL DEFAULT 0,
+    RlSaldoBanco DECIMAL(14,2) NOT NULL DEFAULT 0,
+    RlMovimientos INT NOT NULL DEFAULT 0,
+    RlActualizados INT NOT NULL DEFAULT 0,
+    RlCierresCorregidos INT NOT NULL DEFAULT 0,
+    RlTerminado TINYINT NOT NULL DEFAULT 0,
+    RlActualizado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (RlSede)
+)
+"""
+
+CONDICION_DESPUES, INDICES_DESPUES = condicion_despues_de(["MoFecha", "MoID"])
+
+
+def preparar(conn):
+    """DDL de las tablas auxiliares e índice (antes de cualquier escritura)"""
+    with conn.cursor() as cursor:
+        asegurar_tabla(cursor, "reconstruccion_ledger", DDL_RECONSTRUCCION)
+        asegurar_tabla_cambios(cursor)
+        asegurar_tablas_resumen(cursor)
+        asegurar_indice_movimientos(cursor)
+
+
+def sedes_con_movimientos(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT MoSede FROM movimientos ORDER BY MoSede")
+        return [int(fila['MoSede']) for fila in cursor.fetchall()]
+
+
+def reconstruir_sede(conn, sede, tamaño_tramo=TAMAÑO_TRAMO):
+    """Reconstruye la sede desde su punto de control; un commit por tramo"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT * FROM reconstruccion_ledger WHERE RlSede = %s", (sede,))
+        control = cursor.fetchone()
+        if control and control['RlTerminado']:
+            print(f"⏭️ Sede {sede}: ya reconstruida (usar --reiniciar para repetir)")
+            return {"sede": sede, "omitida": True}
+        if control is None:
+            cursor.execute("INSERT INTO reconstruccion_ledger (RlSede) VALUES (%s)", (sede,))
+            conn.commit()
+            control = {"RlFecha": None, "RlMoID": None, "RlSaldoCaja": 0, "RlSaldoBanco": 0,
+                       "RlMovimientos": 0, "RlActualizados": 0, "RlCierresCorregidos": 0}
+
+        cursor.execute("""
+        SELECT MoID, MoFecha, MoSaldoCaja, MoSaldoBanco
+        FROM movimientos
+        WHERE MoSede = %s AND MoDona = 9999
+        ORDER BY MoFecha, MoID
+        """, (sede,))
+        cierres = cursor.fetchall()
+        dias_cierres = [como_fecha(cierre['MoFecha']) for cierre in cierres]
+        cursor.execute("SELECT RsAnyo, RsMes FROM resumenes_meses WHERE RsSede = %s", (sede,))
+        meses_con_resumen = {(int(fila['RsAnyo']), int(fila['RsMes'])) for fila in cursor.fetchall()}
+
+    # Estado tras el último tramo confirmado
+    posicion = (control['RlFecha'], control['RlMoID']) if control['RlMoID'] is not None else None
+    caja = float(control['RlSaldoCaja'] or 0)
+    banco = float(control['RlSaldoBanco'] or 0)
+    procesados = int(control['RlMovimientos'])
+    actualizados = int(control['RlActualizados'])
+    cierres_corregidos = int(control['RlCierresCorregidos'])
+    # Los cierres de un día preceden a los movimientos de ese día (como en saldos.py)
+    siguiente_cierre = bisect_right(dias_cierres, como_fecha(posicion[0])) if posicion else 0
+    inicio = time.monotonic()
+
+    def aplicar_cierres(hasta, cambios, resumenes):
+        nonlocal caja, banco, siguiente_cierre, cierres_corregidos
+        limite = len(cierres) if hasta is None else bisect_right(dias_cierres, hasta)
+        while siguiente_cierre < limite:
+            cierre = cierres[siguiente_cierre]
+            siguiente_cierre += 1
+            if procesados == 0:
+                # Saldo de apertura: no hay nada acumulado antes
+                caja = float(cierre['MoSaldoCaja'] or 0)
+                banco = float(cierre['MoSaldoBanco'] or 0)
+                continue
+            if saldo_difiere(cierre['MoSaldoCaja'], caja) or saldo_difiere(cierre['MoSaldoBanco'], banco):
+                cambios.append((cierre['MoID'], round(caja, 2), round(banco, 2)))
+                cierres_corregidos += 1
+                dia = dias_cierres[siguiente_cierre - 1]
+                if (dia.year, dia.month) in meses_con_resumen:
+                    resumenes.add((dia.year, dia.month))
+
+    while True:
+        with conn.cursor() as cursor:
+            sql = """
+            SELECT MoID, MoFecha, MoCChica, MoImporte, MoSaldoCaja, MoSaldoBanco
+            FROM movimientos
+            WHERE MoSede = %s AND MoDona != 9999
+            """
+            params = [sede]
+            if posicion:
+                sql += f" AND {CONDICION_DESPUES}"
+                params += parametros_despues_de(posicion, INDICES_DESPUES)
+            sql += " ORDER BY MoFecha, MoID LIMIT %s"
+            cursor.execute(sql, params + [tamaño_tramo])
+            filas = cursor.fetchall()
+
+            cambios = []
+            resumenes = set()
+            try:
+                for fila in filas:
+                    aplicar_cierres(como_fecha(fila['MoFecha']), cambios, resumenes)
+                    caja += float(fila['MoCChica'] or 0)
+                    banco += float(fila['MoImporte'] or 0)
+                    procesados += 1
+                    if saldo_difiere(fila['MoSaldoCaja'], caja) or saldo_difiere(fila['MoSaldoBanco'], banco):
+                        cambios.append((fila['MoID'], round(caja, 2), round(banco, 2)))
+                terminado = len(filas) < tamaño_tramo
+                if terminado:
+                    aplicar_cierres(None, cambios, resumenes)
+
+                actualizar_saldos(cursor, cambios)
+                for año, mes in sorted(resumenes):
+                    crear_resumen_mes(cursor, sede, año, mes)
+                actualizados += len(cambios)
+                if filas:
+                    posicion = (filas[-1]['MoFecha'], filas[-1]['MoID'])
+                cursor.execute("""
+                UPDATE reconstruccion_ledger
+                SET RlFecha = %s, RlMoID = %s, RlSaldoCaja = %s, RlSaldoBanco = %s,
+                    RlMovimientos = %s, RlActualizados = %s, RlCierresCorregidos = %s, RlTerminado = %s
+                WHERE RlSede = %s
+                """, (posicion[0] if posicion else None, posicion[1] if posicion else None,
+                      round(caja, 2), round(banco, 2), procesados, actualizados,
+                      cierres_corregidos, int(terminado), sede))
+                registrar_cambios(cursor, sede, MODIFICACION, [cambio[0] for cambio in cambios])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        print(f"🔄 Sede {sede}: {procesados} movimientos, {actualizados} saldos corregidos")
+        if terminado:
+            break
+
+    print(f"✅ Sede {sede} reconstruida en {time.monotonic() - inicio:.1f}s "
+          f"({cierres_corregidos} cierres corregidos)")
+    return {
+        "sede": sede,
+        "movimientos": procesados,
+        "saldos_corregidos": actualizados,
+        "cierres_corregidos": cierres_corregidos,
+        "saldo_final_caja": round(caja, 2),
+        "saldo_final_banco": round(banco, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruye saldos y cierres de todas las sedes")
+    parser.add_argument("--prueba", action="store_true", help="usar la base de datos de prueba")
+    parser.add_argument("--sedes", help="códigos de sede separados por comas (por defecto todas)")
+    parser.add_argument("--paralelo", type=int, default=MAX_SEDES_EN_PARALELO, help="sedes a la vez")
+    parser.add_argument("--tramo", type=int, default=TAMAÑO_TRAMO, help="movimientos por commit")
+    parser.add_argument("--reiniciar", action="store_true", help="empezar de cero ignorando los puntos de control")
+    args = parser.parse_args()
+
+    conn = conectar_db(test_mode=args.prueba)
+    try:
+        preparar(conn)
+        if args.sedes:
+            sedes = sorted({int(codigo) for codigo in args.sedes.split(",") if codigo.strip()})
+        else:
+            sedes = sedes_con_movimientos(conn)
+        if args.reiniciar:
+            with conn.cursor() as cursor:
+                placeholders = ",".join(["%s"] * len(sedes)) or "NULL"
+                cursor.execute(f"DELETE FROM reconstruccion_ledger WHERE RlSede IN ({placeholders})", sedes)
+            conn.commit()
+    finally:
+        conn.close()
+
+    print(f"▶️ Reconstruyendo {len(sedes)} sedes ({args.paralelo} a la vez)")
+
+    def reconstruir(sede):
+        conn = conectar_db(test_mode=args.prueba)
+        try:
+            return reconstruir_sede(conn, sede, args.tramo)
+        finally:
+            conn.close()
+
+    errores = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.paralelo)) as ejecutor:
+        futuros = {ejecutor.submit(reconstruir, sede): sede for sede in sedes}
+        for futuro in as_completed(futuros):
+            try:
+                futuro.result()
+            except Exception as e:
+                errores += 1
+                print(f"❌ ERROR en sede {futuros[futuro]}: {e} (se puede reanudar desde el último tramo)")
+
+    print("🔁 Reinicie la API para descartar los meses cerrados que tiene en memoria")
+    return 1 if errores else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+# respuestas.py
+"""
+Respuesta JSON rápida para las filas de pymysql.
+Serializa con orjson directamente (date/datetime nativos, Decimal y
+timedelta con un `default` mínimo) en lugar de pasar cada fila por
+jsonable_encoder. El resultado es el mismo JSON que devolvía FastAPI:
+Decimal sin decimales -> int, con decimales -> float, TIME -> segundos.
+También el formato columnar opcional (?format=columnar) de los listados.
+"""
+from datetime import timedelta
+from decimal import Decimal
+from typing import Optional
+import orjson
+import pymysql
+from fastapi import HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Claves no str (p.ej. meses como int) igual que jsonable_encoder
+OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS
+
+
+def _convertir(valor):
+    """Tipos que orjson no serializa por sí mismo"""
+    if isinstance(valor, Decimal):
+        return int(valor) if valor.as_tuple().exponent >= 0 else float(valor)
+    if isinstance(valor, timedelta):
+        return valor.total_seconds()
+    if isinstance(valor, (bytes, bytearray)):
+        return valor.decode()
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    # Modelos pydantic y demás casos raros: como hasta ahora
+    return jsonable_encoder(valor)
+
+
+def a_json(contenido):
+    return orjson.dumps(contenido, default=_convertir, option=OPCIONES_ORJSON)
+
+
+class RespuestaJSON(JSONResponse):
+    """
+    Clase de respuesta por defecto de la app. Los endpoints con muchas filas
+    la devuelven directamente (return RespuestaJSON(datos)) para que FastAPI
+    no recorra antes el contenido con jsonable_encoder.
+    """
+    media_type = "application/json"
+
+    def render(self, content):
+        return a_json(content)
+
+
+# ================== FORMATO COLUMNAR ==================
+# ?format=columnar -> {"columns": [...], "rows": [[...], ...]}
+FORMATO_COLUMNAR = "columnar"
+
+
+def formato_columnar(
+    formato: Optional[str] = Query(None, alias="format", description="'columnar' para columnas + filas")
+):
+    """Dependencia: True si el cliente pide el formato columnar"""
+    if formato in (None, "", "json"):
+        return False
+    if formato == FORMATO_COLUMNAR:
+        return True
+    raise HTTPException(status_code=400, detail=f"Formato no soportado: {formato}")
+
+
+def cursor_filas(conn, columnar):
+    """Cursor de tuplas en formato columnar (sin crear un dict por fila), DictCursor si no"""
+    return conn.cursor(pymysql.cursors.Cursor if columnar else pymysql.cursors.DictCursor)
+
+
+def columnas_cursor(cursor):
+    return [columna[0] for columna in cursor.description]
+
+
+def tabla_columnar(cursor, filas):
+    """Filas de un cursor de tuplas en formato columnar"""
+    return {"columns": columnas_cursor(cursor), "rows": filas}
+
+
+def dicts_a_columnar(filas):
+    """Para resultados que ya son dicts (post-procesados en Python)"""
+    columnas = list(dict.fromkeys(clave for fila in filas for clave in fila))
+    return {"columns": columnas, "rows": [[fila.get(columna) for columna in columnas] for fila in filas]}
@@ -0,0 +1,182 @@
+# resumenes.py
+"""
+Resúmenes congelados de los meses cerrados. Al crear el cierre de un mes
+se guardan, en la misma transacción:
+  - resumen_conceptos: totales de caja/banco por MoTiMo / MoTGas / MoRubr
+  - resumen_domingos:  totales de diezmos y ofrendas de cada domingo
+y una marca en resumenes_meses. Un mes cerrado ya no admite escrituras,
+así que los informes leen los meses con resumen de estas tablas y solo
+consultan `movimientos` para el tramo abierto (a partir de corte_resumenes).
+Los meses cerrados antes de existir esto se pueden completar con
+resumenes_pendientes() + crear_resumen_mes(). Aquí no se hace commit.
+"""
+from datetime import date, timedelta
+from archivo import asegurar_tablas_archivo, fuente_movimientos
+from db import asegurar_tabla
+from saldos import como_fecha
+
+# Códigos de movimientos usados por los informes de diezmos
+TIPO_INGRESO = 100
+CONCEPTO_DIEZMO = 2
+CONCEPTOS_CULTO = (2, 3, 4, 9)
+
+DDL_RESUMENES_MESES = """
+CREATE TABLE IF NOT EXISTS resumenes_meses (
+    RsSede INT NOT NULL,
+    RsAnyo SMALLINT NOT NULL,
+    RsMes TINYINT NOT NULL,
+    RsCreado DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (RsSede, RsAnyo, RsMes)
+)
+"""
+
+DDL_RESUMEN_CONCEPTOS = """
+CREATE TABLE IF NOT EXISTS resumen_conceptos (
+    RcSede INT NOT NULL,
+    RcAnyo SMALLINT NOT NULL,
+    RcMes TINYINT NOT NULL,
+    RcTiMo INT NOT NULL,
+    RcTGas INT NOT NULL,
+    RcRubr INT NOT NULL,
+    RcCaja DECIMAL(14,2) NOT NULL,
+    RcBanco DECIMAL(14,2) NOT NULL,
+    RcMovimientos INT NOT NULL,
+    RcSaldoBanco DECIMAL(14,2) NULL,
+    PRIMARY KEY (RcSede, RcAnyo, RcMes, RcTiMo, RcTGas, RcRubr)
+)
+"""
+
+# Saldo de banco del último movimiento del grupo en el orden del libro
+# (MoFecha, MoID): el primero del GROUP_CONCAT ordenado al revés
+SQL_ULTIMO_SALDO_BANCO = (
+    "CAST(SUBSTRING_INDEX(GROUP_CONCAT(COALESCE(MoSaldoBanco, 0) "
+    "ORDER BY MoFecha DESC, MoID DESC), ',', 1) AS DECIMAL(14,2))"
+)
+
+# RdoFecha se crea copiando la columna MoFecha (DATE o DATETIME según la
+# instalación) para que el informe devuelva la fecha exactamente igual
+DDL_RESUMEN_DOMINGOS = """
+CREATE TABLE IF NOT EXISTS resumen_domingos (
+    PRIMARY KEY (RdoSede, RdoFecha)
+)
+SELECT MoSede AS RdoSede, MoFecha AS RdoFecha,
+       CAST(0 AS DECIMAL(14,2)) AS RdoCaja,
+       CAST(0 AS DECIMAL(14,2)) AS RdoBanco,
+       CAST(0 AS DECIMAL(14,2)) AS RdoImporte
+FROM movimientos WHERE 1 = 0
+"""
+
+
+def asegurar_tablas_resumen(cursor):
+    """resumenes_meses (qué meses están congelados) y sus totales: resumen_conceptos y resumen_domingos"""
+    asegurar_tabla(cursor, "resumenes_meses", DDL_RESUMENES_MESES)
+    asegurar_tabla(cursor, "resumen_conceptos", DDL_RESUMEN_CONCEPTOS)
+    asegurar_tabla(cursor, "resumen_domingos", DDL_RESUMEN_DOMINGOS)
+    # crear_resumen_mes lee también los años archivados
+    asegurar_tablas_archivo(cursor)
+
+
+def rango_mes(año, mes):
+    """[primer día del mes, primer día del mes siguiente)"""
+    return date(año, mes, 1), (date(año, mes + 1, 1) if mes < 12 else date(año + 1, 1, 1))
+
+
+def crear_resumen_mes(cursor, sede, año, mes):
+    """
+    Congela los totales del mes (reemplaza un resumen anterior si lo hubiera).
+    Lee con fuente_movimientos: el mes puede estar ya en movimientos_archivo.
+    """
+    eliminar_resumen_mes(cursor, sede, año, mes)
+    inicio, fin = rango_mes(año, mes)
+    tabla, params_tabla = fuente_movimientos(cursor, sede, inicio, fin - timedelta(days=1))
+
+    # RcSaldoBanco solo tiene sentido para MoTiMo = 0 (el saldo inicial del cierre):
+    # el del último movimiento del mes de ese MoTiMo/MoTGas, igual en todos sus rubros
+    cursor.execute(f"""
+    INSERT INTO resumen_conceptos (
+        RcSede, RcAnyo, RcMes, RcTiMo, RcTGas, RcRubr, RcCaja, RcBanco, RcMovimientos, RcSaldoBanco
+    )
+    SELECT m.MoSede, %s, %s, m.MoTiMo, m.MoTGas, COALESCE(m.MoRubr, 0),
+           COALESCE(SUM(m.MoCChica), 0), COALESCE(SUM(m.MoImporte), 0), COUNT(*), MAX(s.Saldo)
+    FROM {tabla} m
+    INNER JOIN (
+        SELECT MoTiMo, MoTGas, {SQL_ULTIMO_SALDO_BANCO} AS Saldo
+        FROM {tabla} u
+        WHERE MoSede = %s AND MoFecha >= %s AND MoFecha < %s
+        GROUP BY MoTiMo, MoTGas
+    ) s ON s.MoTiMo <=> m.MoTiMo AND s.MoTGas <=> m.MoTGas
+    WHERE m.MoSede = %s AND m.MoFecha >= %s AND m.MoFecha < %s
+    GROUP BY m.MoSede, m.MoTiMo, m.MoTGas, COALESCE(m.MoRubr, 0)
+    """, (año, mes, *params_tabla, *params_tabla, sede, inicio, fin, sede, inicio, fin))
+
+    # Mismo criterio que el informe de diezmos y ofrendas por domingos
+    conceptos = ", ".join(["%s"] * len(CONCEPTOS_CULTO))
+    cursor.execute(f"""
+    INSERT INTO resumen_domingos (RdoSede, RdoFecha, RdoCaja, RdoBanco, RdoImporte)
+    SELECT m.MoSede, m.MoFecha, SUM(m.MoCChica), SUM(m.MoImporte), SUM(m.MoCChica + m.MoImporte)
+    FROM {tabla} m
+    INNER JOIN opcionbtns o ON o.OpTipoOp = m.MoTiMo AND o.OpCod = m.MoTGas
+    WHERE m.MoSede = %s AND m.MoTiMo = %s AND m.MoTGas IN ({conceptos})
+    AND m.MoFecha >= %s AND m.MoFecha < %s
+    AND DAYOFWEEK(m.MoFecha) = 1
+    GROUP BY m.MoSede, m.MoFecha
+    """, (*params_tabla, sede, TIPO_INGRESO, *CONCEPTOS_CULTO, inicio, fin))
+
+    cursor.execute(
+        "INSERT INTO resumenes_meses (RsSede, RsAnyo, RsMes) VALUES (%s, %s, %s)",
+        (sede, año, mes)
+    )
+
+
+def eliminar_resumen_mes(cursor, sede, año, mes):
+    """Al eliminar el cierre el mes vuelve a estar abierto"""
+    inicio, fin = rango_mes(año, mes)
+    cursor.execute("DELETE FROM resumenes_meses WHERE RsSede = %s AND RsAnyo = %s AND RsMes = %s", (sede, año, mes))
+    cursor.execute("DELETE FROM resumen_conceptos WHERE RcSede = %s AND RcAnyo = %s AND RcMes = %s", (sede, año, mes))
+    cursor.execute(
+        "DELETE FROM resumen_domingos WHERE RdoSede = %s AND RdoFecha >= %s AND RdoFecha < %s",
+        (sede, inicio, fin)
+    )
+
+
+def corte_resumenes(cursor, sede, desde):
+    """
+    Primer día del primer mes, a partir del mes de `desde`, que NO tiene
+    resumen: lo anterior se lee de los resúmenes y lo posterior de movimientos.
+    """
+    desde = como_fecha(desde)
+    cursor.execute("""
+    SELECT RsAnyo, RsMes FROM resumenes_meses
+    WHERE RsSede = %s AND (RsAnyo > %s OR (RsAnyo = %s AND RsMes >= %s))
+    """, (sede, desde.year, desde.year, desde.month))
+    filas = cursor.fetchall()
+    # Sirve también con cursores de tuplas (informes en formato columnar)
+    meses = {(int(fila[0]), int(fila[1])) if isinstance(fila, tuple) else (int(fila['RsAnyo']), int(fila['RsMes']))
+             for fila in filas}
+    año, mes = desde.year, desde.month
+    while (año, mes) in meses:
+        año, mes = (año, mes + 1) if mes < 12 else (año + 1, 1)
+    return date(año, mes, 1)
+
+
+def mes_corte_en_año(corte, año):
+    """Meses del año con resumen: RsMes < mes_corte_en_año(corte, año)"""
+    if corte.year > año:
+        return 13
+    return corte.month if corte.year == año else 1
+
+
+def resumenes_pendientes(cursor, sede):
+    """(año, mes) cerrados de la sede que aún no tienen resumen"""
+    cursor.execute("""
+    SELECT DISTINCT YEAR(m.MoFecha) AS anyo, MONTH(m.MoFecha) AS mes
+    FROM movimientos m
+    WHERE m.MoSede = %s AND m.MoDona = 9999
+    """, (sede,))
+    cerrados = set()
+    for fila in cursor.fetchall():
+        anyo, mes = int(fila['anyo']), int(fila['mes'])
+        cerrados.add((anyo, mes - 1) if mes > 1 else (anyo - 1, 12))
+    cursor.execute("SELECT RsAnyo, RsMes FROM resumenes_meses WHERE RsSede = %s", (sede,))
+    con_resumen = {(int(fila['RsAnyo']), int(fila['RsMes'])) for fila in cursor.fetchall()}
+    return sorted(cerrados - con_resumen)
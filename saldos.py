@@ -0,0 +1,274 @@
+# saldos.py
+"""
+Funciones compartidas para grabar movimientos en bloque y recalcular los
+saldos acumulados (MoSaldoCaja / MoSaldoBanco) de una sede.
+Todas reciben un cursor DictCursor y NO hacen commit: la transacción
+la controla el endpoint que las llama.
+"""
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from db import asegurar_indice
+
+# MoDona de los registros de cierre mensual
+CIERRE = 9999
+
+# Columnas de INSERT en el mismo orden que las tuplas de `insertar_movimientos`
+COLUMNAS_MOVIMIENTO = (
+    "MoSede", "MoTiMo", "MoTGas", "MoRubr", "MoFecha", "MoDesc",
+    "MoImporte", "MoCChica", "MoSaldoCaja", "MoSaldoBanco",
+    "MoDona", "MoPers", "MoSedeDes", "MoUser"
+)
+
+# Filas por sentencia en inserciones y actualizaciones en bloque
+TAMAÑO_LOTE = 500
+
+# Diferencia mínima para considerar que un saldo guardado es distinto
+TOLERANCIA_SALDO = 0.005
+
+# Índice para buscar el último movimiento de una sede hasta una fecha
+# (/saldos-en-fecha, /panel-saldos, cierres). NO se crea desde la API: se
+# instala una vez con `python migrar_indices.py [--prueba]`; sin él esas
+# consultas funcionan igual, pero recorren más filas. El DDL equivalente es
+#   CREATE INDEX idx_movimientos_sede_fecha ON movimientos (MoSede, MoFecha);
+INDICE_SEDE_FECHA = "idx_movimientos_sede_fecha"
+COLUMNAS_INDICE_SEDE_FECHA = ("MoSede", "MoFecha")
+
+
+def asegurar_indice_movimientos(cursor):
+    """
+    (MoSede, MoFecha): InnoDB añade MoID, así que sirve para ORDER BY MoFecha, MoID.
+    Solo para herramientas fuera de línea (migrar_indices.py, reconstruir_ledger.py)
+    """
+    asegurar_indice(cursor, "movimientos", INDICE_SEDE_FECHA, COLUMNAS_INDICE_SEDE_FECHA)
+
+
+def como_fecha(valor):
+    """date, datetime o 'AAAA-MM-DD...' -> date (MoFecha puede ser DATE o DATETIME)"""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    return datetime.strptime(str(valor)[:10], "%Y-%m-%d").date()
+
+
+def incremento_ids_consecutivos(cursor):
+    """
+    Paso entre los MoID de un INSERT multi-fila, o None si el servidor no
+    garantiza que sean consecutivos. InnoDB solo reserva los valores de una
+    sentencia de una vez con innodb_autoinc_lock_mode 0 o 1 (MySQL 8 usa 2
+    por defecto); auto_increment_increment > 1 (replicación, Galera) cambia
+    el paso.
+    """
+    cursor.execute("SELECT @@auto_increment_increment AS incremento, @@innodb_autoinc_lock_mode AS modo")
+    fila = cursor.fetchone()
+    incremento, modo = (fila['incremento'], fila['modo']) if isinstance(fila, dict) else fila
+    return int(incremento) if int(modo) in (0, 1) else None
+
+
+def insertar_movimientos(cursor, filas, tamaño_lote=TAMAÑO_LOTE):
+    """
+    Inserta las filas y devuelve sus MoID en el mismo orden. Con IDs
+    consecutivos garantizados usa INSERT multi-fila; si no, una sentencia
+    por fila (lastrowid exacto): los MoID devueltos deciden qué filas
+    reciben los saldos, así que no se pueden suponer.
+    """
+    ids = []
+    grupo = "(" + ", ".join(["%s"] * len(COLUMNAS_MOVIMIENTO)) + ", NOW())"
+    incremento = incremento_ids_consecutivos(cursor)
+    if incremento is None:
+        tamaño_lote = 1
+    for inicio in range(0, len(filas), tamaño_lote):
+        lote = filas[inicio:inicio + tamaño_lote]
+        sql = (
+            f"INSERT INTO movimientos ({', '.join(COLUMNAS_MOVIMIENTO)}, MoHecho) VALUES "
+            + ", ".join([grupo] * len(lote))
+        )
+        cursor.execute(sql, [valor for fila in lote for valor in fila])
+        if cursor.rowcount != len(lote):
+            raise RuntimeError(f"INSERT de {len(lote)} movimientos afectó a {cursor.rowcount} filas")
+        # lastrowid es el MoID de la primera fila
+        paso = incremento or 1
+        ids.extend(range(cursor.lastrowid, cursor.lastrowid + len(lote) * paso, paso))
+    return ids
+
+
+def actualizar_saldos(cursor, cambios, tamaño_lote=TAMAÑO_LOTE, progreso=None):
+    """Aplica [(MoID, saldo_caja, saldo_banco), ...] con un UPDATE ... JOIN por lote"""
+    for inicio in range(0, len(cambios), tamaño_lote):
+        if progreso:
+            progreso(inicio / len(cambios))
+        lote = cambios[inicio:inicio + tamaño_lote]
+        valores = " UNION ALL ".join(["SELECT %s AS id, %s AS caja, %s AS banco"] * len(lote))
+        sql = f"""
+        UPDATE movimientos m
+        JOIN ({valores}) s ON m.MoID = s.id
+        SET m.MoSaldoCaja = s.caja, m.MoSaldoBanco = s.banco
+        """
+        cursor.execute(sql, [valor for cambio in lote for valor in cambio])
+
+
+def saldo_difiere(guardado, calculado):
+    return abs(float(guardado or 0) - calculado) >= TOLERANCIA_SALDO
+
+
+def obtener_ultimo_cierre(cursor, sede, hasta=None):
+    """Último registro de cierre de la sede (opcionalmente con MoFecha <= hasta)"""
+    query = """
+    SELECT MoID, MoSaldoCaja, MoSaldoBanco, MoFecha
+    FROM movimientos
+    WHERE MoSede = %s AND MoDona = 9999
+    """
+    params = [sede]
+    if hasta is not None:
+        query += " AND MoFecha <= %s"
+        params.append(hasta)
+    query += " ORDER BY MoFecha DESC LIMIT 1"
+    cursor.execute(query, params)
+    return cursor.fetchone()
+
+
+def obtener_saldo_base(cursor, sede, fecha_desde):
+    """Saldos (caja, banco) justo antes del primer movimiento con MoFecha >= fecha_desde"""
+    cierre = obtener_ultimo_cierre(cursor, sede, hasta=fecha_desde)
+    fecha_cierre = cierre['MoFecha'] if cierre else '1900-01-01'
+
+    # El cierre precede a todos los movimientos de su fecha
+    cursor.execute("""
+    SELECT MoSaldoCaja, MoSaldoBanco
+    FROM movimientos
+    WHERE MoSede = %s AND MoDona != 9999
+    AND MoFecha >= %s AND MoFecha < %s
+    ORDER BY MoFecha DESC, MoID DESC
+    LIMIT 1
+    """, (sede, fecha_cierre, fecha_desde))
+    anterior = cursor.fetchone() or cierre
+
+    if not anterior:
+        return 0.0, 0.0
+    return float(anterior['MoSaldoCaja'] or 0), float(anterior['MoSaldoBanco'] or 0)
+
+
+def recalcular_saldos_desde(cursor, sede, fecha_desde=None, progreso=None):
+    """
+    Recalcula los saldos acumulados de la sede a partir de fecha_desde
+    (o desde el último cierre si es None). Solo reescribe las filas cuyo
+    saldo guardado no coincide con el calculado.
+    `progreso(fraccion)` opcional para los trabajos en segundo plano.
+    """
+    if fecha_desde is None:
+        cierre = obtener_ultimo_cierre(cursor, sede)
+        if cierre:
+            saldo_caja = float(cierre['MoSaldoCaja'] or 0)
+            saldo_banco = float(cierre['MoSaldoBanco'] or 0)
+            fecha_desde = cierre['MoFecha']
+        else:
+            saldo_caja, saldo_banco = 0.0, 0.0
+            fecha_desde = '1900-01-01'
+    else:
+        saldo_caja, saldo_banco = obtener_saldo_base(cursor, sede, fecha_desde)
+
+    cursor.execute("""
+    SELECT MoID, MoCChica, MoImporte, MoSaldoCaja, MoSaldoBanco
+    FROM movimientos
+    WHERE MoSede = %s
+    AND MoFecha >= %s
+    AND MoDona != 9999
+    ORDER BY MoFecha, MoID
+    """, (sede, fecha_desde))
+    movimientos = cursor.fetchall()
+
+    cambios = []
+    for mov in movimientos:
+        saldo_caja += float(mov['MoCChica'] or 0)
+        saldo_banco += float(mov['MoImporte'] or 0)
+        if saldo_difiere(mov['MoSaldoCaja'], saldo_caja) or saldo_difiere(mov['MoSaldoBanco'], saldo_banco):
+            cambios.append((mov['MoID'], round(saldo_caja, 2), round(saldo_banco, 2)))
+
+    if progreso:
+        progreso(0.5)
+    actualizar_saldos(cursor, cambios, progreso=progreso and (lambda f: progreso(0.5 + f / 2)))
+
+    return {
+        "fecha_desde": str(fecha_desde),
+        "movimientos_recalculados": len(movimientos),
+        "movimientos_actualizados": len(cambios),
+        "ids_actualizados": [cambio[0] for cambio in cambios],
+        "saldo_final_caja": saldo_caja,
+        "saldo_final_banco": saldo_banco
+    }
+
+
+def saldos_en_fechas(cursor, sede, fechas):
+    """
+    Saldos de caja y banco al final de cada una de las `fechas` (date) de la sede.
+
+    Punto de partida de cada fecha: el último cierre hasta esa fecha (todos
+    los cierres de la sede en una consulta). Desde él, el último movimiento
+    hasta la fecha con una búsqueda por índice (todas las fechas en una sola
+    consulta UNION ALL). Igual que en obtener_saldo_base, el cierre precede
+    a los movimientos de su fecha. Devuelve {fecha: {...}}.
+    """
+    fechas = sorted(set(fechas))
+    if not fechas:
+        return {}
+
+    cursor.execute("""
+    SELECT MoID, MoFecha, MoSaldoCaja, MoSaldoBanco
+    FROM movimientos
+    WHERE MoSede = %s AND MoDona = 9999 AND MoFecha < %s
+    ORDER BY MoFecha, MoID
+    """, (sede, fechas[-1] + timedelta(days=1)))
+    cierres = cursor.fetchall()
+    dias_cierres = [como_fecha(cierre['MoFecha']) for cierre in cierres]
+
+    partes = []
+    params = []
+    puntos_partida = []
+    for indice, fecha in enumerate(fechas):
+        posicion = bisect_right(dias_cierres, fecha) - 1
+        cierre = cierres[posicion] if posicion >= 0 else None
+        puntos_partida.append(cierre)
+        partes.append("""
+        (SELECT %s AS Indice, MoID, MoFecha, MoSaldoCaja, MoSaldoBanco
+         FROM movimientos
+         WHERE MoSede = %s AND MoDona != 9999 AND MoFecha >= %s AND MoFecha < %s
+         ORDER BY MoFecha DESC, MoID DESC
+         LIMIT 1)
+        """)
+        params.extend([indice, sede, cierre['MoFecha'] if cierre else '1900-01-01', fecha + timedelta(days=1)])
+    cursor.execute(" UNION ALL ".join(partes), params)
+    ultimos = {fila['Indice']: fila for fila in cursor.fetchall()}
+
+    saldos = {}
+    for indice, fecha in enumerate(fechas):
+        fila = ultimos.get(indice) or puntos_partida[indice]
+        if fila is None:
+            origen = "sin_movimientos"
+        else:
+            origen = "movimiento" if indice in ultimos else "cierre"
+        saldos[fecha] = {
+            "fecha": fecha.isoformat(),
+            "saldo_caja": round(float(fila['MoSaldoCaja'] or 0), 2) if fila else 0.0,
+            "saldo_banco": round(float(fila['MoSaldoBanco'] or 0), 2) if fila else 0.0,
+            "origen": origen,
+            "MoID": fila['MoID'] if fila else None,
+            "fecha_movimiento": str(como_fecha(fila['MoFecha'])) if fila else None,
+        }
+    return saldos
+
+
+def meses_cerrados(cursor, sede, desde):
+    """
+    Conjunto de (año, mes) cerrados a partir de la fecha `desde`.
+    Un mes está cerrado si existe el registro de cierre del mes SIGUIENTE.
+    """
+    cursor.execute("""
+    SELECT DISTINCT YEAR(MoFecha) AS anyo, MONTH(MoFecha) AS mes
+    FROM movimientos
+    WHERE MoSede = %s AND MoDona = 9999 AND MoFecha >= %s
+    """, (sede, date(desde.year, desde.month, 1)))
+    cerrados = set()
+    for fila in cursor.fetchall():
+        anyo, mes = int(fila['anyo']), int(fila['mes'])
+        cerrados.add((anyo, mes - 1) if mes > 1 else (anyo - 1, 12))
+    return cerrados
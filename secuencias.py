@@ -0,0 +1,134 @@
+# secuencias.py
+"""
+Asignación de códigos nuevos (fieles, locales, usuarios) sin MAX()+1.
+Cada proceso reserva bloques de códigos con un único UPDATE atómico sobre
+la tabla `secuencias` y los reparte desde memoria, de modo que dos altas
+simultáneas nunca reciben el mismo código.
+"""
+import threading
+from db import conectar_db, asegurar_tabla
+
+DDL_SECUENCIAS = """
+CREATE TABLE IF NOT EXISTS secuencias (
+    SeNombre VARCHAR(30) NOT NULL PRIMARY KEY,
+    SeValor BIGINT NOT NULL
+)
+"""
+
+# Códigos que reserva cada UPDATE
+TAMAÑO_BLOQUE = 10
+
+# Valor inicial de cada secuencia, calculado una única vez desde la tabla real
+SEMILLAS = {
+    "fieles": "SELECT COALESCE(MAX(fiCod), 1000) FROM fieles",
+    "locales": "SELECT COALESCE(MAX(LoCod), 0) FROM locales",
+    "usuarios": "SELECT COALESCE(MAX(CAST(SUBSTRING(UsCod, 4) AS UNSIGNED)), 0) FROM usuarios WHERE UsCod LIKE 'USR%%'",
+}
+
+# Códigos que nunca se asignan (999 = "todas las sedes" en UsSedes)
+EXCLUIDOS = {
+    "locales": {999},
+}
+
+# Altas con un código ya ocupado (grabado fuera de la secuencia) antes de desistir
+INTENTOS_ASIGNACION = 5
+
+
+class AsignadorCodigos:
+    """Reparte códigos consecutivos por (base de datos, secuencia) desde bloques reservados"""
+
+    def __init__(self, tamaño_bloque=TAMAÑO_BLOQUE):
+        self.tamaño_bloque = tamaño_bloque
+        self._bloques = {}  # (test_mode, nombre) -> [siguiente, ultimo]
+        self._lock = threading.Lock()
+
+    def _reservar_bloque(self, test_mode, nombre):
+        conn = conectar_db(test_mode=test_mode)
+        try:
+            with conn.cursor() as cursor:
+                asegurar_tabla(cursor, "secuencias", DDL_SECUENCIAS)
+                for _ in range(2):
+                    cursor.execute(
+                        "UPDATE secuencias SET SeValor = LAST_INSERT_ID(SeValor + %s) WHERE SeNombre = %s",
+                        (self.tamaño_bloque, nombre)
+                    )
+                    if cursor.rowcount:
+                        cursor.execute("SELECT LAST_INSERT_ID() AS valor")
+                        ultimo = int(cursor.fetchone()['valor'])
+                        conn.commit()
+                        print(f"🔢 Reservados códigos de {nombre}: {ultimo - self.tamaño_bloque + 1}-{ultimo}")
+                        return [ultimo - self.tamaño_bloque + 1, ultimo]
+                    # Primera vez: sembrar la secuencia con el máximo actual
+                    cursor.execute(
+                        f"INSERT IGNORE INTO secuencias (SeNombre, SeValor) SELECT %s, ({SEMILLAS[nombre]})",
+                        (nombre,)
+                    )
+                    conn.commit()
+        finally:
+            conn.close()
+        raise RuntimeError(f"No se pudo reservar un bloque de la secuencia '{nombre}'")
+
+    def siguiente(self, test_mode, nombre):
+        """Consume y devuelve el siguiente código de la secuencia"""
+        clave = (test_mode, nombre)
+        with self._lock:
+            while True:
+                bloque = self._bloques.get(clave)
+                if not bloque or bloque[0] > bloque[1]:
+                    bloque = self._reservar_bloque(test_mode, nombre)
+                    self._bloques[clave] = bloque
+                codigo = bloque[0]
+                bloque[0] += 1
+                if codigo not in EXCLUIDOS.get(nombre, ()):
+                    return codigo
+
+    def previsto(self, test_mode, nombre):
+        """Código que probablemente se asignará en la próxima alta (no lo reserva)"""
+        with self._lock:
+            bloque = self._bloques.get((test_mode, nombre))
+            if bloque and bloque[0] <= bloque[1]:
+                codigo = bloque[0]
+            else:
+                conn = conectar_db(test_mode=test_mode)
+                try:
+                    with conn.cursor() as cursor:
+                        asegurar_tabla(cursor, "secuencias", DDL_SECUENCIAS)
+                        cursor.execute(
+                            f"SELECT COALESCE((SELECT SeValor FROM secuencias WHERE SeNombre = %s), ({SEMILLAS[nombre]})) AS valor",
+                            (nombre,)
+                        )
+                        codigo = int(cursor.fetchone()['valor']) + 1
+                finally:
+                    conn.close()
+        while codigo in EXCLUIDOS.get(nombre, ()):
+            codigo += 1
+        return codigo
+
+    def resincronizar(self, test_mode, nombre):
+        """Avanza la secuencia por encima de códigos grabados sin pasar por ella"""
+        conn = conectar_db(test_mode=test_mode)
+        try:
+            with conn.cursor() as cursor:
+                asegurar_tabla(cursor, "secuencias", DDL_SECUENCIAS)
+                cursor.execute(
+                    f"UPDATE secuencias SET SeValor = GREATEST(SeValor, ({SEMILLAS[nombre]})) WHERE SeNombre = %s",
+                    (nombre,)
+                )
+                conn.commit()
+        finally:
+            conn.close()
+        with self._lock:
+            self._bloques.pop((test_mode, nombre), None)
+
+    def asignar(self, test_mode, nombre, existe):
+        """Siguiente código libre; `existe(codigo)` comprueba si ya está ocupado"""
+        for _ in range(INTENTOS_ASIGNACION):
+            codigo = self.siguiente(test_mode, nombre)
+            if not existe(codigo):
+                return codigo
+            print(f"⚠️ Código {codigo} de {nombre} ya ocupado, resincronizando secuencia")
+            self.resincronizar(test_mode, nombre)
+        raise RuntimeError(f"No se encontró un código libre para {nombre}")
+
+
+asignador_codigos = AsignadorCodigos()
@@ -0,0 +1,6 @@
+# conftest.py
+"""Los módulos de la aplicación están en la raíz del repositorio, sin paquete"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,43 @@
+# test_busqueda.py
+from busqueda import IndicePrefijos, normalizar, tokens
+
+
+def indice_con(*personas):
+    indice = IndicePrefijos()
+    for id_doc, nombre, exactos in personas:
+        indice.poner(id_doc, tokens(nombre), exactos, normalizar(nombre), id_doc)
+    return indice
+
+
+def test_normalizar_y_tokens():
+    assert normalizar("José Peña") == "JOSE PENA"
+    assert tokens("  María-Ángeles  O'Neil 12.345-X ") == ["MARIA", "ANGELES", "O", "NEIL", "12", "345", "X"]
+
+
+def test_buscar_por_prefijos_sin_acentos():
+    indice = indice_con((1, "José García", set()), (2, "Josefa Gómez", set()), (3, "Ana García", set()))
+    assert indice.buscar("gar jo") == [1]
+    assert indice.buscar("JOS") == [1, 2]
+    assert indice.buscar("garcía") == [3, 1]
+    assert indice.buscar("pérez") == []
+    assert indice.buscar("  ") == []
+
+
+def test_coincidencia_exacta_primero_y_limite():
+    indice = indice_con((1, "Ana 1234", set()), (2, "Beatriz 1234", {"1234"}), (3, "Carmen 1234", set()))
+    assert indice.buscar("1234") == [2, 1, 3]
+    assert indice.buscar("1234", limite=2) == [2, 1]
+
+
+def test_poner_reemplaza_y_quitar_borra_tokens():
+    indice = indice_con((1, "José García", set()))
+    indice.poner(1, tokens("José Martín"), set(), "MARTIN JOSE", 1)
+    assert indice.buscar("garc") == []
+    assert indice.buscar("mar") == [1]
+    assert len(indice) == 1
+
+    indice.quitar(1)
+    indice.quitar(1)
+    assert indice.buscar("jo") == []
+    assert len(indice) == 0
+    assert indice._tokens_ordenados == []
@@ -0,0 +1,74 @@
+# test_extractos.py
+import io
+from datetime import date
+
+import pytest
+
+from extractos import ErrorExtracto, clasificar, leer_extracto, parsear_importe, REGLAS_EXTRACTO_BANCO
+
+
+def csv_binario(texto, codificacion="utf-8"):
+    return io.BytesIO(texto.encode(codificacion))
+
+
+@pytest.mark.parametrize("texto, decimal, esperado", [
+    ("1.234,56", ",", 1234.56),
+    ("-1.234,56 €", ",", -1234.56),
+    (" 12,5 ", ",", 12.5),
+    ("1,234.56", ".", 1234.56),
+    ("-0.75", ".", -0.75),
+    ("1 000,00", ",", 1000.0),
+])
+def test_parsear_importe(texto, decimal, esperado):
+    assert parsear_importe(texto, decimal) == pytest.approx(esperado)
+
+
+def test_parsear_importe_no_valido():
+    with pytest.raises(ValueError):
+        parsear_importe("doce")
+
+
+def test_leer_extracto_por_nombre_de_columna():
+    fichero = csv_binario(
+        "Fecha;Concepto;Importe\n"
+        "05/01/2024;  transferencia   iglesia ;1.250,00\n"
+        "\n"
+        "06/01/2024;comisión;-3,5\n"
+    )
+    filas = list(leer_extracto(fichero, "fecha", "CONCEPTO", "Importe"))
+    assert filas == [
+        (2, date(2024, 1, 5), "TRANSFERENCIA IGLESIA", 1250.0, None),
+        (4, date(2024, 1, 6), "COMISIÓN", -3.5, None),
+    ]
+
+
+def test_leer_extracto_filas_con_error():
+    fichero = csv_binario(
+        "2024-01-05,ok,10.00\n"
+        "31/01/2024,fecha mal,1.00\n"
+        "2024-01-07,importe mal,diez\n"
+        "2024-01-08,corta\n",
+        codificacion="latin-1"
+    )
+    filas = list(leer_extracto(
+        fichero, "0", "1", "2", separador=",", formato_fecha="%Y-%m-%d", decimal=".",
+        codificacion="latin-1", tiene_cabecera=False
+    ))
+    assert filas[0] == (1, date(2024, 1, 5), "OK", 10.0, None)
+    assert filas[1] == (2, None, None, None, "Fecha no válida: 31/01/2024")
+    assert filas[2] == (3, None, None, None, "Importe no válido: diez")
+    assert filas[3] == (4, None, None, None, "La fila tiene 2 columnas")
+
+
+def test_leer_extracto_columna_inexistente():
+    with pytest.raises(ErrorExtracto):
+        list(leer_extracto(csv_binario("Fecha;Concepto;Importe\n"), "Fecha", "Concepto", "Saldo"))
+    with pytest.raises(ErrorExtracto):
+        list(leer_extracto(csv_binario("05/01/2024;x;1\n"), "Fecha", "1", "2", tiene_cabecera=False))
+
+
+def test_clasificar():
+    reglas = [{"contiene": "diezmo", "MoTiMo": 100, "MoTGas": 2}] + REGLAS_EXTRACTO_BANCO
+    assert clasificar("DIEZMO ENERO", 50.0, reglas) == (100, 2, 0)
+    assert clasificar("LUZ", -20.0, reglas) == (200, 0, 0)
+    assert clasificar("LUZ", -20.0, [{"signo": "+", "MoTiMo": 100}]) is None
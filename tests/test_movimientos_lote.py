@@ -0,0 +1,119 @@
+# test_movimientos_lote.py
+"""Validación de /grabar-movimientos-lote: un error en cualquier fila rechaza el lote entero"""
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from login import jwt, SECRET_KEY
+
+
+class CursorFalso:
+    """Anota las sentencias; devuelve las filas de la primera respuesta cuyo texto aparece en el SQL"""
+
+    def __init__(self, conexion):
+        self.connection = conexion
+        self.rowcount = 0
+        self.lastrowid = None
+        self._filas = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.connection.sentencias.append(sql)
+        self._filas = next((filas for texto, filas in self.connection.respuestas if texto in sql), [])
+        self.rowcount = len(self._filas)
+
+    def fetchall(self):
+        return list(self._filas)
+
+    def fetchone(self):
+        return self._filas[0] if self._filas else None
+
+    def close(self):
+        pass
+
+
+class ConexionFalsa:
+    db = "pruebas_lote"
+
+    def __init__(self, respuestas=()):
+        self.respuestas = list(respuestas)
+        self.sentencias = []
+        self.commits = 0
+
+    def cursor(self, *args):
+        return CursorFalso(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def movimiento(**cambios):
+    datos = {
+        "sede": 3, "tipoOperacion": 100, "segundoNivel": 2, "tercerNivel": 0,
+        "descripcion": "ofrenda", "dia": 5, "mes": 1, "año": 2024,
+        "importe": 10.0, "origen": "caja",
+    }
+    datos.update(cambios)
+    return datos
+
+
+@pytest.fixture
+def cliente():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def cabeceras():
+    token = jwt.encode({"sub": "USR001", "nivel": 1, "sedes": [3]}, SECRET_KEY)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def conexion(monkeypatch):
+    # Febrero de 2024 cerrado: existe el cierre de marzo
+    conexion = ConexionFalsa([("MoDona = 9999", [{"anyo": 2024, "mes": 3}])])
+    monkeypatch.setattr(main, "conectar_db", lambda test_mode=False: conexion)
+    return conexion
+
+
+def test_lote_vacio(cliente, cabeceras, conexion):
+    respuesta = cliente.post("/grabar-movimientos-lote", json={"sede": 3, "movimientos": []}, headers=cabeceras)
+    assert respuesta.status_code == 400
+    assert conexion.sentencias == []
+
+
+def test_sede_no_autorizada(cliente, cabeceras, conexion):
+    respuesta = cliente.post(
+        "/grabar-movimientos-lote", json={"sede": 4, "movimientos": [movimiento(sede=4)]}, headers=cabeceras
+    )
+    assert respuesta.status_code == 403
+    assert conexion.sentencias == []
+
+
+def test_errores_rechazan_todo_el_lote(cliente, cabeceras, conexion):
+    lote = {"sede": 3, "movimientos": [
+        movimiento(),
+        movimiento(sede=5),
+        movimiento(origen="tarjeta"),
+        movimiento(dia=31, mes=4),
+        movimiento(dia=10, mes=2),
+    ]}
+    respuesta = cliente.post("/grabar-movimientos-lote", json=lote, headers=cabeceras)
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["success"] is False
+    assert [r["success"] for r in cuerpo["resultados"]] == [True, False, False, False, False]
+    errores = [r["error"] for r in cuerpo["resultados"]]
+    assert errores[1] == "La sede 5 no coincide con la del lote"
+    assert errores[2] == "Origen no válido: tarjeta"
+    assert errores[3] == "Fecha no válida: 31/4/2024"
+    assert errores[4] == "El período 2/2024 está cerrado"
+    # No se graba nada
+    assert not any(sql.startswith(("INSERT", "UPDATE", "DELETE")) for sql in conexion.sentencias)
+    assert conexion.commits == 0
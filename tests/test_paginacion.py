@@ -0,0 +1,87 @@
+# test_paginacion.py
+"""
+Paginación por clave del listado de fieles, comprobada contra SQLite:
+COALESCE, comparaciones y OR/AND se comportan igual que en MySQL.
+"""
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from paginacion import (
+    codificar_cursor, decodificar_cursor, condicion_despues_de, parametros_despues_de,
+    orden_sin_nulos, valores_sin_nulos
+)
+
+ORDEN = ("fiApellidos", "fiNombres", "fiID")
+CLAVE = orden_sin_nulos(ORDEN, ("fiApellidos", "fiNombres"))
+
+FIELES = [
+    (1, "GARCIA", "ANA"),
+    (2, None, "BEATRIZ"),
+    (3, "GARCIA", None),
+    (4, "LOPEZ", "CARMEN"),
+    (5, None, None),
+    (6, "GARCIA", "ANA"),
+    (7, "", "DIEGO"),
+    (8, "LOPEZ", None),
+]
+
+
+@pytest.fixture
+def conexion():
+    conexion = sqlite3.connect(":memory:")
+    conexion.row_factory = sqlite3.Row
+    conexion.execute("CREATE TABLE fieles (fiID INTEGER PRIMARY KEY, fiApellidos TEXT, fiNombres TEXT)")
+    conexion.executemany("INSERT INTO fieles VALUES (?, ?, ?)", FIELES)
+    yield conexion
+    conexion.close()
+
+
+def pagina(conexion, cursor, limite):
+    """Misma construcción que /fieles (con ? en lugar de %s)"""
+    condiciones, parametros = ["1 = 1"], []
+    if cursor:
+        valores = valores_sin_nulos(decodificar_cursor(cursor, len(ORDEN)))
+        condicion, indices = condicion_despues_de(CLAVE)
+        condiciones.append(condicion.replace("%s", "?"))
+        parametros.extend(parametros_despues_de(valores, indices))
+    sql = f"SELECT * FROM fieles WHERE {' AND '.join(condiciones)} ORDER BY {', '.join(CLAVE)} LIMIT ?"
+    filas = conexion.execute(sql, parametros + [limite]).fetchall()
+    siguiente = None
+    if len(filas) == limite:
+        siguiente = codificar_cursor(valores_sin_nulos(filas[-1][columna] for columna in ORDEN))
+    return [fila["fiID"] for fila in filas], siguiente
+
+
+def test_condicion_despues_de():
+    sql, indices = condicion_despues_de(("a", "b", "c"))
+    assert sql == "(a > %s OR (a = %s AND (b > %s OR (b = %s AND c > %s))))"
+    assert parametros_despues_de(["x", "y", 9], indices) == ["x", "x", "y", "y", 9]
+
+
+def test_cursor_ida_y_vuelta():
+    valores = ["PEÑA", "", 42]
+    cursor = codificar_cursor(valores)
+    assert "=" not in cursor
+    assert decodificar_cursor(cursor, 3) == valores
+
+
+@pytest.mark.parametrize("cursor", ["no-es-un-cursor", codificar_cursor([1, 2]), codificar_cursor({"a": 1})])
+def test_cursor_no_valido(cursor):
+    with pytest.raises(HTTPException) as error:
+        decodificar_cursor(cursor, 3)
+    assert error.value.status_code == 400
+
+
+@pytest.mark.parametrize("limite", [1, 2, 3, 7])
+def test_recorre_todas_las_filas_con_nulos(conexion, limite):
+    esperado = [fila["fiID"] for fila in conexion.execute(f"SELECT fiID FROM fieles ORDER BY {', '.join(CLAVE)}")]
+    vistos, cursor = [], None
+    while True:
+        ids, cursor = pagina(conexion, cursor, limite)
+        vistos.extend(ids)
+        if cursor is None:
+            break
+    assert vistos == esperado
+    assert sorted(vistos) == [fila[0] for fila in FIELES]
@@ -0,0 +1,58 @@
+# test_secuencias.py
+"""AsignadorCodigos con los bloques servidos desde memoria (sin MySQL)"""
+import pytest
+
+from secuencias import AsignadorCodigos
+
+
+@pytest.fixture
+def asignador(monkeypatch):
+    asignador = AsignadorCodigos(tamaño_bloque=5)
+    reservas = []
+    valores = {}
+
+    def reservar_bloque(test_mode, nombre):
+        # Igual que el UPDATE ... LAST_INSERT_ID(SeValor + tamaño): bloques consecutivos
+        inicio = valores.get((test_mode, nombre), 995) + 1
+        valores[(test_mode, nombre)] = inicio + asignador.tamaño_bloque - 1
+        reservas.append((test_mode, nombre))
+        return [inicio, inicio + asignador.tamaño_bloque - 1]
+
+    monkeypatch.setattr(asignador, "_reservar_bloque", reservar_bloque)
+    asignador.reservas = reservas
+    return asignador
+
+
+def test_siguiente_reparte_el_bloque_y_reserva_otro(asignador):
+    codigos = [asignador.siguiente(False, "fieles") for _ in range(7)]
+    assert codigos == [996, 997, 998, 999, 1000, 1001, 1002]
+    assert asignador.reservas == [(False, "fieles"), (False, "fieles")]
+
+
+def test_siguiente_salta_los_excluidos(asignador):
+    codigos = [asignador.siguiente(False, "locales") for _ in range(5)]
+    assert 999 not in codigos
+    assert codigos == [996, 997, 998, 1000, 1001]
+
+
+def test_secuencias_independientes_por_base(asignador):
+    assert asignador.siguiente(False, "locales") == 996
+    assert asignador.siguiente(True, "locales") == 996
+    assert asignador.siguiente(False, "locales") == 997
+
+
+def test_previsto_no_consume(asignador):
+    asignador.siguiente(False, "locales")
+    asignador.siguiente(False, "locales")
+    assert asignador.previsto(False, "locales") == 998
+    assert asignador.siguiente(False, "locales") == 998
+    assert asignador.previsto(False, "locales") == 1000
+    assert asignador.siguiente(False, "locales") == 1000
+
+
+def test_asignar_salta_codigos_ocupados(asignador, monkeypatch):
+    resincronizadas = []
+    monkeypatch.setattr(asignador, "resincronizar", lambda test_mode, nombre: resincronizadas.append(nombre))
+    ocupados = {996, 997}
+    assert asignador.asignar(False, "fieles", lambda codigo: codigo in ocupados) == 998
+    assert resincronizadas == ["fieles", "fieles"]
@@ -0,0 +1,75 @@
+# test_vista_mensual.py
+from datetime import date
+
+from vista_mensual import CacheMeses, calcular_totales
+
+
+def entrada(cursor=0):
+    return {"movimientos": [], "totales": calcular_totales([]), "cursor": cursor}
+
+
+def guardar(cache, año, mes, cerrado=False, sede=3, cursor=0):
+    return cache.guardar(False, sede, año, mes, entrada(cursor), cerrado, cache.generacion(False, sede))
+
+
+def test_invalidar_solo_el_mes():
+    cache = CacheMeses()
+    for mes in (1, 2, 3):
+        guardar(cache, 2024, mes)
+    cache.invalidar(False, 3, 2024, 2)
+    assert [cache.obtener(False, 3, 2024, mes) is not None for mes in (1, 2, 3)] == [True, False, True]
+
+
+def test_invalidar_siguientes_incluye_meses_cerrados_y_otros_años():
+    cache = CacheMeses()
+    guardar(cache, 2023, 12, cerrado=True)
+    guardar(cache, 2024, 1, cerrado=True)
+    guardar(cache, 2024, 6)
+    guardar(cache, 2025, 1)
+    guardar(cache, 2024, 6, sede=4)
+    cache.invalidar(False, 3, 2024, 1, siguientes=True)
+    assert cache.obtener(False, 3, 2023, 12) is not None
+    assert cache.obtener(False, 3, 2024, 1) is None
+    assert cache.obtener(False, 3, 2024, 6) is None
+    assert cache.obtener(False, 3, 2025, 1) is None
+    assert cache.obtener(False, 4, 2024, 6) is not None
+    assert cache.resumen()["meses_cerrados"] == 1
+
+
+def test_carga_anterior_a_una_invalidacion_no_se_guarda():
+    cache = CacheMeses()
+    generacion = cache.generacion(False, 3)
+    cache.invalidar(False, 3, 2024, 5, siguientes=True)
+    assert cache.guardar(False, 3, 2024, 5, entrada(), False, generacion) is False
+    assert cache.obtener(False, 3, 2024, 5) is None
+    # Otra sede no se ve afectada
+    assert cache.guardar(False, 4, 2024, 5, entrada(), False, cache.generacion(False, 4)) is True
+
+
+def test_meses_abiertos_caducan():
+    cache = CacheMeses(ttl_abiertos=-1)
+    guardar(cache, 2024, 5)
+    assert cache.obtener(False, 3, 2024, 5) is None
+
+
+def test_mes_cerrado_se_valida_con_el_cursor_de_cambios():
+    cache = CacheMeses()
+    guardar(cache, 2024, 1, cerrado=True, cursor=40)
+    assert cache.obtener(False, 3, 2024, 1, version=lambda: 40) is not None
+    # Escritura de otro proceso en la sede: el cursor avanzó
+    assert cache.obtener(False, 3, 2024, 1, version=lambda: 41) is None
+    assert cache.obtener(False, 3, 2024, 1, version=lambda: 40) is None
+
+
+def test_totales():
+    movimientos = [
+        {"MoFecha": date(2024, 1, 2), "MoCChica": 10, "MoImporte": 0, "MoSaldoCaja": 10, "MoSaldoBanco": 0},
+        {"MoFecha": date(2024, 1, 3), "MoCChica": -4, "MoImporte": 25.5, "MoSaldoCaja": 6, "MoSaldoBanco": 25.5},
+        {"MoFecha": date(2024, 1, 9), "MoCChica": None, "MoImporte": -5, "MoSaldoCaja": 6, "MoSaldoBanco": 20.5},
+    ]
+    assert calcular_totales(movimientos) == {
+        "movimientos": 3,
+        "ingresos_caja": 10.0, "gastos_caja": -4.0,
+        "ingresos_banco": 25.5, "gastos_banco": -5.0,
+        "saldo_final_caja": 6.0, "saldo_final_banco": 20.5,
+    }
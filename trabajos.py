@@ -0,0 +1,180 @@
+# trabajos.py
+"""
+Trabajos en segundo plano (por proceso) para operaciones largas como el
+recálculo de saldos o la transposición del informe anual, que de otro modo
+dejan la petición abierta hasta que el proxy corta por tiempo.
+
+  enviar  -> id del trabajo (202)
+  estado  -> en_cola / en_curso / completado / error, con progreso 0..1
+  resultado -> lo que devolvería el endpoint síncrono (si falla, con el
+               mismo código de estado: 400, 404, 409... o 500)
+
+- Como mucho MAX_CONCURRENTES trabajos a la vez; el resto espera en cola.
+- Un trabajo idéntico (misma clave: tipo, base de datos, sede, parámetros)
+  que aún está EN COLA no se duplica: se devuelve el existente, y quien lo
+  pide pasa a poder consultarlo aunque lo haya enviado otro usuario. Si ya está
+  en curso se encola otro (puede no ver escrituras posteriores), que no
+  empieza hasta que termine el primero.
+- Los terminados se conservan RETENCION_SEGUNDOS y después se olvidan.
+"""
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+MAX_CONCURRENTES = 2
+MAX_EN_COLA = 50
+RETENCION_SEGUNDOS = 3600
+MAX_TERMINADOS = 500
+
+EN_COLA = "en_cola"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+
+
+class Trabajo:
+    def __init__(self, tipo, clave, propietario, funcion):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.clave = clave
+        self.propietario = propietario
+        # Usuarios que pueden consultarlo: el propietario y quien envió el mismo trabajo
+        self.usuarios = {propietario}
+        self.funcion = funcion
+        self.estado = EN_COLA
+        self.progreso = 0.0
+        self.mensaje = None
+        self.resultado = None
+        self.error = None
+        self.codigo_error = None
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+
+    def actualizar_progreso(self, fraccion, mensaje=None):
+        """Callback que recibe la función del trabajo"""
+        self.progreso = max(0.0, min(1.0, float(fraccion)))
+        if mensaje is not None:
+            self.mensaje = mensaje
+
+    def resumen(self):
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "progreso": round(self.progreso, 3),
+            "mensaje": self.mensaje,
+            "error": self.error,
+            "codigo_error": self.codigo_error,
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+        }
+
+
+class GestorTrabajos:
+    def __init__(self, max_concurrentes=MAX_CONCURRENTES, max_en_cola=MAX_EN_COLA,
+                 retencion_segundos=RETENCION_SEGUNDOS, max_terminados=MAX_TERMINADOS):
+        self.max_en_cola = max_en_cola
+        self.retencion_segundos = retencion_segundos
+        self.max_terminados = max_terminados
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_concurrentes, thread_name_prefix="trabajo")
+        self._trabajos = {}     # id -> Trabajo
+        self._en_cola = {}      # clave -> Trabajo (para no duplicar)
+        self._en_curso = set()  # claves ejecutándose
+        self._esperando = {}    # clave -> Trabajo que espera a que termine el idéntico en curso
+        self._lock = threading.Lock()
+
+    def enviar(self, tipo, clave, propietario, funcion):
+        """
+        Encola `funcion(progreso)` y devuelve el Trabajo (o el idéntico que ya
+        estaba en cola). Lanza 503 si la cola está llena.
+        """
+        with self._lock:
+            self._purgar()
+            existente = self._en_cola.get(clave)
+            if existente is not None:
+                existente.usuarios.add(propietario)
+                return existente
+            if len(self._en_cola) >= self.max_en_cola:
+                raise HTTPException(status_code=503, detail="Demasiados trabajos en cola, inténtelo más tarde")
+            trabajo = Trabajo(tipo, clave, propietario, funcion)
+            self._trabajos[trabajo.id] = trabajo
+            self._en_cola[clave] = trabajo
+            esperar = clave in self._en_curso
+            if esperar:
+                self._esperando[clave] = trabajo
+        print(f"📥 Trabajo {trabajo.tipo} {trabajo.id} en cola")
+        if not esperar:
+            self._ejecutor.submit(self._ejecutar, trabajo)
+        return trabajo
+
+    def obtener(self, id_trabajo, propietario=None):
+        """Trabajo por id (None si no existe, ha caducado o es de otro usuario)"""
+        with self._lock:
+            self._purgar()
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None or (propietario is not None and propietario not in trabajo.usuarios):
+                return None
+        return trabajo
+
+    def resumen(self):
+        with self._lock:
+            estados = {}
+            for trabajo in self._trabajos.values():
+                estados[trabajo.estado] = estados.get(trabajo.estado, 0) + 1
+        return estados
+
+    def _ejecutar(self, trabajo):
+        with self._lock:
+            if self._en_cola.get(trabajo.clave) is trabajo:
+                del self._en_cola[trabajo.clave]
+            self._en_curso.add(trabajo.clave)
+            trabajo.estado = EN_CURSO
+            trabajo.iniciado = time.time()
+        print(f"▶️ Trabajo {trabajo.tipo} {trabajo.id} iniciado")
+        try:
+            resultado = trabajo.funcion(trabajo.actualizar_progreso)
+        except HTTPException as e:
+            self._terminar(trabajo, ERROR, error=e.detail, codigo_error=e.status_code)
+        except Exception as e:
+            print(f"❌ ERROR en trabajo {trabajo.tipo} {trabajo.id}: {e}")
+            print(traceback.format_exc())
+            self._terminar(trabajo, ERROR, error=str(e), codigo_error=500)
+        else:
+            trabajo.progreso = 1.0
+            self._terminar(trabajo, COMPLETADO, resultado=resultado)
+            print(f"✅ Trabajo {trabajo.tipo} {trabajo.id} completado")
+        finally:
+            trabajo.funcion = None
+            with self._lock:
+                self._en_curso.discard(trabajo.clave)
+                siguiente = self._esperando.pop(trabajo.clave, None)
+            if siguiente is not None:
+                self._ejecutor.submit(self._ejecutar, siguiente)
+
+    def _terminar(self, trabajo, estado, resultado=None, error=None, codigo_error=None):
+        with self._lock:
+            trabajo.resultado = resultado
+            trabajo.error = error
+            trabajo.codigo_error = codigo_error
+            trabajo.terminado = time.time()
+            trabajo.estado = estado
+
+    def _purgar(self):
+        # Con el lock tomado
+        ahora = time.time()
+        terminados = sorted(
+            (t for t in self._trabajos.values() if t.terminado is not None),
+            key=lambda t: t.terminado
+        )
+        sobran = len(terminados) - self.max_terminados
+        for indice, trabajo in enumerate(terminados):
+            if indice < sobran or ahora - trabajo.terminado > self.retencion_segundos:
+                del self._trabajos[trabajo.id]
+
+
+gestor_trabajos = GestorTrabajos()
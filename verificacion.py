@@ -0,0 +1,137 @@
+# verificacion.py
+"""
+Verificación de saldos SIN escribir nada: recorre el libro de cada sede en
+orden (MoFecha, MoID), acumula caja y banco y lo compara con los saldos
+guardados (MoSaldoCaja / MoSaldoBanco), que /grabar-movimiento recibe
+calculados por el cliente y pueden descuadrarse.
+
+Igual que el recálculo, cada cierre es un punto de partida: los saldos se
+comparan dentro de cada tramo entre cierres, y además se comprueba que el
+cierre coincide con lo acumulado hasta él. El informe dice si hace falta
+reparar y desde qué fecha (recalcular_saldos_desde) en vez de reescribirlo todo.
+
+Las filas se leen con un cursor sin buffer (SSDictCursor) por bloques, así
+que la memoria no depende del tamaño del libro. Cada sede usa su propia
+conexión y se verifican varias a la vez.
+"""
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pymysql
+from saldos import como_fecha, saldo_difiere
+
+MAX_SEDES_EN_PARALELO = 4
+TAMAÑO_BLOQUE = 2000
+
+
+def _fila_descuadrada(fila, caja, banco):
+    return {
+        "MoID": fila['MoID'],
+        "MoFecha": str(como_fecha(fila['MoFecha'])),
+        "saldo_caja_guardado": float(fila['MoSaldoCaja'] or 0),
+        "saldo_banco_guardado": float(fila['MoSaldoBanco'] or 0),
+        "saldo_caja_calculado": round(caja, 2),
+        "saldo_banco_calculado": round(banco, 2),
+    }
+
+
+def verificar_sede(conn, sede):
+    """Verifica el libro completo de la sede con la conexión `conn` (no escribe)"""
+    with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute("""
+        SELECT MoID, MoFecha, MoSaldoCaja, MoSaldoBanco
+        FROM movimientos
+        WHERE MoSede = %s AND MoDona = 9999
+        ORDER BY MoFecha, MoID
+        """, (sede,))
+        cierres = cursor.fetchall()
+    dias_cierres = [como_fecha(cierre['MoFecha']) for cierre in cierres]
+
+    resultado = {
+        "sede": sede,
+        "movimientos_verificados": 0,
+        "filas_descuadradas": 0,
+        "primera_descuadrada": None,
+        "cierres_verificados": len(cierres),
+        "cierres_descuadrados": 0,
+        "primer_cierre_descuadrado": None,
+    }
+    caja = banco = 0.0
+    siguiente_cierre = 0
+    hay_anteriores = False
+
+    def aplicar_cierres(hasta):
+        # Los cierres de un día preceden a los movimientos de ese mismo día
+        nonlocal caja, banco, siguiente_cierre
+        limite = len(cierres) if hasta is None else bisect_right(dias_cierres, hasta)
+        while siguiente_cierre < limite:
+            cierre = cierres[siguiente_cierre]
+            # Sin movimientos antes, el primer cierre es el saldo de apertura
+            if hay_anteriores and (saldo_difiere(cierre['MoSaldoCaja'], caja)
+                                   or saldo_difiere(cierre['MoSaldoBanco'], banco)):
+                resultado["cierres_descuadrados"] += 1
+                if resultado["primer_cierre_descuadrado"] is None:
+                    resultado["primer_cierre_descuadrado"] = _fila_descuadrada(cierre, caja, banco)
+            caja = float(cierre['MoSaldoCaja'] or 0)
+            banco = float(cierre['MoSaldoBanco'] or 0)
+            siguiente_cierre += 1
+
+    with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+        cursor.execute("""
+        SELECT MoID, MoFecha, MoCChica, MoImporte, MoSaldoCaja, MoSaldoBanco
+        FROM movimientos
+        WHERE MoSede = %s AND MoDona != 9999
+        ORDER BY MoFecha, MoID
+        """, (sede,))
+        while True:
+            filas = cursor.fetchmany(TAMAÑO_BLOQUE)
+            if not filas:
+                break
+            for fila in filas:
+                aplicar_cierres(como_fecha(fila['MoFecha']))
+                caja += float(fila['MoCChica'] or 0)
+                banco += float(fila['MoImporte'] or 0)
+                hay_anteriores = True
+                if saldo_difiere(fila['MoSaldoCaja'], caja) or saldo_difiere(fila['MoSaldoBanco'], banco):
+                    resultado["filas_descuadradas"] += 1
+                    if resultado["primera_descuadrada"] is None:
+                        resultado["primera_descuadrada"] = _fila_descuadrada(fila, caja, banco)
+            resultado["movimientos_verificados"] += len(filas)
+    aplicar_cierres(None)
+
+    primera = resultado["primera_descuadrada"]
+    resultado["cuadra"] = not resultado["filas_descuadradas"] and not resultado["cierres_descuadrados"]
+    # recalcular_saldos_desde(cursor, sede, fecha_reparacion) corrige los movimientos descuadrados
+    resultado["fecha_reparacion"] = primera["MoFecha"] if primera else None
+    resultado["saldo_final_caja"] = round(caja, 2)
+    resultado["saldo_final_banco"] = round(banco, 2)
+    return resultado
+
+
+def verificar_sedes(sedes, conectar, progreso=None, max_paralelo=MAX_SEDES_EN_PARALELO):
+    """
+    Verifica varias sedes a la vez, cada una con su conexión (`conectar()`).
+    Devuelve los resultados en el orden de `sedes`; el error de una sede no
+    detiene las demás.
+    """
+    def verificar(sede):
+        conn = conectar()
+        try:
+            return verificar_sede(conn, sede)
+        finally:
+            conn.close()
+
+    resultados = {}
+    if not sedes:
+        return []
+    with ThreadPoolExecutor(max_workers=max_paralelo, thread_name_prefix="verificacion") as ejecutor:
+        futuros = {ejecutor.submit(verificar, sede): sede for sede in sedes}
+        for terminadas, futuro in enumerate(as_completed(futuros), start=1):
+            sede = futuros[futuro]
+            try:
+                resultados[sede] = futuro.result()
+            except Exception as e:
+                print(f"❌ ERROR verificando sede {sede}: {e}")
+                resultados[sede] = {"sede": sede, "error": str(e)}
+            if progreso:
+                progreso(terminadas / len(sedes), f"Sede {sede} verificada")
+    return [resultados[sede] for sede in sedes]
@@ -0,0 +1,175 @@
+# vista_mensual.py
+"""
+Caché de la vista mensual del libro (/movimientos): (base de datos, sede,
+año, mes) -> filas del mes + totales del mes + cursor del feed de cambios.
+
+- Los meses abiertos van a una LRU acotada con caducidad corta.
+- Los meses cerrados (existe el cierre del mes siguiente) casi nunca
+  cambian, pero pueden: al eliminar el cierre, al reconstruir el libro o
+  con SQL a mano. Se guardan con caducidad larga y cada acierto se valida
+  contra el cursor de cambios de la sede (cambios.version_sede): si alguien
+  ha escrito en la sede desde la carga, se vuelve a leer el mes.
+- Las escrituras de este proceso invalidan solo lo afectado: el mes del
+  movimiento, o ese mes y todos los siguientes si se recalculan saldos
+  acumulados.
+Cada sede tiene un número de generación: una carga que empezó antes de una
+invalidación no llega a guardarse.
+
+Las invalidaciones son del proceso, así que la caché supone un único worker
+de uvicorn (ver el CMD del Dockerfile). Con varios, un mes abierto puede
+verse hasta TTL_MESES_ABIERTOS sin las escrituras hechas en otro worker,
+igual que ocurre siempre con el SQL escrito a mano.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+MAX_MESES_ABIERTOS = 512
+MAX_MESES_CERRADOS = 4096
+TTL_MESES_ABIERTOS = 300
+TTL_MESES_CERRADOS = 6 * 3600
+
+# Columnas de la vista (las del SELECT de /movimientos)
+COLUMNAS_MES = ("MoID", "MoFecha", "MoDesc", "MoCChica", "MoSaldoCaja", "MoImporte", "MoSaldoBanco")
+
+
+def calcular_totales(movimientos):
+    """Totales del mes a partir de las filas ya ordenadas por MoFecha, MoID"""
+    caja = [float(mov['MoCChica'] or 0) for mov in movimientos]
+    banco = [float(mov['MoImporte'] or 0) for mov in movimientos]
+    ultimo = movimientos[-1] if movimientos else None
+    return {
+        "movimientos": len(movimientos),
+        "ingresos_caja": round(sum((v for v in caja if v > 0), 0.0), 2),
+        "gastos_caja": round(sum((v for v in caja if v < 0), 0.0), 2),
+        "ingresos_banco": round(sum((v for v in banco if v > 0), 0.0), 2),
+        "gastos_banco": round(sum((v for v in banco if v < 0), 0.0), 2),
+        "saldo_final_caja": float(ultimo['MoSaldoCaja'] or 0) if ultimo else None,
+        "saldo_final_banco": float(ultimo['MoSaldoBanco'] or 0) if ultimo else None,
+    }
+
+
+def columnar_mes(movimientos):
+    return {"columns": list(COLUMNAS_MES), "rows": [[mov[c] for c in COLUMNAS_MES] for mov in movimientos]}
+
+
+class CacheMeses:
+    def __init__(self, max_abiertos=MAX_MESES_ABIERTOS, max_cerrados=MAX_MESES_CERRADOS,
+                 ttl_abiertos=TTL_MESES_ABIERTOS, ttl_cerrados=TTL_MESES_CERRADOS):
+        self.max_abiertos = max_abiertos
+        self.max_cerrados = max_cerrados
+        self.ttl_abiertos = ttl_abiertos
+        self.ttl_cerrados = ttl_cerrados
+        self._abiertos = OrderedDict()   # (test_mode, sede, año, mes) -> (expira, entrada)
+        self._cerrados = {}              # (test_mode, sede, año, mes) -> (expira, entrada)
+        self._generaciones = {}          # (test_mode, sede) -> int
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def generacion(self, test_mode, sede):
+        """Leer ANTES de consultar MySQL y pasarla a guardar()"""
+        with self._lock:
+            return self._generaciones.get((test_mode, sede), 0)
+
+    def obtener(self, test_mode, sede, año, mes, version=None):
+        """
+        Entrada guardada o None. `version()` devuelve el cursor de cambios
+        actual de la sede; si se pasa, un mes cerrado solo se sirve mientras
+        coincida con el de su carga (se consulta fuera del lock).
+        """
+        clave = (test_mode, sede, año, mes)
+        ahora = time.monotonic()
+        with self._lock:
+            cerrada = self._cerrados.get(clave)
+            if cerrada is not None and cerrada[0] < ahora:
+                del self._cerrados[clave]
+                cerrada = None
+            entrada = cerrada[1] if cerrada is not None else None
+            if entrada is None:
+                guardada = self._abiertos.get(clave)
+                if guardada is not None and guardada[0] >= ahora:
+                    self._abiertos.move_to_end(clave)
+                    entrada = guardada[1]
+                elif guardada is not None:
+                    del self._abiertos[clave]
+        if cerrada is not None and version is not None and version() != entrada["cursor"]:
+            with self._lock:
+                if self._cerrados.get(clave) is cerrada:
+                    del self._cerrados[clave]
+            entrada = None
+        with self._lock:
+            if entrada is None:
+                self.fallos += 1
+            else:
+                self.aciertos += 1
+        return entrada
+
+    def guardar(self, test_mode, sede, año, mes, entrada, cerrado, generacion):
+        clave = (test_mode, sede, año, mes)
+        with self._lock:
+            if self._generaciones.get((test_mode, sede), 0) != generacion:
+                return False
+            if cerrado and len(self._cerrados) >= self.max_cerrados:
+                ahora = time.monotonic()
+                for caducada in [c for c, (expira, _) in self._cerrados.items() if expira < ahora]:
+                    del self._cerrados[caducada]
+            if cerrado and len(self._cerrados) < self.max_cerrados:
+                self._cerrados[clave] = (time.monotonic() + self.ttl_cerrados, entrada)
+                self._abiertos.pop(clave, None)
+                return True
+            self._abiertos[clave] = (time.monotonic() + self.ttl_abiertos, entrada)
+            self._abiertos.move_to_end(clave)
+            while len(self._abiertos) > self.max_abiertos:
+                self._abiertos.popitem(last=False)
+            return True
+
+    def invalidar(self, test_mode, sede, año, mes, siguientes=False):
+        """Quita el mes (y con siguientes=True también los posteriores) de la sede"""
+        desde = (año, mes)
+        with self._lock:
+            self._generaciones[(test_mode, sede)] = self._generaciones.get((test_mode, sede), 0) + 1
+            for almacen in (self._abiertos, self._cerrados):
+                for clave in [
+                    clave for clave in almacen
+                    if clave[:2] == (test_mode, sede)
+                    and (clave[2:] == desde or (siguientes and clave[2:] > desde))
+                ]:
+                    del almacen[clave]
+
+    def limpiar(self):
+        with self._lock:
+            self._abiertos.clear()
+            self._cerrados.clear()
+            self._generaciones.clear()
+
+    def resumen(self):
+        with self._lock:
+            return {
+                "meses_abiertos": len(self._abiertos),
+                "meses_cerrados": len(self._cerrados),
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+cache_meses = CacheMeses()
+
+
+def _año_mes(fecha):
+    """date/datetime o 'AAAA-MM-DD...' -> (año, mes)"""
+    if isinstance(fecha, str):
+        return int(fecha[:4]), int(fecha[5:7])
+    return fecha.year, fecha.month
+
+
+def invalidar_mes(test_mode, sede, fecha):
+    """Escritura que solo cambia el mes de `fecha` (sin recálculo de saldos)"""
+    año, mes = _año_mes(fecha)
+    cache_meses.invalidar(bool(test_mode), int(sede), año, mes)
+
+
+def invalidar_desde(test_mode, sede, fecha):
+    """Escritura con recálculo de saldos: el mes de `fecha` y todos los siguientes"""
+    año, mes = _año_mes(fecha)
+    cache_meses.invalidar(bool(test_mode), int(sede), año, mes, siguientes=True)
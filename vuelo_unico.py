@@ -0,0 +1,112 @@
+# vuelo_unico.py
+"""
+"Vuelo único" para los endpoints de lectura: si llegan a la vez varias
+peticiones idénticas (mismo endpoint y parámetros, p.ej. todo el equipo de
+una sede abriendo el mismo informe a fin de mes), solo la primera consulta
+MySQL; las demás esperan y reciben una copia de su respuesta.
+
+No es una caché: en cuanto termina la consulta se olvida. La clave incluye
+el cursor de cambios de la sede (cambios.version_sede, MAX(CaID) leído de
+MySQL), así que una lectura pedida después de una escritura confirmada
+nunca se une a una consulta empezada antes, aunque la escritura la haya
+hecho otro worker o reconstruir_ledger.py.
+"""
+import functools
+import json
+import threading
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import Response
+from cambios import version_sede
+from respuestas import RespuestaJSON
+
+# Parámetros que no cambian el resultado (la sede ya está autorizada por la dependencia)
+PARAMETROS_IGNORADOS = ("auth",)
+
+
+class _Vuelo:
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+class VueloUnico:
+    """La primera llamada con una clave ejecuta; las concurrentes con la misma clave esperan su resultado"""
+
+    def __init__(self):
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        self.ejecuciones = 0
+        self.compartidas = 0
+
+    def ejecutar(self, clave, funcion):
+        with self._lock:
+            vuelo = self._en_vuelo.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._en_vuelo[clave] = _Vuelo()
+                self.ejecuciones += 1
+            else:
+                self.compartidas += 1
+
+        if not lider:
+            vuelo.terminado.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_vuelo[clave]
+            vuelo.terminado.set()
+
+    def resumen(self):
+        with self._lock:
+            return {"ejecuciones": self.ejecuciones, "compartidas": self.compartidas, "en_vuelo": len(self._en_vuelo)}
+
+
+vuelo_lecturas = VueloUnico()
+
+
+def _valor_clave(valor):
+    return json.dumps(jsonable_encoder(valor), sort_keys=True, default=str)
+
+
+def _congelar(respuesta):
+    """Respuesta -> (estado, cuerpo, tipo, cabeceras) para poder dar una copia a cada petición"""
+    if not isinstance(respuesta, Response):
+        respuesta = RespuestaJSON(respuesta)
+    cabeceras = {
+        nombre: valor for nombre, valor in respuesta.headers.items()
+        if nombre not in ("content-length", "content-type")
+    }
+    return respuesta.status_code, respuesta.body, respuesta.media_type, cabeceras
+
+
+def compartir_lectura(sede):
+    """
+    Decorador para endpoints de lectura síncronos. `sede(kwargs)` devuelve la
+    sede consultada. Cada petición recibe su propio objeto Response (el
+    middleware de compresión modifica las cabeceras de la que envía).
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(**kwargs):
+            clave = (
+                funcion.__name__,
+                version_sede(bool(kwargs.get("test_mode")), int(sede(kwargs))),
+                tuple(sorted(
+                    (nombre, _valor_clave(valor)) for nombre, valor in kwargs.items()
+                    if nombre not in PARAMETROS_IGNORADOS
+                ))
+            )
+            estado, cuerpo, tipo, cabeceras = vuelo_lecturas.ejecutar(clave, lambda: _congelar(funcion(**kwargs)))
+            return Response(content=cuerpo, status_code=estado, media_type=tipo, headers=cabeceras)
+        return envoltura
+    return decorador